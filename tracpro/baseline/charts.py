@@ -6,7 +6,7 @@ import numpy
 
 from tracpro.charts.formatters import format_series, format_x_axis
 from tracpro.polls.utils import (
-    get_numeric_values, summarize_by_pollrun, overall_mean, overall_stdev)
+    summarize_by_pollrun, overall_mean, overall_stdev)
 
 
 def chart_baseline(baseline_term, filter_form, region, include_subregions):
@@ -83,9 +83,7 @@ def get_baseline_data(baseline_term, **kwargs):
     # The sum of the first answer from each contact.
     answers = answers.order_by('response__contact', 'submitted_on')
     answers = answers.distinct('response__contact')
-    numeric_values = get_numeric_values(answers.values_to_use())
-
-    baseline = numpy.sum(numeric_values)
+    baseline = numpy.sum(answers.numeric_values_to_use())
 
     responses = responses.distinct('contact')
     response_rate = round(100.0 * len(answers) / len(responses), 1) if responses else 0.0
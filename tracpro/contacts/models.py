@@ -79,6 +79,78 @@ class ContactManager(models.Manager.from_queryset(ContactQuerySet)):
         new_contact.groups = contact_groups
         return new_contact
 
+    def create_from_temba_many(self, org, temba_contacts):
+        """
+        Create contacts from Temba contacts with bulk inserts, along with
+        their cohorts and data field values.
+
+        Returns a list with the new contact for each Temba contact, or the
+        NoMatchingCohortsWarning or NoUsableURNWarning which prevented it
+        from being created.
+        """
+        temba_contacts = list(temba_contacts)
+        if not temba_contacts:
+            return []
+        results = {}
+
+        group_uuids = set(g.uuid for tc in temba_contacts for g in tc.groups)
+        regions = {r.uuid: r for r in Region.get_all(org).filter(uuid__in=group_uuids)}
+        groups = {g.uuid: g for g in Group.objects.filter(uuid__in=group_uuids)}
+
+        contacts = {}
+        for temba_contact in temba_contacts:
+            # Use the first Temba group that matches one of the org's Regions.
+            matching = [regions[g.uuid] for g in temba_contact.groups if g.uuid in regions]
+            if not matching:
+                results[temba_contact.uuid] = Contact.no_matching_cohorts(temba_contact)
+                continue
+            try:
+                urn = Contact.urn_from_temba(temba_contact)
+            except NoUsableURNWarning as e:
+                results[temba_contact.uuid] = e
+                continue
+            contacts[temba_contact.uuid] = Contact(
+                org=org,
+                name=temba_contact.name or "",
+                urn=urn,
+                region=min(matching, key=lambda r: r.name),
+                language=temba_contact.language,
+                uuid=temba_contact.uuid,
+                temba_modified_on=temba_contact.modified_on,
+            )
+
+        # Another sync may have created some of these contacts meanwhile.
+        existing = self.filter(org=org, uuid__in=contacts.keys()).select_related('region')
+        existing = {contact.uuid: contact for contact in existing}
+        results.update(existing)
+        self.bulk_create([c for uuid, c in contacts.items() if uuid not in existing])
+
+        created = self.filter(org=org, uuid__in=set(contacts).difference(existing))
+        created = {contact.uuid: contact for contact in created.select_related('region')}
+        results.update(created)
+
+        # Cohorts and data field values are usually set by post-save signals.
+        data_fields = {f.key: f for f in org.datafield_set.all()}
+        memberships = []
+        contact_fields = []
+        for temba_contact in temba_contacts:
+            contact = created.get(temba_contact.uuid)
+            if not contact:
+                continue
+            for group in temba_contact.groups:
+                if group.uuid in groups:
+                    memberships.append(Contact.groups.through(contact=contact, group=groups[group.uuid]))
+            for key, value in (temba_contact.fields or {}).items():
+                if key in data_fields:
+                    contact_field = ContactField(contact=contact, field=data_fields[key])
+                    # Remove empty strings for consistency with RapidPro.
+                    contact_field.set_value(value or None)
+                    contact_fields.append(contact_field)
+        Contact.groups.through.objects.bulk_create(memberships)
+        ContactField.objects.bulk_create(contact_fields)
+
+        return [results[temba_contact.uuid] for temba_contact in temba_contacts]
+
     def sync(self, org):
         try:
             region_uuids = set(get_uuids(Region.get_all(org)))
@@ -160,6 +232,8 @@ class Contact(models.Model):
     def __init__(self, *args, **kwargs):
         self._data_field_values = kwargs.pop('_data_field_values', None)
         super(Contact, self).__init__(*args, **kwargs)
+        # Remember what the contact's answers are rolled up by.
+        self._rollup_state = (self.__dict__.get('region_id'), self.__dict__.get('is_active'))
 
     def __str__(self):
         return self.name or self.get_urn()[1]
@@ -214,6 +288,39 @@ class Contact(models.Model):
             # NB: Contact.kwargs_from_temba can raise NoMatchingCohortsWarning
             return cls.objects.create(**cls.kwargs_from_temba(org, temba_contact))
 
+    @classmethod
+    def get_or_fetch_many(cls, org, uuids):
+        """Gets contacts by UUID.
+
+        Known contacts are loaded with a single query, and the others are
+        fetched from RapidPro and created in bulk.
+
+        Returns a dictionary mapping each UUID to its contact, or to the
+        NoContactInRapidProWarning, NoMatchingCohortsWarning or
+        NoUsableURNWarning which prevented it from being fetched.
+        """
+        uuids = set(uuids)
+        contacts = cls.objects.filter(org=org, uuid__in=uuids).select_related('region')
+        contacts = {contact.uuid: contact for contact in contacts}
+
+        missing = uuids.difference(contacts)
+        if missing:
+            client = get_client(org)
+            fetched = {}
+            for uuid in missing:
+                # The contacts endpoint filters by a single UUID only (of
+                # several, it uses the last), so they can't be fetched in
+                # batches. Unknown contacts are rare once contacts are synced.
+                temba_contacts = client.get_contacts(uuid=uuid)
+                if temba_contacts:
+                    fetched[uuid] = temba_contacts[0]
+                else:
+                    contacts[uuid] = NoContactInRapidProWarning("No contact in RapidPro with uuid=%s" % uuid)
+            created = cls.objects.create_from_temba_many(org, fetched.values())
+            contacts.update(zip(fetched.keys(), created))
+
+        return contacts
+
     def get_responses(self, include_empty=True):
         from tracpro.polls.models import Response
         qs = self.responses.filter(pollrun__poll__is_active=True, is_active=True)
@@ -243,11 +350,7 @@ class Contact(models.Model):
         region = _get_first(Region, temba_contact.groups)
 
         if not region:
-            raise NoMatchingCohortsWarning(
-                "Unable to save contact {c.name} ({c.uuid}) because none of "
-                "their RapidPro Groups match an active Panel for this org.".format(
-                    c=temba_contact,
-                ))
+            raise cls.no_matching_cohorts(temba_contact)
 
         # Make a list of groups that the Contact belongs to.
         # Use all the Temba groups that match a group (cohort) in Tracpro.
@@ -259,21 +362,7 @@ class Contact(models.Model):
         # cohorts, and will never even notice the other groups.
         groups = Group.objects.filter(uuid__in=get_uuids(temba_contact.groups))
 
-        # Use the first URN we know about the scheme of
-        urn = None
-        for u in temba_contact.urns:
-            scheme, value = u.split(':', 1)
-            if scheme in URN_SCHEME_LABELS:
-                urn = u
-                break  # it's a urn we can use
-        if urn is None:
-            raise NoUsableURNWarning(
-                "Unable to save contact {c.name} ({c.uuid}) because none of "
-                "their URNs ({c.urns}) are for schemes that tracpro supports ({schemes})".format(
-                    c=temba_contact,
-                    schemes=URN_SCHEME_LABELS.keys(),
-                )
-            )
+        urn = cls.urn_from_temba(temba_contact)
 
         kwargs = {
             'org': org,
@@ -291,6 +380,29 @@ class Contact(models.Model):
             kwargs['groups'] = list(Group.objects.filter(uuid__in=get_uuids(temba_contact.groups)))
         return kwargs
 
+    @classmethod
+    def urn_from_temba(cls, temba_contact):
+        """Return the first URN of the Temba contact with a scheme we know about."""
+        for urn in temba_contact.urns:
+            scheme, value = urn.split(':', 1)
+            if scheme in URN_SCHEME_LABELS:
+                return urn  # it's a urn we can use
+        raise NoUsableURNWarning(
+            "Unable to save contact {c.name} ({c.uuid}) because none of "
+            "their URNs ({c.urns}) are for schemes that tracpro supports ({schemes})".format(
+                c=temba_contact,
+                schemes=URN_SCHEME_LABELS.keys(),
+            )
+        )
+
+    @classmethod
+    def no_matching_cohorts(cls, temba_contact):
+        return NoMatchingCohortsWarning(
+            "Unable to save contact {c.name} ({c.uuid}) because none of "
+            "their RapidPro Groups match an active Panel for this org.".format(
+                c=temba_contact,
+            ))
+
     def push(self, change_type):
         push_contact_change.delay(self.pk, change_type)
 
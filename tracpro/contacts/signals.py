@@ -5,6 +5,7 @@ from django.dispatch import receiver
 
 from tracpro.client import get_client
 from tracpro.groups.models import Group
+from tracpro.polls.utils import bump_chart_data_version
 from .models import Contact, ContactField
 
 
@@ -64,3 +65,15 @@ def set_groups_to_new_contact(sender, instance, created, **kwargs):
         if instance._groups is not None:
             instance.groups = instance._groups
             del instance._groups
+
+
+@receiver(post_save, sender=Contact)
+def refresh_answer_rollups(sender, instance, created, **kwargs):
+    """Hook to re-aggregate a contact's answers when its region or activity changes."""
+    from tracpro.polls.models import AnswerRollup
+
+    state = (instance.region_id, instance.is_active)
+    if not created and state != instance._rollup_state:
+        AnswerRollup.objects.refresh_for_contacts([instance])
+        bump_chart_data_version(instance.org_id)
+    instance._rollup_state = state
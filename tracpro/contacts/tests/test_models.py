@@ -96,6 +96,45 @@ class ContactTest(TracProDataTest):
         contact = models.Contact.get_or_fetch(org=self.unicef, uuid='C-009')
         self.assertEqual(contact.name, "Mo Polls")
 
+    def test_get_or_fetch_many(self):
+        gender = factories.DataField(org=self.unicef, key='gender')
+
+        def get_contacts(uuid):
+            return {
+                'C-009': [TembaContact.create(
+                    uuid='C-009', name="Mo Polls", urns=['tel:123'],
+                    groups=[self.region1, self.group1], fields={'gender': 'M', 'age': '30'},
+                    language='eng', modified_on=timezone.now())],
+                'C-010': [TembaContact.create(
+                    uuid='C-010', name="No Panel", urns=['tel:456'],
+                    groups=[self.group1], fields={}, language='eng', modified_on=timezone.now())],
+                'C-011': [TembaContact.create(
+                    uuid='C-011', name="No URN", urns=['mailto:a@b.c'],
+                    groups=[self.region1], fields={}, language='eng', modified_on=timezone.now())],
+            }.get(uuid, [])
+        self.mock_temba_client.get_contacts.reset_mock()
+        self.mock_temba_client.get_contacts.side_effect = get_contacts
+
+        contacts = models.Contact.get_or_fetch_many(
+            self.unicef, ['C-001', 'C-009', 'C-010', 'C-011', 'C-012'])
+
+        self.assertEqual(contacts['C-001'], self.contact1)
+        self.assertIsInstance(contacts['C-010'], models.NoMatchingCohortsWarning)
+        self.assertIsInstance(contacts['C-011'], models.NoUsableURNWarning)
+        self.assertIsInstance(contacts['C-012'], models.NoContactInRapidProWarning)
+        # Only unknown contacts are fetched, without a second call for their groups.
+        self.assertEqual(self.mock_temba_client.get_contacts.call_count, 4)
+
+        contact = models.Contact.objects.get(org=self.unicef, uuid='C-009')
+        self.assertEqual(contacts['C-009'], contact)
+        self.assertEqual(contact.name, "Mo Polls")
+        self.assertEqual(contact.urn, 'tel:123')
+        self.assertEqual(contact.region, self.region1)
+        self.assertEqual(set(contact.groups.all()), set([self.group1, self.group5]))
+        self.assertEqual(contact.contactfield_set.get().field, gender)
+        self.assertEqual(contact.contactfield_set.get().get_value(), 'M')
+        self.assertFalse(models.Contact.objects.filter(uuid__in=['C-010', 'C-011', 'C-012']).exists())
+
     def test_kwargs_from_temba(self):
         modified_date = timezone.now()
         temba_contact = TembaContact.create(
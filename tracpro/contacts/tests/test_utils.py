@@ -1,5 +1,7 @@
 from __future__ import unicode_literals
 
+import mock
+
 from django.utils import timezone
 
 from temba_client.v2.types import Contact as TembaContact
@@ -239,3 +241,10 @@ class SyncPullTest(TracProDataTest):
         # of interest to us, and we should have marked it inactive.
         contact.refresh_from_db()
         self.assertFalse(contact.is_active)
+
+    def test_deactivated_contacts_bump_chart_data_version(self):
+        self.rapidpro_contacts_as_temba = self.rapidpro_contacts_as_temba[1:]
+        with mock.patch('tracpro.contacts.utils.bump_chart_data_version') as bump_chart_data_version:
+            sync_pull_contacts(
+                org=self.org, region_uuids=self.get_region_uuids(), group_uuids=self.get_group_uuids())
+        bump_chart_data_version.assert_called_once_with(self.org.pk)
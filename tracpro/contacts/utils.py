@@ -8,6 +8,7 @@ from temba_client.clients import TembaBadRequestError
 from temba_client.exceptions import TembaNoSuchObjectError
 
 from tracpro.client import get_client
+from tracpro.polls.utils import bump_chart_data_version
 from tracpro.utils import get_uuids
 
 
@@ -24,6 +25,7 @@ def sync_pull_contacts(org, region_uuids, group_uuids):
      and error/warning messages
     """
     from tracpro.contacts.models import Contact, NoMatchingCohortsWarning, NoUsableURNWarning
+    from tracpro.polls.models import AnswerRollup
 
     # get all remote contacts for the specified groups
     client = get_client(org)
@@ -126,14 +128,21 @@ def sync_pull_contacts(org, region_uuids, group_uuids):
     deleted_uuids += get_uuids(deleted_rapidpro_contacts)
 
     # Mark all deleted contacts as not active if they aren't already.
-    existing_contacts.filter(uuid__in=deleted_uuids, is_active=True).update(is_active=False)
+    deactivated = list(existing_contacts.filter(
+        uuid__in=deleted_uuids, is_active=True).values_list('pk', flat=True))
 
     # See if any of our existing contacts that are still active never showed
     # up from RapidPro, which could mean they were just edited so they no longer
     # belong to any of the groups we were using to sync.  Mark those inactive too.
     uuids_seen = set(created_uuids) | set(updated_uuids) | set(deleted_uuids) | set(failed_uuids)
-    Contact.objects.filter(org=org, is_active=True).exclude(uuid__in=uuids_seen).\
-        update(is_active=False)
+    deactivated.extend(Contact.objects.filter(org=org, is_active=True).exclude(
+        uuid__in=uuids_seen).values_list('pk', flat=True))
+
+    if deactivated:
+        Contact.objects.filter(pk__in=deactivated).update(is_active=False)
+        # Their answers no longer count towards the charts.
+        AnswerRollup.objects.refresh_for_contacts(deactivated)
+        bump_chart_data_version(org.pk)
 
     return (list(set(created_uuids)),
             list(set(updated_uuids)),
@@ -30,9 +30,8 @@ class ContactCRUDL(SmartCRUDL):
     class ContactBase(object):
 
         def get_queryset(self):
-            regions = self.request.user.get_all_regions(self.request.org)
             qs = super(ContactCRUDL.ContactBase, self).get_queryset()
-            qs = qs.by_org(self.request.org).by_regions(regions).active()
+            qs = qs.by_org(self.request.org).by_regions(self.request.user_region_ids).active()
             return qs
 
     class ContactFormMixin(object):
@@ -190,8 +189,8 @@ class ContactCRUDL(SmartCRUDL):
         def derive_queryset(self, **kwargs):
             qs = super(ContactCRUDL.List, self).derive_queryset(**kwargs)
             qs = qs.filter(org=self.request.org, is_active=True)
-            if self.request.data_regions is not None:
-                qs = qs.filter(region__in=self.request.data_regions)
+            if self.request.data_region_ids is not None:
+                qs = qs.filter(region__in=self.request.data_region_ids)
             return qs
 
     class Delete(OrgObjPermsMixin, ContactBase, SmartDeleteView):
@@ -0,0 +1,10 @@
+from __future__ import unicode_literals
+
+from django.apps import AppConfig
+
+
+class GroupsConfig(AppConfig):
+    name = "tracpro.groups"
+
+    def ready(self):
+        from . import signals  # noqa
@@ -1,10 +1,14 @@
-from __future__ import unicode_literals
+from __future__ import absolute_import, unicode_literals
+
+from .models import Region
 
 
 def show_subregions_toggle_form(request):
     show = False
     if request.region:
-        if any(c in request.user_regions for c in request.region.get_descendants()):
+        tree = Region.objects.get_tree(request.region.org_id)
+        subregion_ids = tree.get_descendant_ids(request.region.pk)
+        if set(subregion_ids).intersection(request.user_region_ids):
             show = True
     return {
         'show_subregions_toggle_form': show,
@@ -0,0 +1,95 @@
+"""
+Helpers for the GeoJSON geometries of boundaries.
+
+Geometries are simplified when boundaries are synced, so that maps can
+download boundaries at a level of detail that suits them rather than at
+full resolution.
+"""
+from __future__ import absolute_import, unicode_literals
+
+
+def simplify(geometry, tolerance):
+    """
+    Return the Polygon or MultiPolygon geometry simplified with the
+    Douglas-Peucker algorithm, so that no removed point is further than
+    `tolerance` (in degrees) from the simplified outline.
+
+    Holes which collapse are dropped, as are polygons which collapse, unless
+    all would be, in which case the geometry is returned unchanged. Other
+    types of geometry are returned unchanged.
+    """
+    if geometry.get('type') == 'Polygon':
+        polygon = _simplify_polygon(geometry['coordinates'], tolerance)
+        if polygon:
+            return {'type': 'Polygon', 'coordinates': polygon}
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = [_simplify_polygon(p, tolerance) for p in geometry['coordinates']]
+        polygons = [p for p in polygons if p]
+        if polygons:
+            return {'type': 'MultiPolygon', 'coordinates': polygons}
+    return geometry
+
+
+def get_bbox(geometry):
+    """Return the [west, south, east, north] bounds of the geometry, or None."""
+    points = list(_iter_points(geometry.get('coordinates')))
+    if not points:
+        return None
+    lngs = [point[0] for point in points]
+    lats = [point[1] for point in points]
+    return [min(lngs), min(lats), max(lngs), max(lats)]
+
+
+def _simplify_polygon(rings, tolerance):
+    """Return the simplified rings of the polygon, or None if its exterior collapses."""
+    simplified = []
+    for ring in rings:
+        ring = _simplify_line(ring, tolerance)
+        if len(ring) >= 4:  # A closed ring needs at least 3 distinct points.
+            simplified.append(ring)
+        elif not simplified:
+            return None
+    return simplified
+
+
+def _simplify_line(points, tolerance):
+    if len(points) < 3:
+        return points
+
+    # Iterative, since rings may have many thousands of points.
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        furthest, furthest_distance = None, 0
+        for index in range(start + 1, end):
+            distance = _segment_distance(points[index], points[start], points[end])
+            if distance > furthest_distance:
+                furthest, furthest_distance = index, distance
+        if furthest is not None and furthest_distance > tolerance:
+            keep[furthest] = True
+            stack.append((start, furthest))
+            stack.append((furthest, end))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _segment_distance(point, start, end):
+    """Return the distance from the point to the line segment from start to end."""
+    x, y = point[0], point[1]
+    x1, y1 = start[0], start[1]
+    dx, dy = end[0] - x1, end[1] - y1
+    if dx or dy:
+        t = max(0, min(1, ((x - x1) * dx + (y - y1) * dy) / float(dx * dx + dy * dy)))
+        x1, y1 = x1 + t * dx, y1 + t * dy
+    return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+
+
+def _iter_points(coordinates):
+    if isinstance(coordinates, (list, tuple)) and coordinates:
+        if isinstance(coordinates[0], (int, float)):
+            yield coordinates
+        else:
+            for item in coordinates:
+                for point in _iter_points(item):
+                    yield point
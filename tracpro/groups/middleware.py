@@ -1,46 +1,119 @@
 from __future__ import absolute_import, unicode_literals
 
+from django.core.cache import cache
+
+from .models import Region
+
+
+REGION_SCOPE_KEY = 'org:%d:user:%d:region_scope:%s:%s:%s:%s'
+REGION_SCOPE_TIMEOUT = 60 * 60 * 24
+
 
 class UserRegionsMiddleware(object):
 
     def process_request(self, request):
         """Store commonly-used region variables on the request."""
-        self.set_user_regions(request)
         self.set_include_subregions(request)
-        self.set_region(request)
-        self.set_data_regions(request)
-
-    def set_user_regions(self, request):
-        # Determine the org regions the user has access to.
-        if request.org and request.user.is_authenticated():
-            request.user_regions = request.user.get_all_regions(request.org)
-        else:
-            request.user_regions = None
+        scope = self.get_region_scope(request)
+        self.set_user_regions(request, scope)
+        self.set_region(request, scope)
+        self.set_data_regions(request, scope)
 
     def set_include_subregions(self, request):
         # Whether or not sub-region data should be included.
         request.include_subregions = request.session.get('include_subregions', True)
 
-    def set_region(self, request):
+    def get_region_scope(self, request):
+        """
+        Return the ids of the org regions the user has access to, of the
+        currently-active region and of the regions to retrieve data for.
+
+        The scope is cached until the user's access or the org's regions
+        change, so most requests only need to look up the current region.
+        """
+        if not (request.org and request.user.is_authenticated()):
+            return None
+
+        org, user = request.org, request.user
+        session_region_id = request.session.get('{org}:region_id'.format(org=org.pk))
+        key = REGION_SCOPE_KEY % (
+            org.pk, user.pk, session_region_id, request.include_subregions,
+            Region.objects.get_tree_version(org.pk),
+            Region.objects.get_user_regions_version(user.pk))
+        scope = cache.get(key)
+        if scope is None:
+            scope = self.calculate_region_scope(
+                org, user, session_region_id, request.include_subregions)
+            cache.set(key, scope, timeout=REGION_SCOPE_TIMEOUT)
+        return scope
+
+    def calculate_region_scope(self, org, user, session_region_id, include_subregions):
+        tree = Region.objects.get_tree(org.pk)
+        is_admin = user.is_admin_for(org)
+
+        # Determine the org regions the user has access to, in tree order.
+        if is_admin:
+            # org admins have implicit access to all regions
+            direct_ids = set(tree.nodes)
+        else:
+            direct_ids = set(user.regions.values_list('pk', flat=True))
+        access_ids = set()
+        for pk in direct_ids:
+            if pk in tree and tree.nodes[pk].is_active:
+                access_ids.update(tree.get_descendant_ids(pk, include_self=True))
+        user_region_ids = self._tree_order(tree, [
+            pk for pk in access_ids if tree.nodes[pk].is_active])
+
         # Find the currently-active region.
-        if request.org and request.user.is_authenticated():
-            region_id = request.session.get(
-                '{org}:region_id'.format(org=request.org.pk))
-            region = request.user_regions.filter(pk=region_id).first()
-            if not region and not request.user.is_admin_for(request.org):
-                # Only org admins may see "All Regions".
-                region = request.user_regions.first()
-            request.region = region
+        try:
+            region_id = int(session_region_id)
+        except (TypeError, ValueError):
+            region_id = None
+        if region_id not in user_region_ids:
+            # Only org admins may see "All Regions".
+            region_id = None if is_admin or not user_region_ids else user_region_ids[0]
+
+        # Calculate which org regions to retrieve data for.
+        if region_id is None:
+            data_region_ids = None
+        elif include_subregions:
+            data_region_ids = [
+                pk for pk in tree.get_descendant_ids(region_id, include_self=True)
+                if pk in access_ids and tree.nodes[pk].is_active]
+            data_region_ids = self._tree_order(tree, data_region_ids)
+        else:
+            data_region_ids = [region_id]
+
+        return {
+            'user_region_ids': user_region_ids,
+            'region_id': region_id,
+            'data_region_ids': data_region_ids,
+        }
+
+    def set_user_regions(self, request, scope):
+        if scope is not None:
+            request.user_region_ids = scope['user_region_ids']
+            request.user_regions = self._get_regions(scope['user_region_ids'])
+        else:
+            request.user_region_ids = None
+            request.user_regions = None
+
+    def set_region(self, request, scope):
+        if scope is not None and scope['region_id'] is not None:
+            request.region = Region.objects.filter(pk=scope['region_id']).first()
         else:
             request.region = None
 
-    def set_data_regions(self, request):
-        # Calculate which org regions to retrieve data for.
-        if request.region:
-            if request.include_subregions:
-                request.data_regions = request.region.get_descendants(include_self=True)
-                request.data_regions = request.data_regions.filter(pk__in=request.user_regions)
-            else:
-                request.data_regions = [request.region]
+    def set_data_regions(self, request, scope):
+        if scope is not None and scope['data_region_ids'] is not None:
+            request.data_region_ids = scope['data_region_ids']
+            request.data_regions = self._get_regions(scope['data_region_ids'])
         else:
+            request.data_region_ids = None
             request.data_regions = None
+
+    def _get_regions(self, ids):
+        return Region.objects.filter(pk__in=ids).order_by('tree_id', 'lft')
+
+    def _tree_order(self, tree, ids):
+        return sorted(ids, key=lambda pk: (tree.nodes[pk].tree_id, tree.nodes[pk].lft))
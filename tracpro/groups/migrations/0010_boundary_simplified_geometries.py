@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0009_auto_20170307_1338'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boundary',
+            name='bbox',
+            field=models.CharField(help_text='The [west, south, east, north] bounds of this boundary, as JSON.', max_length=255, verbose_name='bounding box', blank=True),
+        ),
+        migrations.AddField(
+            model_name='boundary',
+            name='geometry_high',
+            field=models.TextField(help_text='The GeoJSON geometry of this boundary, at high detail.', verbose_name='high detail geojson', blank=True),
+        ),
+        migrations.AddField(
+            model_name='boundary',
+            name='geometry_low',
+            field=models.TextField(help_text='The GeoJSON geometry of this boundary, at low detail.', verbose_name='low detail geojson', blank=True),
+        ),
+        migrations.AddField(
+            model_name='boundary',
+            name='geometry_medium',
+            field=models.TextField(help_text='The GeoJSON geometry of this boundary, at medium detail.', verbose_name='medium detail geojson', blank=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import migrations
+
+from tracpro.groups.geometry import get_bbox, simplify
+
+
+SIMPLIFY_TOLERANCES = (
+    ('low', 0.01),
+    ('medium', 0.001),
+    ('high', 0.0001),
+)
+
+
+def simplify_geometries(apps, schema_editor):
+    Boundary = apps.get_model('groups', 'Boundary')
+    for boundary in Boundary.objects.iterator():
+        try:
+            geometry = json.loads(boundary.geometry)
+        except ValueError:
+            continue
+        if not isinstance(geometry, dict):
+            continue
+        for detail, tolerance in SIMPLIFY_TOLERANCES:
+            setattr(boundary, 'geometry_{}'.format(detail), json.dumps(simplify(geometry, tolerance)))
+        bbox = get_bbox(geometry)
+        boundary.bbox = json.dumps(bbox) if bbox else ""
+        boundary.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0010_boundary_simplified_geometries'),
+    ]
+
+    operations = [
+        migrations.RunPython(simplify_geometries, migrations.RunPython.noop),
+    ]
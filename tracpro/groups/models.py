@@ -1,5 +1,6 @@
 from __future__ import absolute_import, unicode_literals
 
+from collections import namedtuple
 import json
 from operator import attrgetter
 
@@ -8,15 +9,32 @@ from dateutil.relativedelta import relativedelta
 from mptt import models as mptt
 
 from django.conf import settings
-from django.db import models, transaction
+from django.core.cache import cache
+from django.db import connection, models, transaction
 from django.db.models import Count
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
 from tracpro.client import get_client
+from tracpro.polls.utils import bump_chart_data_version
+from tracpro.utils import bump_cache_version, call_after_transaction, get_cache_version
 from tracpro.contacts.tasks import SyncOrgContacts
 
+from .geometry import get_bbox, simplify
+
+
+BOUNDARIES_VERSION_KEY = 'org:%d:boundaries_version'
+
+REGION_TREE_VERSION_KEY = 'org:%d:region_tree_version'
+REGION_TREE_KEY = 'org:%d:region_tree:%s'
+REGION_TREE_TIMEOUT = 60 * 60 * 24 * 7
+
+USER_REGIONS_VERSION_KEY = 'user:%d:regions_version'
+
+# The latest region tree of each org loaded by this process.
+_region_trees = {}
+
 
 @python_2_unicode_compatible
 class AbstractGroup(models.Model):
@@ -125,6 +143,111 @@ class AbstractGroup(models.Model):
         return self.contacts.filter(is_active=True)
 
 
+RegionNode = namedtuple('RegionNode', ['pk', 'parent_id', 'tree_id', 'lft', 'rght', 'is_active', 'boundary_id'])
+
+
+class RegionTree(object):
+    """
+    A snapshot of the hierarchy of an org's regions, which answers ancestor
+    and descendant lookups without querying the database.
+
+    Relations are followed by parent rather than by tree interval, as the
+    tree ids of an org's root regions change when other orgs' root regions
+    are inserted before them.
+    """
+
+    def __init__(self, version, nodes):
+        self.version = version
+        self.nodes = {node.pk: node for node in nodes}
+        self.children = {}
+        for node in sorted(nodes, key=attrgetter('tree_id', 'lft')):
+            self.children.setdefault(node.parent_id, []).append(node.pk)
+
+    def __contains__(self, region_id):
+        return region_id in self.nodes
+
+    def get_ancestor_ids(self, region_id, include_self=False):
+        """Return the ids of the region's ancestors, from the root down."""
+        ancestor_ids = []
+        node = self.nodes.get(region_id)
+        if node and include_self:
+            ancestor_ids.append(node.pk)
+        while node and node.parent_id:
+            node = self.nodes.get(node.parent_id)
+            if node:
+                ancestor_ids.append(node.pk)
+        ancestor_ids.reverse()
+        return ancestor_ids
+
+    def get_descendant_ids(self, region_id, include_self=False):
+        """Return the ids of the region's descendants, in tree order."""
+        if region_id not in self.nodes:
+            return []
+        descendant_ids = []
+        stack = [region_id] if include_self else list(reversed(self.children.get(region_id, [])))
+        while stack:
+            pk = stack.pop()
+            descendant_ids.append(pk)
+            stack.extend(reversed(self.children.get(pk, [])))
+        return descendant_ids
+
+    def is_ancestor_of(self, ancestor_id, region_id, include_self=False):
+        """Return whether the first region is an ancestor of the second."""
+        return ancestor_id in self.get_ancestor_ids(region_id, include_self)
+
+
+class RegionManager(mptt.TreeManager):
+
+    def get_tree(self, org_id):
+        """
+        Return the snapshot of the org's region hierarchy. Snapshots are
+        kept in the cache and by each process until the tree version changes.
+        """
+        tree = _region_trees.get(org_id)
+        version = cache.get(REGION_TREE_VERSION_KEY % org_id)
+        if tree is not None and version is not None and tree.version == version:
+            return tree
+
+        # Without a cached version, a snapshot held by this process may be stale.
+        version = version or self.get_tree_version(org_id)
+        key = REGION_TREE_KEY % (org_id, version)
+        nodes = cache.get(key)
+        if nodes is None:
+            nodes = [RegionNode(*values) for values in self.filter(org_id=org_id).values_list(
+                'pk', 'parent_id', 'tree_id', 'lft', 'rght', 'is_active', 'boundary_id')]
+            cache.set(key, nodes, timeout=REGION_TREE_TIMEOUT)
+        tree = _region_trees[org_id] = RegionTree(version, nodes)
+        return tree
+
+    def get_tree_version(self, org_id):
+        """Return the current version of the org's region tree."""
+        return get_cache_version(REGION_TREE_VERSION_KEY % org_id)
+
+    def bump_tree_version(self, org_id):
+        """Invalidate the snapshots of the org's region tree."""
+        self._bump_tree_version(org_id)
+        if connection.in_atomic_block:
+            # Until the transaction commits, other requests still load the
+            # old tree, and would cache it under the new version.
+            call_after_transaction(self._bump_tree_version, org_id)
+
+    def _bump_tree_version(self, org_id):
+        _region_trees.pop(org_id, None)
+        bump_cache_version(REGION_TREE_VERSION_KEY % org_id)
+        # Charts show the regions' names and boundaries, and which regions'
+        # responses they include depends on the hierarchy.
+        bump_chart_data_version(org_id)
+
+    def get_user_regions_version(self, user_id):
+        """Return the current version of the user's region access."""
+        return get_cache_version(USER_REGIONS_VERSION_KEY % user_id)
+
+    def bump_user_regions_version(self, user_ids):
+        """Invalidate anything cached from the users' region access."""
+        for user_id in user_ids:
+            bump_cache_version(USER_REGIONS_VERSION_KEY % user_id)
+
+
 class Region(mptt.MPTTModel, AbstractGroup):
     """
     *In the user interface, this is now named a "Panel"*
@@ -148,16 +271,20 @@ class Region(mptt.MPTTModel, AbstractGroup):
     class Meta:
         verbose_name = 'panel'
 
+    objects = RegionManager()
+
     class MPTTMeta:
         order_insertion_by = ['name']
 
+    def save(self, *args, **kwargs):
+        super(Region, self).save(*args, **kwargs)
+        # Includes deactivation, which moves the region out of the tree.
+        Region.objects.bump_tree_version(self.org_id)
+
     @transaction.atomic
     def deactivate(self):
         # Make this region's parent the parent of all of its children.
-        with Region.objects.disable_mptt_updates():
-            for child in self.get_children():
-                child.parent = self.parent
-                child.save()
+        Region.objects.filter(parent=self).update(parent=self.parent)
         Region.objects.rebuild()
 
         # Move this node out of the tree.
@@ -174,6 +301,7 @@ class Region(mptt.MPTTModel, AbstractGroup):
         """Rebuild the tree hierarchy after new nodes are added."""
         super(Region, cls).sync_with_temba(org, uuids)
         Region.objects.rebuild()
+        Region.objects.bump_tree_version(org.pk)
 
 
 class Group(AbstractGroup):
@@ -205,7 +333,7 @@ class BoundaryManager(models.Manager.from_queryset(BoundaryQuerySet)):
         boundary, _ = self.get_or_create(org=org, rapidpro_uuid=temba_boundary.osm_id)
         boundary.name = temba_boundary.name
         boundary.level = temba_boundary.level
-        boundary.geometry = json.dumps(temba_boundary.geometry.serialize())
+        boundary.set_geometry(temba_boundary.geometry.serialize())
         boundary.parent = self.filter(org=org, rapidpro_uuid=temba_boundary.parent).first()
         boundary.save()
         return boundary
@@ -228,6 +356,16 @@ class BoundaryManager(models.Manager.from_queryset(BoundaryQuerySet)):
         for temba_boundary in temba_boundaries:
             Boundary.objects.from_temba(org, temba_boundary)
 
+        self.bump_cache_version(org)
+
+    def get_cache_version(self, org):
+        """Return the current version of the org's cached boundary data."""
+        return get_cache_version(BOUNDARIES_VERSION_KEY % org.pk)
+
+    def bump_cache_version(self, org):
+        """Invalidate the org's cached boundary data."""
+        bump_cache_version(BOUNDARIES_VERSION_KEY % org.pk)
+
 
 class Boundary(models.Model):
     """Corresponds with a RapidPro AdminBoundary."""
@@ -241,6 +379,17 @@ class Boundary(models.Model):
         (LEVEL_DISTRICT, _("District")),
     )
 
+    DETAIL_LOW = 'low'
+    DETAIL_MEDIUM = 'medium'
+    DETAIL_HIGH = 'high'
+    DETAIL_FULL = 'full'
+    # Geometries are simplified to within these distances, in degrees.
+    SIMPLIFY_TOLERANCES = (
+        (DETAIL_LOW, 0.01),
+        (DETAIL_MEDIUM, 0.001),
+        (DETAIL_HIGH, 0.0001),
+    )
+
     org = models.ForeignKey(
         'orgs.Org',
         verbose_name=_("org"))
@@ -265,6 +414,23 @@ class Boundary(models.Model):
     geometry = models.TextField(
         help_text=_("The GeoJSON geometry of this boundary."),
         verbose_name=_("geojson"))
+    geometry_low = models.TextField(
+        blank=True,
+        help_text=_("The GeoJSON geometry of this boundary, at low detail."),
+        verbose_name=_("low detail geojson"))
+    geometry_medium = models.TextField(
+        blank=True,
+        help_text=_("The GeoJSON geometry of this boundary, at medium detail."),
+        verbose_name=_("medium detail geojson"))
+    geometry_high = models.TextField(
+        blank=True,
+        help_text=_("The GeoJSON geometry of this boundary, at high detail."),
+        verbose_name=_("high detail geojson"))
+    bbox = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text=_("The [west, south, east, north] bounds of this boundary, as JSON."),
+        verbose_name=_("bounding box"))
 
     objects = BoundaryManager()
 
@@ -276,15 +442,35 @@ class Boundary(models.Model):
     def __str__(self):
         return self.name
 
-    def as_geojson(self):
+    def as_geojson(self, detail=DETAIL_FULL):
+        """
+        Return the boundary as a GeoJSON feature, with its geometry at the
+        given level of detail if it has been simplified.
+        """
         if not hasattr(self, '_geojson'):
-            self._geojson = {
+            self._geojson = {}
+        if detail not in self._geojson:
+            geometry = self.geometry
+            if detail != self.DETAIL_FULL:
+                geometry = getattr(self, 'geometry_{}'.format(detail)) or geometry
+            self._geojson[detail] = {
                 'type': "Feature",
-                'geometry': json.loads(self.geometry),
+                'geometry': json.loads(geometry),
                 'properties': {
                     'id': self.id,
                     'level': self.level,
                     'name': self.name,
                 },
             }
-        return self._geojson
+            if self.bbox:
+                self._geojson[detail]['bbox'] = json.loads(self.bbox)
+        return self._geojson[detail]
+
+    def set_geometry(self, geometry):
+        """Set the GeoJSON geometry, with its simplified versions and bounds."""
+        self.geometry = json.dumps(geometry)
+        for detail, tolerance in self.SIMPLIFY_TOLERANCES:
+            setattr(self, 'geometry_{}'.format(detail), json.dumps(simplify(geometry, tolerance)))
+        bbox = get_bbox(geometry)
+        self.bbox = json.dumps(bbox) if bbox else ""
+        self.__dict__.pop('_geojson', None)
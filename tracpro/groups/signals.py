@@ -0,0 +1,36 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from dash.orgs.models import Org
+
+from .models import Region
+
+
+def _bump_changed_users(instance, action, reverse, pk_set, users_attr):
+    """Bump the region access version of the users whose relation changed."""
+    if reverse:
+        # The relation was changed from the user's side.
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Region.objects.bump_user_regions_version([instance.pk])
+    elif action == 'pre_clear':
+        # The cleared users are only known beforehand.
+        users = getattr(instance, users_attr)
+        instance._cleared_user_ids = list(users.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        Region.objects.bump_user_regions_version(instance.__dict__.pop('_cleared_user_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        Region.objects.bump_user_regions_version(pk_set)
+
+
+@receiver(m2m_changed, sender=Region.users.through)
+def bump_region_users(sender, instance, action, reverse, pk_set, **kwargs):
+    """Hook to invalidate the cached region access of users given or denied a region."""
+    _bump_changed_users(instance, action, reverse, pk_set, 'users')
+
+
+@receiver(m2m_changed, sender=Org.administrators.through)
+def bump_org_administrators(sender, instance, action, reverse, pk_set, **kwargs):
+    """Hook to invalidate the cached region access of users made or unmade org admins."""
+    _bump_changed_users(instance, action, reverse, pk_set, 'administrators')
@@ -0,0 +1,51 @@
+from __future__ import unicode_literals
+
+from tracpro.test.cases import TracProTest
+
+from .. import geometry
+
+
+# A square with extra points just off its edges.
+SQUARE = [[0, 0], [0.5, 0.001], [1, 0], [1, 1], [0.5, 1.001], [0, 1], [0, 0]]
+
+HOLE = [[0.4, 0.4], [0.41, 0.4], [0.41, 0.41], [0.4, 0.4]]
+
+
+class TestSimplify(TracProTest):
+
+    def test_polygon(self):
+        polygon = {'type': 'Polygon', 'coordinates': [SQUARE]}
+        self.assertEqual(geometry.simplify(polygon, 0.01), {
+            'type': 'Polygon',
+            'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]],
+        })
+        # Points further than the tolerance are kept.
+        self.assertEqual(geometry.simplify(polygon, 0.0001), polygon)
+
+    def test_collapsed_holes_dropped(self):
+        polygon = {'type': 'Polygon', 'coordinates': [SQUARE, HOLE]}
+        self.assertEqual(len(geometry.simplify(polygon, 0.001)['coordinates']), 2)
+        self.assertEqual(len(geometry.simplify(polygon, 0.1)['coordinates']), 1)
+
+    def test_multipolygon(self):
+        multipolygon = {'type': 'MultiPolygon', 'coordinates': [[SQUARE], [HOLE]]}
+        self.assertEqual(geometry.simplify(multipolygon, 0.1), {
+            'type': 'MultiPolygon',
+            'coordinates': [[[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]],
+        })
+
+        # Polygons are kept unchanged rather than all collapsing.
+        multipolygon = {'type': 'MultiPolygon', 'coordinates': [[HOLE]]}
+        self.assertEqual(geometry.simplify(multipolygon, 0.1), multipolygon)
+
+    def test_other_types_unchanged(self):
+        point = {'type': 'Point', 'coordinates': [1, 2]}
+        self.assertEqual(geometry.simplify(point, 0.1), point)
+
+
+class TestGetBbox(TracProTest):
+
+    def test_get_bbox(self):
+        multipolygon = {'type': 'MultiPolygon', 'coordinates': [[SQUARE], [[[2, -1], [3, 0], [2, 0], [2, -1]]]]}
+        self.assertEqual(geometry.get_bbox(multipolygon), [0, -1, 3, 1.001])
+        self.assertIsNone(geometry.get_bbox({'type': 'Polygon', 'coordinates': []}))
@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 
 from django.contrib.auth.models import AnonymousUser
 from django.test import RequestFactory
+from django.test.utils import override_settings
 
 from tracpro.test import factories
 from tracpro.test.cases import TracProTest
@@ -18,9 +19,12 @@ class TestUserRegionsMiddleware(TracProTest):
         self.org = factories.Org()
         self.user = factories.User()
 
-    def get_request(self, **kwargs):
+    def get_request(self, region=None, **kwargs):
         request_kwargs = {'HTTP_HOST': "{}.testserver".format(self.org.subdomain)}
         request = RequestFactory().get("/", **request_kwargs)
+        request.session = {}
+        if region is not None:
+            request.session['{org}:region_id'.format(org=self.org.pk)] = str(region.pk)
         for key, value in kwargs.items():
             setattr(request, key, value)
         return request
@@ -50,38 +54,69 @@ class TestUserRegionsMiddleware(TracProTest):
 
     def test_variables_set(self):
         """Middleware should set several commonly-used region variables."""
-        request = self.get_request(user=self.user, org=self.org, session={})
+        request = self.get_request(user=self.user, org=self.org)
         self.middleware.process_request(request)
         self.assertTrue(hasattr(request, 'region'))
         self.assertTrue(hasattr(request, 'include_subregions'))
         self.assertTrue(hasattr(request, 'user_regions'))
+        self.assertTrue(hasattr(request, 'user_region_ids'))
         self.assertTrue(hasattr(request, 'data_regions'))
+        self.assertTrue(hasattr(request, 'data_region_ids'))
 
     def test_user_regions__unauthenticated(self):
         """User regions should be set to null for unauthenticated users."""
         request = self.get_request(user=AnonymousUser(), org=self.org)
-        self.middleware.set_user_regions(request)
+        self.middleware.process_request(request)
         self.assertIsNone(request.user_regions)
+        self.assertIsNone(request.user_region_ids)
 
     def test_user_regions__no_org(self):
         """User regions should be set to null for non-org views."""
         request = self.get_request(user=self.user, org=None)
-        self.middleware.set_user_regions(request)
+        self.middleware.process_request(request)
         self.assertIsNone(request.user_regions)
+        self.assertIsNone(request.user_region_ids)
 
     def test_user_regions(self):
-        """User regions should be set to the value of get_all_regions."""
+        """User regions should be the active regions the user has access to."""
         self.make_regions()
         self.region_kenya.users.add(self.user)
         request = self.get_request(user=self.user, org=self.org)
-        self.middleware.set_user_regions(request)
+        self.middleware.process_request(request)
         self.assertEqual(
             set(request.user_regions),
             set([self.region_kenya, self.region_nairobi, self.region_mombasa]))
+        self.assertEqual(
+            set(request.user_region_ids),
+            set([self.region_kenya.pk, self.region_nairobi.pk, self.region_mombasa.pk]))
+        self.assertEqual(
+            set(request.user_regions),
+            set(self.user.get_all_regions(self.org)))
+
+    def test_user_regions__admin(self):
+        """Org admins should have access to all active regions, in tree order."""
+        regions = self.make_regions()
+        self.org.administrators.add(self.user)
+        request = self.get_request(user=self.user, org=self.org)
+        self.middleware.process_request(request)
+        self.assertEqual(
+            request.user_region_ids,
+            list(regions.order_by('tree_id', 'lft').values_list('pk', flat=True)))
+
+    def test_user_regions__other_org(self):
+        """Regions of other orgs should not be included."""
+        self.make_regions()
+        self.region_kenya.users.add(self.user)
+        factories.Region(org=factories.Org()).users.add(self.user)
+        request = self.get_request(user=self.user, org=self.org)
+        self.middleware.process_request(request)
+        self.assertEqual(
+            set(request.user_region_ids),
+            set([self.region_kenya.pk, self.region_nairobi.pk, self.region_mombasa.pk]))
 
     def test_include_subregions__default(self):
         """If key is not in the session, should default to True."""
-        request = self.get_request(session={})
+        request = self.get_request()
         self.middleware.set_include_subregions(request)
         self.assertTrue(request.include_subregions)
 
@@ -99,83 +134,116 @@ class TestUserRegionsMiddleware(TracProTest):
 
     def test_data_regions__no_region(self):
         """If there is no current region, data_regions should be None."""
-        request = self.get_request(user=self.user, region=None)
-        self.middleware.set_data_regions(request)
+        self.make_regions()
+        self.org.administrators.add(self.user)
+        request = self.get_request(user=self.user, org=self.org)
+        self.middleware.process_request(request)
         self.assertIsNone(request.data_regions)
+        self.assertIsNone(request.data_region_ids)
 
     def test_data_regions__include_subregions(self):
-        """Include all subregions user has access to if include_subregions is True."""
+        """Include all active subregions user has access to if include_subregions is True."""
         self.make_regions()
-        user_regions = Region.objects.filter(pk__in=(
-            self.region_uganda.pk, self.region_kenya.pk, self.region_nairobi.pk))
-        request = self.get_request(
-            user=self.user, region=self.region_kenya, include_subregions=True,
-            user_regions=user_regions)
-        self.middleware.set_data_regions(request)
+        self.region_uganda.users.add(self.user)
+        self.region_kenya.users.add(self.user)
+        request = self.get_request(user=self.user, org=self.org, region=self.region_kenya)
+        request.session['include_subregions'] = True
+        self.middleware.process_request(request)
         self.assertEqual(
             set(request.data_regions),
-            set([self.region_kenya, self.region_nairobi]))
+            set([self.region_kenya, self.region_nairobi, self.region_mombasa]))
+        self.assertEqual(request.data_region_ids[0], self.region_kenya.pk)
 
     def test_data_regions__exclude_subregions(self):
         """Include only the current region if include_subregions is False."""
         self.make_regions()
-        user_regions = Region.objects.filter(pk__in=(
-            self.region_uganda.pk, self.region_kenya.pk, self.region_nairobi.pk))
-        request = self.get_request(
-            user=self.user, region=self.region_kenya, include_subregions=False,
-            user_regions=user_regions)
-        self.middleware.set_data_regions(request)
-        self.assertEqual(
-            set(request.data_regions),
-            set([self.region_kenya]))
+        self.region_uganda.users.add(self.user)
+        self.region_kenya.users.add(self.user)
+        request = self.get_request(user=self.user, org=self.org, region=self.region_kenya)
+        request.session['include_subregions'] = False
+        self.middleware.process_request(request)
+        self.assertEqual(set(request.data_regions), set([self.region_kenya]))
+        self.assertEqual(request.data_region_ids, [self.region_kenya.pk])
 
     def test_region__unauthenticated(self):
         """Current region should be None for an unauthenticated user."""
         request = self.get_request(user=AnonymousUser(), org=self.org)
-        self.middleware.set_region(request)
+        self.middleware.process_request(request)
         self.assertIsNone(request.region)
 
     def test_region__no_org(self):
         """Current region should be None if there is no current org."""
         request = self.get_request(user=self.user, org=None)
-        self.middleware.set_region(request)
+        self.middleware.process_request(request)
         self.assertIsNone(request.region)
 
     def test_region__not_set__admin(self):
         """If region_id is not in the session, admin will see All Regions."""
         self.make_regions()
         self.org.administrators.add(self.user)
-        user_regions = Region.objects.filter(pk__in=(
-            self.region_uganda.pk, self.region_kenya.pk, self.region_nairobi.pk))
-        request = self.get_request(
-            user=self.user, org=self.org, session={}, user_regions=user_regions)
-        self.middleware.set_region(request)
+        request = self.get_request(user=self.user, org=self.org)
+        self.middleware.process_request(request)
         self.assertIsNone(request.region)
 
     def test_region__not_set(self):
         """If region_id is not in the session, user will see first of their regions."""
         self.make_regions()
-        user_regions = Region.objects.filter(pk=self.region_kenya.pk)
-        request = self.get_request(
-            user=self.user, org=self.org, session={}, user_regions=user_regions)
-        self.middleware.set_region(request)
+        self.region_kenya.users.add(self.user)
+        request = self.get_request(user=self.user, org=self.org)
+        self.middleware.process_request(request)
         self.assertEqual(request.region, self.region_kenya)
 
     def test_region__not_in_user_regions(self):
         """If region is not in user regions, return the first of the user's regions."""
         self.make_regions()
-        user_regions = Region.objects.filter(pk=self.region_kenya.pk)
-        request = self.get_request(
-            user=self.user, org=self.org, session={'region_id': self.region_nairobi.pk},
-            user_regions=user_regions)
-        self.middleware.set_region(request)
+        self.region_kenya.users.add(self.user)
+        request = self.get_request(user=self.user, org=self.org, region=self.region_uganda)
+        self.middleware.process_request(request)
         self.assertEqual(request.region, self.region_kenya)
 
     def test_region(self):
         self.make_regions()
-        user_regions = Region.objects.filter(pk=self.region_kenya.pk)
-        request = self.get_request(
-            user=self.user, org=self.org, session={'region_id': self.region_kenya.pk},
-            user_regions=user_regions)
-        self.middleware.set_region(request)
-        self.assertEqual(request.region, self.region_kenya)
+        self.region_kenya.users.add(self.user)
+        request = self.get_request(user=self.user, org=self.org, region=self.region_nairobi)
+        self.middleware.process_request(request)
+        self.assertEqual(request.region, self.region_nairobi)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_region_scope__cached(self):
+        """The scope is reused until the user's access or the org's regions change."""
+        self.make_regions()
+        self.region_kenya.users.add(self.user)
+        self.middleware.process_request(self.get_request(user=self.user, org=self.org))
+
+        # Only the current region is fetched.
+        request = self.get_request(user=self.user, org=self.org)
+        with self.assertNumQueries(1):
+            self.middleware.process_request(request)
+            self.assertEqual(request.region, self.region_kenya)
+
+        # Access is re-calculated when the user is given another region.
+        self.region_uganda.users.add(self.user)
+        request = self.get_request(user=self.user, org=self.org)
+        self.middleware.process_request(request)
+        self.assertIn(self.region_entebbe.pk, request.user_region_ids)
+
+        # ... or when the user is made an org admin.
+        self.org.administrators.add(self.user)
+        request = self.get_request(user=self.user, org=self.org)
+        self.middleware.process_request(request)
+        self.assertIsNone(request.region)
+        self.user.org_admins.remove(self.org)
+
+        # ... or when regions are changed.
+        self.user.regions.clear()
+        self.region_kenya.users.add(self.user)
+        factories.Region(org=self.org, name="Garissa", parent=self.region_kenya)
+        request = self.get_request(user=self.user, org=self.org, region=self.region_kenya)
+        self.middleware.process_request(request)
+        self.assertEqual(len(request.data_region_ids), 4)
+
+        self.region_nairobi.deactivate()
+        request = self.get_request(user=self.user, org=self.org, region=self.region_kenya)
+        self.middleware.process_request(request)
+        self.assertEqual(len(request.data_region_ids), 3)
+        self.assertNotIn(self.region_nairobi.pk, request.user_region_ids)
@@ -1,10 +1,17 @@
 from __future__ import unicode_literals
 
+import json
+
+import mock
+
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TransactionTestCase
 from django.test.utils import override_settings
 
-from temba_client.v2.types import Group as TembaGroup
+from temba_client.v2.types import Boundary as TembaBoundary, Group as TembaGroup
 
+from tracpro.polls.utils import get_chart_data_version
 from tracpro.test import factories
 from tracpro.test.cases import TracProDataTest, TracProTest
 
@@ -72,6 +79,54 @@ class TestRegion(TracProTest):
             self.makerere,
         ]))
 
+    def test_get_tree(self):
+        """The region tree matches the hierarchy of the org's regions."""
+        tree = models.Region.objects.get_tree(self.org.pk)
+        for region in models.Region.objects.filter(org=self.org):
+            self.assertEqual(
+                tree.get_ancestor_ids(region.pk, include_self=True),
+                [r.pk for r in region.get_ancestors(include_self=True)])
+            self.assertEqual(
+                tree.get_descendant_ids(region.pk, include_self=True),
+                [r.pk for r in region.get_descendants(include_self=True)])
+        self.assertTrue(tree.is_ancestor_of(self.uganda.pk, self.makerere.pk))
+        self.assertFalse(tree.is_ancestor_of(self.entebbe.pk, self.makerere.pk))
+        self.assertFalse(tree.is_ancestor_of(self.makerere.pk, self.makerere.pk))
+        self.assertTrue(tree.is_ancestor_of(self.makerere.pk, self.makerere.pk, include_self=True))
+        self.assertEqual(tree.get_descendant_ids(0), [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_get_tree__cached(self):
+        """The region tree is loaded once until regions change."""
+        with self.assertNumQueries(1):
+            models.Region.objects.get_tree(self.org.pk)
+        with self.assertNumQueries(0):
+            tree = models.Region.objects.get_tree(self.org.pk)
+        self.assertEqual(tree.get_descendant_ids(self.kampala.pk), [self.inactive.pk, self.makerere.pk])
+
+        # Another process loads the tree from the cache.
+        models._region_trees.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(models.Region.objects.get_tree(self.org.pk).nodes, tree.nodes)
+
+        self.kampala.deactivate()
+        tree = models.Region.objects.get_tree(self.org.pk)
+        self.assertEqual(tree.get_descendant_ids(self.kampala.pk), [])
+        self.assertEqual(tree.get_ancestor_ids(self.makerere.pk), [self.uganda.pk])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_tree_change_bumps_chart_data_version(self):
+        """Charts cached for the org's regions are invalidated when regions change."""
+        version = get_chart_data_version(self.org.pk)
+        self.kampala.deactivate()
+        self.assertGreater(get_chart_data_version(self.org.pk), version)
+
+    def test_deactivate_bumps_tree_version_once(self):
+        """Moving the children of a deactivated region is a single tree change."""
+        with mock.patch.object(models.Region.objects, '_bump_tree_version') as bump:
+            self.kampala.deactivate()
+        bump.assert_called_once_with(self.org.pk)
+
     def test_deactivate_no_children(self):
         """Deactivation workflow when region has no children."""
         self.makerere.deactivate()
@@ -199,6 +254,31 @@ class TestRegion(TracProTest):
         self.assertEqual(self.mock_temba_client.get_contacts_in_groups.call_count, 2)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestRegionTreeVersion(TransactionTestCase):
+
+    def test_bumped_after_commit(self):
+        """Trees loaded before the transaction commits are not reused."""
+        org = factories.Org()
+        region = factories.Region(org=org)
+        with transaction.atomic():
+            region.deactivate()
+            version = models.Region.objects.get_tree_version(org.pk)
+            chart_version = get_chart_data_version(org.pk)
+        self.assertGreater(models.Region.objects.get_tree_version(org.pk), version)
+        self.assertGreater(get_chart_data_version(org.pk), chart_version)
+
+    def test_bumped_after_rollback(self):
+        org = factories.Org()
+        region = factories.Region(org=org)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                region.deactivate()
+                version = models.Region.objects.get_tree_version(org.pk)
+                raise ValueError()
+        self.assertGreater(models.Region.objects.get_tree_version(org.pk), version)
+
+
 class TestGroup(TracProDataTest):
 
     def test_create(self):
@@ -286,6 +366,23 @@ class TestBoundaryManager(TracProTest):
         self.assertEqual(result.level, models.Boundary.LEVEL_COUNTRY)
         self.assertIsNone(result.parent)
 
+    def test_from_temba__simplifies_geometry(self):
+        """The geometry is stored along with its simplified versions and bounds."""
+        coordinates = [[[0, 0], [0.5, 0.001], [1, 0], [1, 1], [0, 1], [0, 0]]]
+        self.temba.geometry = TembaBoundary.Geometry.create(type='Polygon', coordinates=coordinates)
+        result = models.Boundary.objects.from_temba(self.org, self.temba)
+        result.refresh_from_db()
+        self.assertEqual(json.loads(result.geometry)['coordinates'], coordinates)
+        self.assertEqual(json.loads(result.geometry_high)['coordinates'], coordinates)
+        self.assertEqual(json.loads(result.geometry_low)['coordinates'],
+                         [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]])
+        self.assertEqual(json.loads(result.bbox), [0, 0, 1, 1])
+
+        feature = result.as_geojson(models.Boundary.DETAIL_LOW)
+        self.assertEqual(feature['geometry'], json.loads(result.geometry_low))
+        self.assertEqual(feature['bbox'], [0, 0, 1, 1])
+        self.assertEqual(result.as_geojson()['geometry'], json.loads(result.geometry))
+
     def test_from_temba__new_for_org(self):
         """Create a new Boundary if UUID exists, but only for another org."""
         other_org = factories.Org()
@@ -1,10 +1,14 @@
 from __future__ import unicode_literals
 
+import gzip
 import json
+from StringIO import StringIO
 
 from dateutil.relativedelta import relativedelta
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.utils import timezone
 
 from tracpro.polls import models as polls
@@ -595,3 +599,81 @@ class TestGroupMostActive(TracProDataTest):
         self.assertEqual(results[1]['id'], self.group2.pk)
         self.assertEqual(results[1]['name'], self.group2.name)
         self.assertEqual(results[1]['response_count'], 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestBoundaryList(TracProDataTest):
+    url_name = "groups.boundary_list"
+
+    def setUp(self):
+        super(TestBoundaryList, self).setUp()
+        self.country = factories.Boundary(org=self.unicef, level=models.Boundary.LEVEL_COUNTRY)
+        self.country.set_geometry({
+            'type': 'Polygon',
+            'coordinates': [[[0, 0], [0.5, 0.001], [1, 0], [1, 1], [0, 1], [0, 0]]],
+        })
+        self.country.save()
+        self.state = factories.Boundary(
+            org=self.unicef, level=models.Boundary.LEVEL_STATE, parent=self.country)
+        self.state.set_geometry({'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [0, 1], [0, 0]]]})
+        self.state.save()
+        self.login(self.admin)
+
+    def get(self, **kwargs):
+        return self.url_get('unicef', reverse(self.url_name), **kwargs)
+
+    def test_list(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.content)['results']
+        self.assertEqual(set(results), {str(self.country.pk), str(self.state.pk)})
+        self.assertEqual(results[str(self.country.pk)], json.loads(json.dumps(
+            self.country.as_geojson(models.Boundary.DETAIL_MEDIUM))))
+
+        # Full geometries and single levels can be requested.
+        results = json.loads(self.get(data={'detail': 'full', 'level': 1}).content)['results']
+        self.assertEqual(results.keys(), [str(self.state.pk)])
+        self.assertEqual(self.get(data={'detail': 'foo'}).status_code, 400)
+
+        # Boundaries without simplified geometries fall back to the full
+        # geometry, which is loaded with them rather than one at a time.
+        models.Boundary.objects.filter(pk=self.state.pk).update(geometry_medium="")
+        factories.Boundary(
+            org=self.unicef, level=models.Boundary.LEVEL_STATE, parent=self.country,
+            geometry=json.dumps({'type': 'Point', 'coordinates': [0, 0]}))
+        with CaptureQueriesContext(connection) as queries:
+            results = json.loads(self.get(data={'level': 1}).content)['results']
+        self.assertEqual(len([q for q in queries.captured_queries if 'groups_boundary' in q['sql']]), 2)
+        self.assertEqual(results[str(self.state.pk)], json.loads(json.dumps(
+            self.state.as_geojson(models.Boundary.DETAIL_FULL))))
+
+    def test_list_cached(self):
+        response = self.get()
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.get()
+        self.assertEqual(cached.content, response.content)
+        self.assertFalse([q for q in queries.captured_queries if 'groups_boundary' in q['sql']])
+
+        # Clients with the current boundaries don't download them again.
+        response = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Syncing boundaries changes the data.
+        self.mock_temba_client.get_boundaries.return_value = []
+        models.Boundary.objects.sync(self.unicef)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(json.loads(self.get().content)['results'], {})
+
+    def test_list_gzipped(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(
+            json.loads(gzip.GzipFile(fileobj=StringIO(response.content)).read()),
+            json.loads(self.get().content))
+
+        # Each encoding has its own ETag, so that caches don't mix them up.
+        self.assertNotEqual(response['ETag'], self.get()['ETag'])
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
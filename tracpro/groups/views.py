@@ -1,21 +1,29 @@
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
+from itertools import chain
 import logging
 import json
+import re
 
 from dash.orgs.views import OrgPermsMixin
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
 from django.db import transaction
 from django.db.models import Prefetch
 from django.db.models.functions import Lower
 from django.http import (
-    HttpResponseBadRequest, HttpResponseRedirect, JsonResponse)
+    HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, HttpResponseRedirect,
+    JsonResponse)
 from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.decorators import method_decorator
-from django.utils.http import is_safe_url
+from django.utils.http import is_safe_url, parse_etags, quote_etag
+from django.utils.text import compress_string
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import View
 
@@ -29,6 +37,12 @@ from .forms import CohortsForm, PanelsForm
 
 logger = logging.getLogger(__name__)
 
+BOUNDARIES_CACHE_KEY = 'org:%d:boundaries:%s'
+
+BOUNDARIES_CACHE_TIMEOUT = 60 * 60 * 24 * 7  # 1 week
+
+RE_ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
 
 class SetRegion(View):
     """
@@ -243,6 +257,7 @@ class RegionCRUDL(SmartCRUDL):
                     if changed:
                         region.save()
             Region.objects.rebuild()
+            Region.objects.bump_tree_version(org.pk)
 
             return self.success("{} panels have been updated.".format(request.org))
 
@@ -324,10 +339,68 @@ class BoundaryCRUDL(SmartCRUDL):
     actions = ('list',)
 
     class List(OrgPermsMixin, SmartListView):
+        """
+        The org's boundaries as GeoJSON features, with geometries at the
+        `detail` given (medium by default), optionally limited to the given
+        `level`s.
+
+        Responses are cached until the org's boundaries are next synced, and
+        are served gzipped with an ETag so that unchanged boundaries aren't
+        downloaded again.
+        """
+
+        def get(self, request, *args, **kwargs):
+            detail = request.GET.get('detail', Boundary.DETAIL_MEDIUM)
+            if detail not in [Boundary.DETAIL_FULL] + [d for d, _ in Boundary.SIMPLIFY_TOLERANCES]:
+                return HttpResponseBadRequest("Unknown level of detail.")
+            try:
+                levels = sorted(set(int(level) for level in request.GET.getlist('level')))
+            except ValueError:
+                return HttpResponseBadRequest("Levels must be integers.")
+
+            version = Boundary.objects.get_cache_version(request.org)
+            params = json.dumps([version, detail, levels])
+            cache_key = BOUNDARIES_CACHE_KEY % (request.org.pk, hashlib.md5(params).hexdigest())
+            cached = cache.get(cache_key)
+            if cached is None:
+                content = self.get_content(detail, levels)
+                cached = (content, compress_string(content), hashlib.md5(content).hexdigest())
+                cache.set(cache_key, cached, BOUNDARIES_CACHE_TIMEOUT)
+            content, compressed_content, etag = cached
+
+            # Each encoding of the content has its own ETag.
+            gzipped = RE_ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+            if gzipped:
+                etag = '{}-gzip'.format(etag)
+
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponseNotModified()
+            elif gzipped:
+                response = HttpResponse(compressed_content, content_type='application/json')
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(content, content_type='application/json')
+            response['ETag'] = quote_etag(etag)
+            patch_vary_headers(response, ['Accept-Encoding'])
+            patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+            return response
 
         def get_queryset(self):
             return Boundary.objects.by_org(self.request.org).order_by('-level')
 
-        def render_to_response(self, context, **response_kwargs):
-            results = {b.pk: b.as_geojson() for b in context['object_list']}
-            return JsonResponse({'results': results})
+        def get_content(self, detail, levels):
+            boundaries = self.get_queryset()
+            if levels:
+                boundaries = boundaries.filter(level__in=levels)
+            # Don't load the geometries which won't be used.
+            unused = [
+                'geometry_{}'.format(d) for d, _ in Boundary.SIMPLIFY_TOLERANCES if d != detail]
+            boundaries = boundaries.defer(*unused)
+            if detail != Boundary.DETAIL_FULL:
+                # Boundaries without a simplified geometry fall back to the
+                # full geometry, so it is only deferred for the others.
+                simplified = {'geometry_{}'.format(detail): ""}
+                boundaries = chain(boundaries.exclude(**simplified).defer('geometry'),
+                                   boundaries.filter(**simplified))
+            results = {b.pk: b.as_geojson(detail) for b in boundaries}
+            return json.dumps({'results': results}, cls=DjangoJSONEncoder)
@@ -63,7 +63,7 @@ class MessageCRUDL(SmartCRUDL):
         title = _("Message Log")
 
         def derive_queryset(self, **kwargs):
-            return Message.get_all(self.request.org, self.request.data_regions)
+            return Message.get_all(self.request.org, self.request.data_region_ids)
 
         def lookup_field_link(self, context, field, obj):
             return super(MessageCRUDL.List, self).lookup_field_link(context, field, obj)
@@ -110,7 +110,7 @@ class InboxMessageCRUDL(SmartCRUDL):
         template_name = 'msgs/inbox.html'
 
         def derive_queryset(self, **kwargs):
-            qs = InboxMessage.get_all(self.request.org, self.request.data_regions)
+            qs = InboxMessage.get_all(self.request.org, self.request.data_region_ids)
             qs = qs.exclude(contact__is_active=False)
             qs = qs.select_related('contact')
 
@@ -149,9 +149,9 @@ class InboxMessageCRUDL(SmartCRUDL):
             # We don't need the form quite yet, but we will soon in a couple of other
             # places, so go ahead and create it and save that on the object too.
             contact_id = self.kwargs['contact_id']
-            regions = self.request.user.get_all_regions(self.request.org)
             data = self.request.POST or None
-            self.contact = get_object_or_404(Contact.objects.filter(region__in=regions), pk=contact_id)
+            contacts = Contact.objects.filter(region__in=self.request.user_region_ids)
+            self.contact = get_object_or_404(contacts, pk=contact_id)
             self.form = InboxMessageResponseForm(contact=self.contact, data=data)
             return InboxMessage.objects.filter(contact=self.contact).order_by('-created_on')
 
@@ -184,5 +184,4 @@ class InboxMessageCRUDL(SmartCRUDL):
     class Read(OrgPermsMixin, SmartReadView):
 
         def derive_queryset(self, **kwargs):
-            regions = self.request.user.get_all_regions(self.request.org)
-            return InboxMessage.get_all(self.request.org, regions)
+            return InboxMessage.get_all(self.request.org, self.request.user_region_ids)
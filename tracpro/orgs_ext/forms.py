@@ -142,8 +142,17 @@ class OrgExtForm(OrgForm):
         if 'google_analytics' in self.cleaned_data:
             self.instance.google_analytics = self.cleaned_data.get('google_analytics') or ''
         if 'how_to_handle_sameday_responses' in self.cleaned_data:
-            self.instance.how_to_handle_sameday_responses = \
-                self.cleaned_data['how_to_handle_sameday_responses']
+            sameday = self.cleaned_data['how_to_handle_sameday_responses']
+            if sameday != self.instance.how_to_handle_sameday_responses:
+                # Set hook that will be picked up by a post-save signal, as
+                # the charted values of numeric questions have changed.
+                self.instance._rebuild_answer_rollups = True
+            self.instance.how_to_handle_sameday_responses = sameday
+
+        if 'timezone' in self.changed_data:
+            # Set hook that will be picked up by a post-save signal, as the
+            # local dates of the org's pollruns have changed.
+            self.instance._recompute_conducted_dates = True
 
         if 'contact_fields' in self.fields:
             # Set hook that will be picked up by a post-save signal.
@@ -6,6 +6,9 @@ from django.dispatch import receiver
 from dash.orgs.models import Org
 
 from tracpro.contacts.models import DataField
+from tracpro.polls.models import PollRun
+from tracpro.polls.tasks import rebuild_answer_rollups
+from tracpro.polls.utils import bump_chart_data_version
 
 
 @receiver(post_save, sender=Org)
@@ -14,3 +17,22 @@ def set_visible_data_fields(sender, instance, **kwargs):
     if hasattr(instance, '_visible_data_fields'):
         keys = instance._visible_data_fields.values_list('key', flat=True)
         DataField.objects.set_active_for_org(instance, keys)
+
+
+@receiver(post_save, sender=Org)
+def rebuild_org_answer_rollups(sender, instance, **kwargs):
+    """Hook to re-aggregate an org's answers when its same-day policy changes."""
+    if getattr(instance, '_rebuild_answer_rollups', False):
+        # Charts computed from the answers change straight away.
+        bump_chart_data_version(instance.pk)
+        rebuild_answer_rollups.delay(instance.pk)
+        del instance._rebuild_answer_rollups
+
+
+@receiver(post_save, sender=Org)
+def recompute_conducted_dates(sender, instance, **kwargs):
+    """Hook to recompute the local dates of an org's pollruns when its timezone changes."""
+    if getattr(instance, '_recompute_conducted_dates', False):
+        PollRun.objects.recompute_conducted_dates(instance)
+        bump_chart_data_version(instance.pk)
+        del instance._recompute_conducted_dates
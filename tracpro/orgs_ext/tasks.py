@@ -3,7 +3,7 @@ from __future__ import unicode_literals
 import datetime
 import logging
 
-from celery import signature
+from celery import chord, signature
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
 from dash.orgs.models import Org
@@ -21,7 +21,6 @@ from temba_client.exceptions import TembaTokenError
 from temba_client.utils import parse_iso8601, format_iso8601
 
 from tracpro.celery import app as celery_app
-from tracpro.client import get_client
 
 
 logger = get_task_logger(__name__)
@@ -57,7 +56,9 @@ class WrapCacheMixin(object):
         return self.wrap_cache("set", *args, **kwargs)
 
     def wrap_cache(self, method, org, key, *args, **kwargs):
-        cache_key = key.format(task=self.__name__, org=org.pk)
+        # The key is scoped to the org, unless a narrower scope is given.
+        scope = kwargs.pop('scope', None) or org.pk
+        cache_key = key.format(task=self.__name__, org=scope)
         return getattr(cache, method)(cache_key, *args, **kwargs)
 
 
@@ -130,14 +131,21 @@ class OrgTask(WrapCacheMixin, WrapLoggerMixin, PostTransactionTask):
         kwargs.setdefault('max_retries', 0)
         return super(OrgTask, self).apply_async(*args, **kwargs)
 
-    def check_rate_limit(self, org):
+    def get_cache_scope(self, org, *args):
+        """
+        Return the scope of the task's lock, rate limit and failure count
+        for the given task arguments, or None to keep them for the org.
+        """
+        return None
+
+    def check_rate_limit(self, org, scope=None):
         """Return the next run time if this task has run too recently."""
         now = timezone.now()
-        last_run_time = self.cache_get(org, LAST_RUN_TIME)
+        last_run_time = self.cache_get(org, LAST_RUN_TIME, scope=scope)
         if last_run_time is not None:
             # Calculate when the task will be eligible to run again.
             last_run_time = parse_iso8601(last_run_time) if last_run_time else None
-            failure_count = self.cache_get(org, FAILURE_COUNT, default=0)
+            failure_count = self.cache_get(org, FAILURE_COUNT, default=0, scope=scope)
             delta = settings.ORG_TASK_TIMEOUT * 2 ** failure_count
             next_run_time = last_run_time + min(delta, MAX_TIME_BETWEEN_RUNS)
             if now < next_run_time:
@@ -150,47 +158,48 @@ class OrgTask(WrapCacheMixin, WrapLoggerMixin, PostTransactionTask):
                         last_run_time, failure_count, next_run_time))
 
         # Set the current time as the last run time.
-        self.cache_set(org, LAST_RUN_TIME, value=format_iso8601(now), timeout=RUNS_TIMEOUT)
+        self.cache_set(org, LAST_RUN_TIME, value=format_iso8601(now), timeout=RUNS_TIMEOUT, scope=scope)
 
-    def fail_count_incr(self, org):
+    def fail_count_incr(self, org, scope=None):
         """Increment the org's recorded failure count by 1."""
         # Set default value to 0.
-        self.cache_add(org, FAILURE_COUNT, value=0, timeout=RUNS_TIMEOUT)
-        return self.cache_incr(org, FAILURE_COUNT)  # Increment value by 1.
+        self.cache_add(org, FAILURE_COUNT, value=0, timeout=RUNS_TIMEOUT, scope=scope)
+        return self.cache_incr(org, FAILURE_COUNT, scope=scope)  # Increment value by 1.
 
-    def fail_count_reset(self, org):
+    def fail_count_reset(self, org, scope=None):
         """Reset the org's recorded failure count to 0."""
-        self.cache_set(org, FAILURE_COUNT, value=0, timeout=RUNS_TIMEOUT)
+        self.cache_set(org, FAILURE_COUNT, value=0, timeout=RUNS_TIMEOUT, scope=scope)
 
-    def lock_acquire(self, org):
+    def lock_acquire(self, org, scope=None):
         """Set a cache key that indicates the task is currently in progress.
 
         If the key is already set (task in progress), return False.
         """
-        return self.cache_add(org, ORG_TASK_LOCK, value='true', timeout=LOCK_TIMEOUT)
+        return self.cache_add(org, ORG_TASK_LOCK, value='true', timeout=LOCK_TIMEOUT, scope=scope)
 
-    def lock_release(self, org):
+    def lock_release(self, org, scope=None):
         """Delete cache key that indicates that this task is in progress."""
         self.log_debug(org, "Starting to release lock.")
-        self.cache_delete(org, ORG_TASK_LOCK)
+        self.cache_delete(org, ORG_TASK_LOCK, scope=scope)
         self.log_debug(org, "Released lock.")
 
-    def run(self, org_pk):
+    def run(self, org_pk, *args):
         """Run the org_task with locks and logging."""
         org = apps.get_model('orgs', 'Org').objects.get(pk=org_pk)
-        if self.lock_acquire(org):
+        scope = self.get_cache_scope(org, *args)
+        if self.lock_acquire(org, scope):
             try:
-                self.check_rate_limit(org)
+                self.check_rate_limit(org, scope)
             except ValueError as e:
                 self.log_info(org, e.message)
-                self.lock_release(org)
+                self.lock_release(org, scope)
                 return None
 
             try:
                 self.log_info(org, "Starting task.")
-                result = self.org_task(org)
+                result = self.org_task(org, *args)
             except Exception as e:
-                fail_count = self.fail_count_incr(org)
+                fail_count = self.fail_count_incr(org, scope)
                 if isinstance(e, TembaTokenError):
                     msg = "API token is invalid (#{count})."
                     self.log_warning(org, msg, exc_info=True, count=fail_count)
@@ -205,11 +214,11 @@ class OrgTask(WrapCacheMixin, WrapLoggerMixin, PostTransactionTask):
                     self.log_info(org, msg, count=fail_count)
                     raise
             else:
-                self.fail_count_reset(org)
+                self.fail_count_reset(org, scope)
                 self.log_info(org, "Finished task.")
                 return result
             finally:
-                self.lock_release(org)
+                self.lock_release(org, scope)
         else:
             msg = "Skipping task because it is already running for this org."
             self.log_info(org, msg)
@@ -238,59 +247,56 @@ def fetch_runs(org_id, since, email=None):
     Fetch responses for the org with id=org_id, going back
     to `since` (datetime).
 
-    Creates or updates Response objects for each run.
+    The runs are fetched by parallel tasks, one for each poll and day (see
+    `RunBackfill`), which create or update Response objects for each run.
+    Days which were fetched by a previous call are skipped.
 
     If `email` is provided, an email is sent to that address at the end to
     report the results.
     """
-    from tracpro.polls.models import Poll, Response  # Avoid circular imports
+    from tracpro.polls.backfill import RunBackfill  # Avoid circular imports
 
     try:
         org = Org.objects.get(id=org_id)
     except Org.DoesNotExist:
         raise ValueError("No such org with id %d" % org_id)
 
-    # Collect our log messages so we can email them at the end if we want to.
-    messages = []
-
-    def log(s):
-        messages.append(s)
-        logger.info(s)
+    backfill = RunBackfill(org, since)
+    windows = backfill.get_windows()
+    backfill.start(windows)
 
-    # These will show up on stdout when this is called from the management command
-    # (without an `email`).
-    log(_('Fetching responses for org {org_name} since {time}.')
-        .format(org_name=org.name, time=since.strftime('%b %d, %Y %H:%M')))
+    logger.info(_('Fetching responses for org {org_name} since {time} in {num} windows.')
+                .format(org_name=org.name, time=since.strftime('%b %d, %Y %H:%M'), num=len(windows)))
 
-    client = get_client(org)
+    report = report_fetched_runs.s(org_id, since, email)
+    if windows:
+        chord(fetch_runs_window.si(org_id, since, backfill.until, *window) for window in windows)(report)
+    else:
+        report.delay([])
 
-    polls_by_flow_uuids = {p.flow_uuid: p for p in Poll.objects.active().by_org(org)}
 
-    for flow_uuid in polls_by_flow_uuids.keys():
-        runs = client.get_runs(flow=flow_uuid, after=since).all()
+@task
+def fetch_runs_window(org_id, since, until, poll_id, after, before):
+    """Fetch the runs of one poll and window of a `fetch_runs` backfill."""
+    from tracpro.polls.backfill import RunBackfill  # Avoid circular imports
 
-        log(_("Fetched {num} runs for poll {flow_uuid}.").format(num=len(runs), flow_uuid=flow_uuid))
+    org = Org.objects.get(id=org_id)
+    return RunBackfill(org, since, until).fetch_window(poll_id, after, before)
 
-        created = 0
-        updated = 0
-        for run in runs:
-            if run.flow.uuid not in polls_by_flow_uuids:
-                continue  # Response is for a Poll not tracked for this org.
 
-            poll = polls_by_flow_uuids[run.flow.uuid]
-            try:
-                response = Response.from_run(org, run, poll=poll)
-            except ValueError as e:
-                log(_("Unable to save run #{num} due to error: {message}.").format(num=run.id, message=e.message))
-                continue
+@task(ignore_result=True)
+def report_fetched_runs(results, org_id, since, email=None):
+    """Log the results of a `fetch_runs` backfill, and email them if requested."""
+    from tracpro.polls.backfill import RunBackfill  # Avoid circular imports
 
-            if getattr(response, 'is_new', False):
-                created += 1
-            else:
-                updated += 1
+    org = Org.objects.get(id=org_id)
 
-        log(_("Created {created} new responses and updated {updated} existing responses.")
-            .format(created=created, updated=updated))
+    # Collect our log messages so we can email them at the end if we want to.
+    messages = [_('Fetched responses for org {org_name} since {time}.')
+                .format(org_name=org.name, time=since.strftime('%b %d, %Y %H:%M'))]
+    messages.extend(RunBackfill.summarize(results))
+    for message in messages:
+        logger.info(message)
 
     if email:
         send_mail(
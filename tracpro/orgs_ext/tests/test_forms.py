@@ -2,6 +2,7 @@ from __future__ import unicode_literals
 
 import datetime
 import mock
+import pytz
 
 from django.core.exceptions import NON_FIELD_ERRORS
 from django.forms import model_to_dict
@@ -10,7 +11,7 @@ from django.test import override_settings
 from django.utils.timezone import now
 
 from tracpro.orgs_ext.forms import FetchRunsForm, OrgExtForm
-from tracpro.polls.models import SAMEDAY_LAST, SAMEDAY_SUM, Question
+from tracpro.polls.models import SAMEDAY_LAST, SAMEDAY_SUM, PollRun, Question
 from tracpro.test import factories
 from tracpro.test.cases import TracProTest, TracProDataTest
 
@@ -308,6 +309,9 @@ class TestChangingHowRepeatedAnswersAreHandledFromLatestToSum(TracProDataTest):
             self.answer2.refresh_from_db()
             self.assertEqual(SAMEDAY_SUM, self.answer2.org.how_to_handle_sameday_responses)
             self.assertEqual(str(4.0), self.answer2.value_to_use)
+            # The answer rollups were rebuilt with the summed values.
+            self.assertEqual(
+                sum(self.answer1.question.rollups.values_list('numeric_sum', flat=True)), 8.0)
 
 
 class TestChangingHowRepeatedAnswersAreHandledFromSumToLatest(TracProDataTest):
@@ -371,3 +375,34 @@ class TestChangingHowRepeatedAnswersAreHandledFromSumToLatest(TracProDataTest):
             self.assertEqual(str(3.0), self.answer1.value_to_use)
             self.answer2.refresh_from_db()
             self.assertEqual(str(3.0), self.answer2.value_to_use)
+
+
+class TestChangingTimezone(TracProDataTest):
+
+    def test_changed_timezone_recomputes_conducted_dates(self):
+        conducted_on = datetime.datetime(2016, 1, 1, 22, 0, tzinfo=pytz.utc)
+        pollrun = factories.UniversalPollRun(poll=self.poll1, conducted_on=conducted_on)
+        self.assertEqual(pollrun.conducted_date, datetime.date(2016, 1, 2))  # Asia/Kabul
+
+        with mock.patch('tracpro.orgs_ext.forms.DataField'):
+            data = model_to_dict(self.unicef)
+            data.update(dict(
+                administrators=list(self.unicef.administrators.values_list('pk', flat=True)),
+                viewers=[self.superuser.pk],
+                available_languages=self.unicef.available_languages,
+                modified_by=self.unicef.modified_by_id,
+                name=self.unicef.name,
+                language=self.unicef.language,
+                how_to_handle_sameday_responses=self.unicef.how_to_handle_sameday_responses,
+                timezone='UTC',
+            ))
+            form = OrgExtForm(instance=self.unicef, data=data)
+            self.assertTrue(form.is_valid(), form.errors.as_data())
+            form.save()
+
+        pollrun.refresh_from_db()
+        self.assertEqual(pollrun.conducted_date, datetime.date(2016, 1, 1))
+        # Runs of the same day are still added to the existing pollrun.
+        self.unicef.refresh_from_db()
+        self.poll1.refresh_from_db()
+        self.assertEqual(PollRun.objects.get_or_create_universal(self.poll1, conducted_on), pollrun)
@@ -1,12 +1,18 @@
+import datetime
+
 import mock
+import redis
 
 from unittest import skip
 
+from django.core import mail
 from django.utils import timezone
 
 from temba_client.v2.types import Run
 
 from tracpro.orgs_ext.tasks import fetch_runs
+from tracpro.polls.models import Response
+from tracpro.test import factories
 from tracpro.test.cases import TracProDataTest
 
 
@@ -15,6 +21,26 @@ class FetchRunsTaskTest(TracProDataTest):
         with self.assertRaises(ValueError):
             fetch_runs(0, timezone.now())
 
+    def test_fetch_in_windows(self):
+        redis_patcher = mock.patch(
+            'tracpro.polls.backfill.get_redis_connection',
+            return_value=redis.StrictRedis(host='localhost', db=10))
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+
+        get_runs = self.mock_temba_client.get_runs
+        get_runs.return_value.iterfetches.side_effect = lambda **kwargs: iter([
+            [factories.TembaRun(id=1, flow__uuid='F-001', contact__uuid='C-001', exit_type='')],
+        ])
+        fetch_runs(self.unicef.id, timezone.now() - datetime.timedelta(days=1), email='a@b.com')
+
+        # One window for each of the two days of the only active poll.
+        self.assertEqual(get_runs.call_count, 2)
+        self.assertEqual(Response.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("Fetched 2 runs for poll F-001.", mail.outbox[0].body)
+        self.assertIn("Created 1 new responses and updated 1 existing responses.", mail.outbox[0].body)
+
     @skip("Skipping test_with_runs() for now, fixing functionality for API v2.")
     @mock.patch('tracpro.orgs_ext.tasks.logger.error')
     @mock.patch('tracpro.orgs_ext.tasks.logger.info')
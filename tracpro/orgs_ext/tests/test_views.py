@@ -4,19 +4,35 @@ import datetime
 from django.conf import settings
 from django.core.urlresolvers import reverse
 import mock
+import redis
 from django.utils import timezone
 
+from tracpro.polls.backfill import RunBackfill
 from tracpro.test.cases import TracProDataTest
 
 
 class TestOrgExtCRUDLHome(TracProDataTest):
     url_name = "orgs_ext.org_home"
 
+    def setUp(self):
+        super(TestOrgExtCRUDLHome, self).setUp()
+        self.redis = redis.StrictRedis(host='localhost', db=10)
+        redis_patcher = mock.patch('tracpro.polls.backfill.get_redis_connection', return_value=self.redis)
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+
     def test_get(self):
         self.login(self.admin)
         response = self.url_get('unicef', reverse(self.url_name))
         self.assertEqual(response.status_code, 200)
 
+    def test_get_run_backfill_progress(self):
+        backfill = RunBackfill(self.unicef, timezone.now() - datetime.timedelta(days=2))
+        backfill.start(backfill.get_windows())
+        self.login(self.admin)
+        response = self.url_get('unicef', reverse(self.url_name))
+        self.assertContains(response, "0 of 3 poll days fetched (0 failed, 0 runs)")
+
 
 class FetchRunsViewTest(TracProDataTest):
     url_name = 'orgs_ext.org_fetchruns'
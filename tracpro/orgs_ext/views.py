@@ -13,6 +13,8 @@ from dateutil.relativedelta import relativedelta
 from smartmin.templatetags.smartmin import format_datetime
 from smartmin.views import SmartUpdateView, SmartFormView
 
+from tracpro.polls.backfill import RunBackfill
+
 from . import constants
 from . import forms
 from . import tasks
@@ -55,11 +57,14 @@ class OrgExtCRUDL(OrgCRUDL):
 
     class Home(OrgCRUDL.Home):
         fields = ('name', 'timezone', 'api_token', 'google_analytics', 'last_contact_sync',
-                  'last_flow_run_fetch')
+                  'last_flow_run_fetch', 'run_backfill')
         field_config = {
             'api_token': {
                 'label': _("RapidPro API Token"),
             },
+            'run_backfill': {
+                'label': _("Past runs fetch"),
+            },
         }
         permission = 'orgs.org_home'
         title = _("My Organization")
@@ -90,6 +95,19 @@ class OrgExtCRUDL(OrgCRUDL):
             else:
                 return None
 
+        def get_run_backfill(self, obj):
+            progress = RunBackfill.get_progress(obj)
+            if progress:
+                return "since %s: %d of %d poll days fetched (%d failed, %d runs)" % (
+                    format_datetime(progress['since']),
+                    progress['done'],
+                    progress['total'],
+                    progress['failed'],
+                    progress['runs'],
+                )
+            else:
+                return None
+
     class Edit(InferOrgMixin, OrgPermsMixin, SmartUpdateView):
         fields = ('name', 'timezone', 'contact_fields', 'logo', 'google_analytics')
         form_class = forms.OrgExtForm
@@ -0,0 +1,196 @@
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import logging
+from multiprocessing.dummy import Pool as ThreadPool
+
+import pytz
+
+from django.db import connection
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from django_redis import get_redis_connection
+from temba_client.utils import parse_iso8601, format_iso8601
+
+from tracpro.client import get_client
+
+from .ingest import RunIngester
+from .models import Poll
+
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_PROGRESS_KEY = 'org:%d:run_backfill_progress'
+
+BACKFILL_DONE_WINDOWS_KEY = 'org:%d:run_backfill:%s:done_windows'
+
+BACKFILL_TIMEOUT = 60 * 60 * 24 * 30  # 30 days
+
+WINDOW_SIZE = datetime.timedelta(days=1)
+
+
+class RunBackfill(object):
+    """
+    Fetches the runs of an org's active polls which were modified since a
+    given time.
+
+    The time range is split into windows of one UTC day for each poll, so
+    that windows can be fetched by parallel workers. Progress is recorded in
+    Redis: windows which have ended are remembered once fetched, and are
+    skipped when a backfill for the org since the same day is run again,
+    unless it is forced.
+    """
+
+    def __init__(self, org, since, until=None, force=False):
+        self.org = org
+        self.since = since
+        self.until = until or timezone.now()
+        self.force = force
+        self.first_day = since.astimezone(pytz.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.done_key = BACKFILL_DONE_WINDOWS_KEY % (self.org.pk, self.first_day.date().isoformat())
+
+    def get_windows(self):
+        """
+        Return the (poll id, after, before) windows still to be fetched.
+
+        Windows are aligned to UTC days so that they are the same for each
+        run of a backfill. The last window ends at `until`. A forced backfill
+        forgets the windows fetched by previous runs.
+        """
+        redis_connection = get_redis_connection()
+        if self.force:
+            redis_connection.delete(self.done_key)
+        done = redis_connection.smembers(self.done_key)
+        poll_ids = Poll.objects.active().by_org(self.org).order_by('pk').values_list('pk', flat=True)
+
+        windows = []
+        for poll_id in poll_ids:
+            after = self.first_day
+            while after < self.until:
+                before = min(after + WINDOW_SIZE, self.until)
+                if self._window_key(poll_id, after) not in done:
+                    windows.append((poll_id, after, before))
+                after += WINDOW_SIZE
+        return windows
+
+    def start(self, windows):
+        """Reset the org's recorded progress for the given windows."""
+        redis_connection = get_redis_connection()
+        key = BACKFILL_PROGRESS_KEY % self.org.pk
+        redis_connection.delete(key)
+        redis_connection.hmset(key, {
+            'since': format_iso8601(self.since),
+            'until': format_iso8601(self.until),
+            'total': len(windows),
+            'done': 0,
+            'failed': 0,
+            'runs': 0,
+        })
+        redis_connection.expire(key, BACKFILL_TIMEOUT)
+
+    def fetch_window(self, poll_id, after, before):
+        """
+        Fetch and save the poll's runs modified within the window.
+
+        Returns a dictionary of the counts for the window, and the messages
+        of any errors.
+        """
+        result = {'poll': poll_id, 'fetched': 0, 'created': 0, 'updated': 0, 'errors': []}
+        redis_connection = get_redis_connection()
+        progress_key = BACKFILL_PROGRESS_KEY % self.org.pk
+        try:
+            poll = Poll.objects.select_related('org').get(pk=poll_id)
+            query = get_client(self.org).get_runs(flow=poll.flow_uuid, after=after, before=before)
+
+            ingester = RunIngester(self.org)
+            for page in query.iterfetches(retry_on_rate_exceed=True):
+                result['fetched'] += len(page)
+                redis_connection.hincrby(progress_key, 'runs', len(page))
+                ingester.ingest_all(poll, [run for run in page if run.flow.uuid == poll.flow_uuid])
+        except Exception as e:
+            logger.exception("Failed to fetch runs of poll #%d between %s and %s" % (
+                poll_id, format_iso8601(after), format_iso8601(before)))
+            redis_connection.hincrby(progress_key, 'failed', 1)
+            result['errors'].append(_("Unable to fetch runs between {after} and {before} due to error: "
+                                      "{message}.").format(after=after, before=before, message=e))
+            return result
+
+        result['created'] = ingester.created
+        result['updated'] = ingester.updated
+        for run, error in ingester.failures:
+            if isinstance(error, ValueError):
+                result['errors'].append(_("Unable to save run #{num} due to error: {message}.")
+                                        .format(num=run.id, message=error.message))
+
+        # Runs only move to later windows as they are modified, so windows
+        # which have ended never need to be fetched again. The set expires a
+        # fixed time after the first of them was fetched.
+        if before - after == WINDOW_SIZE:
+            redis_connection.sadd(self.done_key, self._window_key(poll_id, after))
+            if redis_connection.ttl(self.done_key) < 0:
+                redis_connection.expire(self.done_key, BACKFILL_TIMEOUT)
+        redis_connection.hincrby(progress_key, 'done', 1)
+        return result
+
+    def run(self, workers=1):
+        """Fetch all remaining windows in this process, using threads."""
+        windows = self.get_windows()
+        self.start(windows)
+        if workers <= 1:
+            return [self.fetch_window(*window) for window in windows]
+
+        def fetch_window(window):
+            try:
+                return self.fetch_window(*window)
+            finally:
+                # Each thread has its own database connection.
+                connection.close()
+
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(fetch_window, windows)
+        finally:
+            pool.close()
+            pool.join()
+
+    @classmethod
+    def get_progress(cls, org):
+        """Return the progress of the org's latest backfill, or None."""
+        progress = get_redis_connection().hgetall(BACKFILL_PROGRESS_KEY % org.pk)
+        if not progress:
+            return None
+        return {
+            'since': parse_iso8601(progress['since']),
+            'until': parse_iso8601(progress['until']),
+            'total': int(progress['total']),
+            'done': int(progress['done']),
+            'failed': int(progress['failed']),
+            'runs': int(progress['runs']),
+        }
+
+    @classmethod
+    def summarize(cls, results):
+        """Return messages reporting the results of the windows, by poll."""
+        polls = Poll.objects.in_bulk(set(result['poll'] for result in results))
+        totals = {}
+        for result in results:
+            poll_totals = totals.setdefault(result['poll'], {
+                'fetched': 0, 'created': 0, 'updated': 0, 'errors': []})
+            for name in ('fetched', 'created', 'updated'):
+                poll_totals[name] += result[name]
+            poll_totals['errors'].extend(result['errors'])
+
+        messages = []
+        for poll_id, poll_totals in sorted(totals.items()):
+            poll = polls.get(poll_id)
+            messages.append(_("Fetched {num} runs for poll {flow_uuid}.").format(
+                num=poll_totals['fetched'], flow_uuid=poll.flow_uuid if poll else poll_id))
+            messages.extend(poll_totals['errors'])
+            messages.append(
+                _("Created {created} new responses and updated {updated} existing responses.")
+                .format(**poll_totals))
+        return messages
+
+    def _window_key(self, poll_id, after):
+        return '%d:%s' % (poll_id, after.date().isoformat())
@@ -1,16 +1,29 @@
 from __future__ import absolute_import, unicode_literals
 
+from collections import Counter
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
+from django.db.models import Count
 from django.db.models.functions import Lower
 from django.utils.http import urlencode
 
 from tracpro.charts.formatters import format_series, format_x_axis
 from tracpro.groups.models import Region
 
-from .models import Answer, Question
+from .models import Answer, AnswerRollup, Question
+from . import maps
 from . import utils
 
 
+CHART_DATA_KEY = 'org:%d:chart_data:%s'
+
+CHART_DATA_TIMEOUT = 60 * 60 * 24  # 1 day
+
+
 def _url(name, args=None, kwargs=None, params=None):
     url = reverse(name, args=args, kwargs=kwargs)
     if params:
@@ -18,11 +31,17 @@ def _url(name, args=None, kwargs=None, params=None):
     return url
 
 
-def single_pollrun(pollrun, responses, question):
+def get_chart_data_key(question, version, params):
+    """Return the cache key of the question's chart data for the given parameters."""
+    params = json.dumps([question.pk, version] + params, cls=DjangoJSONEncoder)
+    return CHART_DATA_KEY % (question.poll.org_id, hashlib.md5(params).hexdigest())
+
+
+def single_pollrun_chart(pollrun, responses, question, answers):
     """Chart the data for one question from a single pollrun.
 
-    Assumes responses are already filtered for the desired pollrun/date,
-    and includes all valid answers for the given question and responses.
+    Assumes responses and answers are already filtered for the desired
+    pollrun/date.
 
     Will be a word cloud for open-ended questions, a bar chart with autocreated
     categories for numeric questions, and a bar chart of categories for everything else.
@@ -41,8 +60,7 @@ def single_pollrun(pollrun, responses, question):
     chart_data = []
     summary_table = None
 
-    answers = Answer.objects.filter(response__in=responses, question=question)
-    if answers:
+    if answers.exists():
         if question.question_type == Question.TYPE_OPEN:
             chart_type = 'open-ended'
             chart_data = word_cloud_data(answers)
@@ -53,8 +71,7 @@ def single_pollrun(pollrun, responses, question):
             else:
                 chart_data = single_pollrun_multiple_choice(answers, pollrun)
 
-            _, answer_avgs, answer_stdevs, response_rates = utils.summarize_by_pollrun(
-                answers, responses)
+            _, answer_avgs, answer_stdevs, response_rates = answers.summarize_by_pollrun(responses)
             summary_table = [
                 ('Mean', answer_avgs.get(pollrun.pk, 0)),
                 ('Standard deviation', answer_stdevs.get(pollrun.pk, 0)),
@@ -81,24 +98,19 @@ def single_pollrun_multiple_choice(answers, pollrun):
     }
 
 
-def multiple_pollruns(pollruns, responses, question, split_regions, contact_filters):
+def multiple_pollruns_chart(pollruns, responses, question, answers, split_regions,
+                            contact_filters, regions=None):
+    """Chart the data for one question over the pollruns."""
     chart_type = None
     chart_data = None
     summary_table = None
 
-    pollruns = pollruns.order_by('conducted_on')
-    answers = Answer.objects.\
-        filter(response__in=responses, question=question).\
-        select_related('question__poll__org', 'response__contact')
-
-    # Save a bit of time with .exists();
-    # queryset is re-evaluated later as a values set.
     if answers.exists():
         if question.question_type == Question.TYPE_NUMERIC:
             chart_type = 'numeric'
             if split_regions:
                 chart_data, summary_table = multiple_pollruns_numeric_split(
-                    pollruns, answers, responses, question, contact_filters)
+                    pollruns, answers, responses, question, contact_filters, regions)
             else:
                 chart_data, summary_table = multiple_pollruns_numeric(
                     pollruns, answers, responses, question, contact_filters)
@@ -135,7 +147,7 @@ def multiple_pollruns_multiple_choice(pollruns, answers, responses, contact_filt
     (answer_sums,
      answer_avgs,
      answer_stdevs,
-     response_rates) = utils.summarize_by_pollrun(answers, responses)
+     response_rates) = answers.summarize_by_pollrun(responses)
 
     summary_table = [
         ('Mean', utils.overall_mean(pollruns, answer_avgs)),
@@ -150,7 +162,7 @@ def multiple_pollruns_numeric(pollruns, answers, responses, question, contact_fi
     (answer_sums,
      answer_avgs,
      answer_stdevs,
-     response_rates) = utils.summarize_by_pollrun(answers, responses)
+     response_rates) = answers.summarize_by_pollrun(responses)
 
     sum_data = []
     avg_data = []
@@ -184,14 +196,22 @@ def multiple_pollruns_numeric(pollruns, answers, responses, question, contact_fi
     return chart_data, summary_table
 
 
-def multiple_pollruns_numeric_split(pollruns, answers, responses, question, contact_filters):
-    """Return separate series for each contact region."""
-    data = utils.summarize_by_region_and_pollrun(answers, responses)
+def multiple_pollruns_numeric_split(pollruns, answers, responses, question, contact_filters,
+                                    regions=None):
+    """Return separate series for each contact region.
+
+    Pass `regions` to select the regions from a list, in order, rather than
+    loading them.
+    """
+    data = answers.summarize_by_region_and_pollrun(responses)
 
     sum_data = []
     avg_data = []
     rate_data = []
-    regions = (Region.objects.filter(pk__in=data.keys()).order_by(Lower('name')))
+    if regions is None:
+        regions = Region.objects.filter(pk__in=data.keys()).order_by(Lower('name'))
+    else:
+        regions = [region for region in regions if region.pk in data]
     for region in regions:
         answer_sums, answer_avgs, answer_stdevs, response_rates = data.get(region.pk)
         region_answer_sums = []
@@ -224,7 +244,7 @@ def multiple_pollruns_numeric_split(pollruns, answers, responses, question, cont
     (pollrun_answer_sums,
      pollrun_answer_avgs,
      pollrun_answer_stdevs,
-     pollrun_response_rates) = utils.summarize_by_pollrun(answers, responses)
+     pollrun_response_rates) = answers.summarize_by_pollrun(responses)
     summary_table = [
         ('Mean', utils.overall_mean(pollruns, pollrun_answer_avgs)),
         ('Standard deviation', utils.overall_stdev(pollruns, pollrun_answer_avgs)),
@@ -232,3 +252,246 @@ def multiple_pollruns_numeric_split(pollruns, answers, responses, question, cont
     ]
 
     return chart_data, summary_table
+
+
+class PollCharts(object):
+    """
+    Charts all of the given questions of a poll in one pass.
+
+    Answer totals for all of the questions are loaded with a single query,
+    from the answer rollups unless the responses are filtered by contact
+    data, in which case the answers are totalled by the database instead,
+    and partitioned by question in memory. Map data is aggregated by
+    boundary in the database, as are the histograms of numeric questions,
+    and the individual answers needed for word clouds are loaded with one
+    more streamed query. Each chart and summary table is then computed in
+    memory.
+
+    If a `cache_scope` is given, identifying how the responses were limited
+    other than by pollrun and contact data (e.g. the region being viewed),
+    the data for each question is cached until the org's chart data version
+    changes.
+    """
+
+    def __init__(self, questions, responses, contact_filters=None, cache_scope=None):
+        self.questions = list(questions.select_related('poll__org'))
+        self.responses = responses
+        self.contact_filters = contact_filters or {}
+        self.cache_scope = cache_scope
+
+    def multiple_pollruns(self, pollruns, split_regions):
+        """
+        Return a (question, chart type, chart data, map data, summary table)
+        tuple for each question, charted over the pollruns.
+        """
+        pollruns = list(pollruns.order_by('conducted_on'))
+
+        def get_data(questions):
+            self._load(questions, histograms=False)
+            data = []
+            for question in questions:
+                answers = self.answers[question.pk]
+                chart_type, chart_data, summary_table = multiple_pollruns_chart(
+                    pollruns, self.response_counts, question, answers,
+                    split_regions, self.contact_filters, self.regions)
+                data.append((question, chart_type, chart_data, self._map_data(question), summary_table))
+            return data
+
+        return self._get_cached(['pollruns', [p.pk for p in pollruns], split_regions], get_data)
+
+    def single_pollrun(self, pollrun):
+        """
+        Return a (question, chart type, chart data, map data, summary table)
+        tuple for each question, charted for a single pollrun.
+        """
+        def get_data(questions):
+            self._load(questions, histograms=True)
+            data = []
+            for question in questions:
+                answers = self.answers[question.pk]
+                chart_type, chart_data, summary_table = single_pollrun_chart(
+                    pollrun, self.response_counts, question, answers)
+                data.append((question, chart_type, chart_data, self._map_data(question), summary_table))
+            return data
+
+        return self._get_cached(['pollrun', pollrun.pk], get_data)
+
+    def _get_cached(self, params, get_data):
+        """
+        Return the cached data of each question, calling `get_data` with
+        the list of questions which aren't cached.
+        """
+        if self.cache_scope is None or not self.questions:
+            return get_data(self.questions)
+
+        version = utils.get_chart_data_version(self.questions[0].poll.org_id)
+        params = params + [self.cache_scope, sorted(self.contact_filters.items())]
+        keys = [get_chart_data_key(question, version, params) for question in self.questions]
+        cached = cache.get_many(keys)
+
+        missing = [q for q, key in zip(self.questions, keys) if key not in cached]
+        if missing:
+            data = get_data(missing)
+            to_cache = {get_chart_data_key(d[0], version, params): d[1:] for d in data}
+            cache.set_many(to_cache, CHART_DATA_TIMEOUT)
+            cached.update(to_cache)
+        return [(question,) + cached[key] for question, key in zip(self.questions, keys)]
+
+    def _map_data(self, question):
+        # Maps only show the answers of contacts in regions with boundaries.
+        answers = self.answers[question.pk].in_regions(self.boundaries)
+        return maps.format_map_data(self.map_data.get(question.pk), question, answers)
+
+    def _load(self, questions, histograms):
+        self.response_counts = ResponseCounts(self.responses)
+        region_ids = set(region_id for region_id, pollrun_id in self.response_counts.by_region)
+        self.regions = sorted(Region.objects.filter(pk__in=region_ids), key=lambda r: r.name.lower())
+        self.boundaries = {r.pk: r.boundary_id for r in self.regions if r.boundary_id}
+        self.answers = {question.pk: QuestionAnswers(question) for question in questions}
+
+        # Rollups don't record contact data, so can't be filtered by it.
+        use_rollups = not any(self.contact_filters.values())
+        if use_rollups:
+            rollups = AnswerRollup.objects.filter(question__in=questions).for_responses(self.responses)
+            rollups = rollups.values_list(
+                'question', 'region', 'pollrun', 'answer_count', 'numeric_count',
+                'numeric_sum', 'numeric_sum_squares', 'category_counts')
+            for rollup in rollups.iterator():
+                question_id, category_counts = rollup[0], json.loads(rollup[-1])
+                self.answers[question_id].add_totals(*rollup[1:-1], category_counts=category_counts)
+        else:
+            answers = Answer.objects.filter(question__in=questions, response__in=self.responses)
+            for total in answers.category_totals(questions).iterator():
+                self.answers[total['question']].add_totals(
+                    total['response__contact__region'], total['response__pollrun'],
+                    total['answer_count'], total['numeric_count'], total['numeric_sum'] or 0.0,
+                    total['numeric_sum_squares'] or 0.0,
+                    category_counts=[(total['category'], total['answer_count'])])
+
+            # Standard deviations computed from the sums of squares lose
+            # precision, so compute them in the database where we can.
+            numeric = [question for question in questions if question.question_type == Question.TYPE_NUMERIC]
+            if numeric:
+                answers = answers.filter(question__in=numeric)
+                for (question_id, pollrun_id), stdev in answers.numeric_stdevs(numeric).items():
+                    self.answers[question_id].stdevs[pollrun_id] = stdev
+                stdevs = answers.numeric_stdevs(numeric, by_region=True)
+                for (question_id, region_id, pollrun_id), stdev in stdevs.items():
+                    self.answers[question_id].stdevs[(region_id, pollrun_id)] = stdev
+
+        # Maps only show the answers of contacts in regions with boundaries.
+        self.map_data = {}
+        if self.boundaries:
+            self.map_data = maps.get_map_data(questions, self.responses, use_rollups)
+
+        # Histograms are computed in the database.
+        numeric = [question for question in questions if question.question_type == Question.TYPE_NUMERIC]
+        if histograms and numeric:
+            answers = Answer.objects.filter(question__in=numeric, response__in=self.responses)
+            for question_id, histogram in answers.autocategorize_by_question(numeric).items():
+                self.answers[question_id].histogram = histogram
+
+        # Only word clouds need the individual answers.
+        questions = [question for question in questions if question.question_type == Question.TYPE_OPEN]
+        if not questions:
+            return
+        answers = Answer.objects.filter(question__in=questions, response__in=self.responses)
+        answers = answers.order_by().values_list('question', 'value', 'response__contact__language')
+        for question_id, value, language in answers.iterator():
+            self.answers[question_id].words.append((value, language))
+
+
+class ResponseCounts(object):
+    """
+    Response counts by pollrun and contact region, loaded with one query.
+    Stands in for the responses queryset in the chart functions.
+    """
+
+    def __init__(self, responses):
+        counts = responses.order_by().values('contact__region', 'pollrun').annotate(count=Count('pk'))
+        self.by_region = {(c['contact__region'], c['pollrun']): c['count'] for c in counts}
+        self.by_pollrun = Counter()
+        for (region_id, pollrun_id), count in self.by_region.items():
+            self.by_pollrun[pollrun_id] += count
+
+    def group_counts(self, *fields):
+        if fields == ('pollrun',):
+            return dict(self.by_pollrun)
+        elif fields == ('contact__region', 'pollrun'):
+            return dict(self.by_region)
+        raise ValueError("Responses are only counted by pollrun, or by region and pollrun.")
+
+
+class QuestionAnswers(object):
+    """
+    The answers to one question, totalled in memory by contact region and
+    pollrun. Stands in for the answers queryset in the chart functions.
+    """
+
+    def __init__(self, question):
+        self.question = question
+        # (region id, pollrun id) -> [answer count, numeric count, sum, sum of squares, category counts]
+        self.totals = {}
+        # Standard deviations computed in the database, by the keys of `numeric_totals`.
+        self.stdevs = {}
+        self.histogram = utils.histogram_categories([], [])
+        self.words = []
+
+    def add_totals(self, region_id, pollrun_id, answer_count, numeric_count, numeric_sum,
+                   numeric_sum_squares, category_counts):
+        total = self.totals.setdefault((region_id, pollrun_id), [0, 0, 0.0, 0.0, Counter()])
+        total[0] += answer_count
+        total[1] += numeric_count
+        total[2] += numeric_sum
+        total[3] += numeric_sum_squares
+        for category, count in category_counts:
+            total[4][category] += count
+
+    def in_regions(self, region_ids):
+        """Return the totals of the answers by contacts in the given regions."""
+        answers = QuestionAnswers(self.question)
+        answers.totals = {key: total for key, total in self.totals.items() if key[0] in region_ids}
+        answers.stdevs = {
+            key: stdev for key, stdev in self.stdevs.items() if isinstance(key, tuple) and key[0] in region_ids}
+        return answers
+
+    def exists(self):
+        return bool(self.totals)
+
+    def numeric_totals(self, by_region=False):
+        totals = {}
+        for (region_id, pollrun_id), total in self.totals.items():
+            key = (region_id, pollrun_id) if by_region else pollrun_id
+            sums = totals.setdefault(key, [0, 0, 0.0, 0.0])
+            for index in range(4):
+                sums[index] += total[index]
+        totals = {key: utils.summarize_totals(*sums) for key, sums in totals.items()}
+        for key, total in totals.items():
+            if key in self.stdevs:
+                total['numeric_stdev'] = self.stdevs[key]
+        return totals
+
+    def summarize_by_pollrun(self, responses):
+        return utils.summarize_by_pollrun(self, responses)
+
+    def summarize_by_region_and_pollrun(self, responses):
+        return utils.summarize_by_region_and_pollrun(self, responses)
+
+    def category_counts_by_pollrun(self):
+        counts = {}
+        for (region_id, pollrun_id), total in self.totals.items():
+            for category, count in total[4].items():
+                counts.setdefault(category, Counter())[pollrun_id] += count
+        return sorted(counts.items(), key=lambda (category, pollrun_counts): utils.natural_sort_key(category))
+
+    def categories(self):
+        categories = set()
+        for total in self.totals.values():
+            categories.update(category for category in total[4] if category)
+        return sorted(categories)
+
+    def word_counts(self):
+        return utils.count_words(self.words)
+
+    def autocategorize(self):
+        return self.histogram
@@ -9,7 +9,7 @@ from dash.utils import get_month_range
 from tracpro.charts import filters
 
 from . import models
-from .tasks import sync_questions_categories
+from .tasks import start_poll_backfills, sync_questions_categories
 
 
 class PollForm(forms.ModelForm):
@@ -59,13 +59,16 @@ class ActivePollsForm(forms.Form):
 
     def save(self):
         uuids = self.cleaned_data['polls'].values_list('flow_uuid', flat=True)
-        models.Poll.objects.set_active_for_org(self.org, uuids)
+        activated = models.Poll.objects.set_active_for_org(self.org, uuids)
 
         # Call a celery task to update the questions and categories
         # This takes a long time, so let's schedule it to run in the background
         sync_questions_categories.delay(
             self.org, self.cleaned_data['polls'])
 
+        # Fetch the history of polls which weren't active before.
+        start_poll_backfills(activated)
+
 
 class PollChartFilterForm(filters.DateRangeFilter, filters.DataFieldFilter,
                           filters.FilterForm):
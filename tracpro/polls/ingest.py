@@ -0,0 +1,350 @@
+from __future__ import absolute_import, unicode_literals
+
+from itertools import islice
+
+from django.db import connection, transaction
+
+from tracpro.contacts.models import Contact, NoContactInRapidProWarning, NoUsableURNWarning
+from tracpro.utils import bulk_update
+
+from .models import Answer, AnswerRollup, PollRun, Response
+from .utils import bump_chart_data_version, get_numeric_value
+
+
+BATCH_SIZE = 200
+
+RESPONSE_UPSERT_SQL = """
+    INSERT INTO polls_response (flow_run_id, pollrun_id, contact_id, created_on, updated_on, status, is_active)
+    VALUES {values}
+    ON CONFLICT (flow_run_id, pollrun_id) DO UPDATE
+    SET contact_id = EXCLUDED.contact_id,
+        created_on = EXCLUDED.created_on,
+        updated_on = EXCLUDED.updated_on,
+        status = EXCLUDED.status,
+        is_active = TRUE
+    RETURNING id, flow_run_id, pollrun_id, xmax = 0
+"""
+
+ACTIVE_RESPONSES_SQL = """
+    UPDATE polls_response
+    SET is_active = (polls_response.id = latest.id)
+    FROM (
+        SELECT DISTINCT ON (r.pollrun_id, r.contact_id) r.id, r.pollrun_id, r.contact_id
+        FROM polls_response r
+        INNER JOIN (VALUES {pairs}) AS p(pollrun_id, contact_id)
+            ON r.pollrun_id = p.pollrun_id AND r.contact_id = p.contact_id
+        ORDER BY r.pollrun_id, r.contact_id, r.created_on DESC, r.id DESC
+    ) AS latest
+    WHERE polls_response.pollrun_id = latest.pollrun_id
+      AND polls_response.contact_id = latest.contact_id
+      AND polls_response.is_active != (polls_response.id = latest.id)
+    RETURNING polls_response.pollrun_id, polls_response.contact_id
+"""
+
+
+class RunIngester(object):
+    """
+    Converts batches of RapidPro flow runs into poll Responses and Answers.
+
+    Each call to `ingest` handles one batch of runs for a single poll using a
+    fixed number of set-based queries, and writes the results inside a single
+    transaction. Runs which can't be saved are recorded in `failures` as
+    (run, exception) pairs rather than raised.
+    """
+
+    def __init__(self, org):
+        self.org = org
+        self.created = 0
+        self.updated = 0
+        self.failures = []
+        self._contacts = {}
+        self._questions = {}
+        self._pollruns = {}
+        self._same_day_keys = set()
+        self._rollup_keys = set()
+
+    def ingest_all(self, poll, runs, batch_size=BATCH_SIZE):
+        """Ingest an iterable of runs in batches. Returns the number of runs."""
+        runs = iter(runs)
+        total = 0
+        while True:
+            batch = list(islice(runs, batch_size))
+            if not batch:
+                return total
+            self.ingest(poll, batch)
+            total += len(batch)
+
+    def ingest(self, poll, runs):
+        """
+        Create or update responses for the given runs of the poll.
+
+        Returns the list of responses for the runs which were saved. New
+        responses have the attribute `is_new` = True.
+        """
+        runs = list(runs)
+        if not runs:
+            return []
+
+        existing = self._get_existing_responses(poll, runs)
+
+        # Up-to-date responses need no further work.
+        stale_runs = []
+        responses = []
+        for run in runs:
+            response = existing.get((run.id, run.contact.uuid))
+            if response and response.updated_on == Response.get_run_updated_on(run):
+                response.is_new = False
+                responses.append(response)
+            else:
+                stale_runs.append(run)
+
+        contacts = self._get_contacts(stale_runs)
+
+        # Same-day values of these keys, and the rollups of these (question,
+        # pollrun, region) groups, are recomputed at the end of the batch.
+        self._same_day_keys = set()
+        self._rollup_keys = set()
+
+        to_update = []
+        to_create = []
+        for run in stale_runs:
+            contact = contacts.get(run.contact.uuid)
+            if isinstance(contact, Exception):
+                self.failures.append((run, contact))
+                continue
+            response = existing.get((run.id, run.contact.uuid))
+            if response:
+                to_update.append((run, response))
+            else:
+                to_create.append((run, contact))
+
+        # Creating a universal pollrun locks the poll until the transaction
+        # ends, so resolve them first rather than for the whole batch.
+        for run, contact in to_create:
+            self._get_universal_pollrun(poll, run.created_on)
+
+        with transaction.atomic():
+            run_responses = self._update_responses(to_update)
+            run_responses.extend(self._create_responses(poll, to_create))
+            self._save_answers(poll, run_responses)
+            Answer.objects.recompute_same_day(self._same_day_keys)
+            AnswerRollup.objects.refresh(self._rollup_keys)
+            AnswerRollup.objects.refresh_same_day(self._same_day_keys)
+
+        if run_responses:
+            bump_chart_data_version(self.org.pk)
+
+        responses.extend(response for run, response in run_responses)
+        for response in responses:
+            if response.is_new:
+                self.created += 1
+            else:
+                self.updated += 1
+        return responses
+
+    def _get_existing_responses(self, poll, runs):
+        """Map (run id, contact uuid) to the active response for each run."""
+        responses = Response.objects.filter(
+            flow_run_id__in=[run.id for run in runs],
+            pollrun__poll=poll,
+            is_active=True,
+        ).select_related('pollrun', 'contact').order_by('pk')
+        existing = {}
+        for response in responses:
+            existing.setdefault((response.flow_run_id, response.contact.uuid), response)
+        return existing
+
+    def _get_contacts(self, runs):
+        """
+        Map contact uuid to the local contact for each of the runs, fetching
+        unknown contacts from RapidPro. Contacts which can't be synced map to
+        the exception which should be reported for their runs. Results are
+        kept for the whole sync, so failed contacts aren't fetched again.
+        """
+        uuids = set(run.contact.uuid for run in runs)
+        missing = uuids.difference(self._contacts)
+        if missing:
+            for uuid, contact in Contact.get_or_fetch_many(self.org, missing).items():
+                if isinstance(contact, (NoContactInRapidProWarning, NoUsableURNWarning)):
+                    # Callers expect an exception if we don't sync the response
+                    contact = ValueError("not syncing response because %s" % contact.args[0], contact)
+                # NoMatchingCohortsWarning happens regularly because tracpro users
+                # aren't necessarily interested in all contacts' responses.
+                self._contacts[uuid] = contact
+        return {uuid: self._contacts[uuid] for uuid in uuids}
+
+    def _update_responses(self, to_update):
+        """Update existing responses whose runs have changed in RapidPro."""
+        if not to_update:
+            return []
+
+        for run, response in to_update:
+            response.updated_on = Response.get_run_updated_on(run)
+            response.status = Response.get_run_status(run)
+            response.is_new = False
+        bulk_update(Response, [response for run, response in to_update], ['updated_on', 'status'])
+        return to_update
+
+    def _create_responses(self, poll, to_create):
+        """
+        Create or re-activate responses for runs which have no active response.
+
+        If we don't have an existing response then the poll was started in
+        RapidPro and is non-regional.
+        """
+        if not to_create:
+            return []
+
+        # A run can only be upserted once per statement.
+        to_create = {run.id: (run, contact) for run, contact in to_create}.values()
+
+        pollrun_for_run = {}
+        for run, contact in to_create:
+            pollrun_for_run[run.id] = self._get_universal_pollrun(poll, run.created_on)
+
+        # Responses may already exist (inactive, or for another contact) for
+        # the same run and pollrun, in which case they are re-used and their
+        # answers replaced. Note the same-day values and rollups which may
+        # depend on them while we still know their previous contacts.
+        previous = Answer.objects.filter(
+            response__pollrun__in=set(pollrun_for_run.values()),
+            response__flow_run_id__in=pollrun_for_run.keys(),
+        )
+        self._same_day_keys.update(previous.same_day_keys())
+        self._rollup_keys.update(previous.order_by().values_list(
+            'question_id', 'response__pollrun_id', 'response__contact__region_id').distinct())
+
+        responses = {}
+        params = []
+        for run, contact in to_create:
+            response = Response(
+                flow_run_id=run.id,
+                pollrun=pollrun_for_run[run.id],
+                contact=contact,
+                created_on=run.created_on,
+                updated_on=Response.get_run_updated_on(run),
+                status=Response.get_run_status(run),
+                is_active=True,
+            )
+            responses[(response.flow_run_id, response.pollrun_id)] = response
+            params.extend([
+                response.flow_run_id, response.pollrun_id, response.contact_id,
+                response.created_on, response.updated_on, response.status,
+            ])
+
+        # Upsert on the unique (flow_run_id, pollrun) key, so that concurrent
+        # fetches of the same runs don't conflict.
+        with connection.cursor() as cursor:
+            cursor.execute(RESPONSE_UPSERT_SQL.format(
+                values=", ".join(["(%s, %s, %s, %s, %s, %s, TRUE)"] * len(to_create)),
+            ), params)
+            for pk, flow_run_id, pollrun_id, inserted in cursor.fetchall():
+                response = responses[(flow_run_id, pollrun_id)]
+                response.pk = pk
+                response.is_new = inserted
+
+        reused = [r for r in responses.values() if not r.is_new]
+        if reused:
+            Answer.objects.filter(response__in=reused).delete()
+
+        self._select_active_responses(poll, responses.values())
+        return [(run, responses[(run.id, pollrun_for_run[run.id].pk)]) for run, contact in to_create]
+
+    def _get_universal_pollrun(self, poll, for_date):
+        """Get or create the poll's universal pollrun for the date, once per sync."""
+        key = (poll.pk, PollRun.objects.get_local_date(self.org, for_date))
+        if key not in self._pollruns:
+            self._pollruns[key] = PollRun.objects.get_or_create_universal(poll=poll, for_date=for_date)
+        return self._pollruns[key]
+
+    def _select_active_responses(self, poll, responses):
+        """
+        If there is more than one response for a contact and pollrun, set the
+        last one created as the active one, in a single statement.
+        """
+        pairs = set((r.pollrun_id, r.contact_id) for r in responses)
+        if not pairs:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(ACTIVE_RESPONSES_SQL.format(
+                pairs=", ".join(["(%s, %s)"] * len(pairs)),
+            ), [value for pair in pairs for value in pair])
+            changed = set(cursor.fetchall())
+
+        # The answers of responses which were (de)activated count, or stop
+        # counting, towards the rollups of their contacts' regions.
+        regions = {r.contact_id: r.contact.region_id for r in responses}
+        self._rollup_keys.update(
+            (question.pk, pollrun_id, regions[contact_id])
+            for pollrun_id, contact_id in changed
+            for question in self._get_questions(poll))
+
+    def _get_questions(self, poll):
+        if poll.pk not in self._questions:
+            self._questions[poll.pk] = list(poll.questions.active())
+        return self._questions[poll.pk]
+
+    def _save_answers(self, poll, run_responses):
+        """
+        Bring the answers of the responses in line with their runs' values
+        for the poll's active questions, keyed by ruleset. Unchanged answers
+        are left alone, changed ones are updated in place, answers with no
+        matching value are removed, and only new ones are inserted.
+        """
+        questions = self._get_questions(poll)
+        responses = {response.pk: response for run, response in run_responses}
+
+        existing = {}
+        to_delete = []
+        previous = Answer.objects.filter(
+            response__in=[response for response in responses.values() if not response.is_new],
+        ).order_by('pk')
+        for answer in previous:
+            answer.response = responses[answer.response_id]
+            key = (answer.response_id, answer.question_id)
+            if key in existing:
+                to_delete.append(answer)
+            else:
+                existing[key] = answer
+
+        to_create = []
+        to_update = []
+        for run, response in run_responses:
+            # organize values by ruleset UUID
+            valuesets_by_ruleset = {value.node: value for value in run.values.itervalues()}
+            for question in questions:
+                valueset = valuesets_by_ruleset.get(question.ruleset_uuid)
+                if not valueset:
+                    continue
+                category = Answer.objects.clean_category(valueset.category)
+                answer = existing.pop((response.pk, question.pk), None)
+                if answer is None:
+                    answer = Answer(response=response, question=question)
+                    to_create.append(answer)
+                elif (answer.value, answer.category, answer.submitted_on) == (
+                        valueset.value, category, valueset.time):
+                    continue
+                else:
+                    # The previous day's same-day values may depend on it.
+                    self._same_day_keys.add(answer.same_day_key())
+                    to_update.append(answer)
+                self._rollup_keys.add(self._rollup_key(answer))
+                answer.value = valueset.value
+                answer.numeric_value = get_numeric_value(valueset.value)
+                answer.category = category
+                answer.submitted_on = valueset.time
+                self._same_day_keys.add(answer.same_day_key())
+
+        to_delete.extend(existing.values())
+        if to_delete:
+            self._same_day_keys.update(a.same_day_key() for a in to_delete)
+            self._rollup_keys.update(self._rollup_key(a) for a in to_delete)
+            Answer.objects.filter(pk__in=[a.pk for a in to_delete]).delete()
+        if to_update:
+            bulk_update(Answer, to_update, ['value', 'numeric_value', 'category', 'submitted_on'])
+        Answer.objects.bulk_create(to_create)
+
+    def _rollup_key(self, answer):
+        """Identify the rollup which the answer counts towards."""
+        response = answer.response
+        return (answer.question_id, response.pollrun_id, response.contact.region_id)
@@ -7,7 +7,7 @@ from optparse import make_option
 
 from django.utils import timezone
 
-from tracpro.orgs_ext.tasks import fetch_runs
+from tracpro.polls.backfill import RunBackfill
 
 
 class Command(BaseCommand):
@@ -30,7 +30,18 @@ class Command(BaseCommand):
                     type='int',
                     dest='days',
                     default=0,
-                    help='Number of previous days to fetch'),)
+                    help='Number of previous days to fetch'),
+        make_option('--workers',
+                    action='store',
+                    type='int',
+                    dest='workers',
+                    default=1,
+                    help='Number of poll days to fetch in parallel'),
+        make_option('--force',
+                    action='store_true',
+                    dest='force',
+                    default=False,
+                    help='Fetch days which a previous run already fetched'),)
 
     help = 'Fetches old responses for the currently active polls'
 
@@ -38,7 +49,8 @@ class Command(BaseCommand):
         org_id = int(args[0]) if args else None
         if not org_id:
             raise CommandError("Must provide valid org id")
-        if not Org.objects.filter(pk=org_id).exists():
+        org = Org.objects.filter(pk=org_id).first()
+        if not org:
             raise CommandError("No such org with id %d" % org_id)
 
         minutes, hours, days = options['minutes'], options['hours'], options['days']
@@ -52,4 +64,11 @@ class Command(BaseCommand):
             days=days)
         since = timezone.now() - howfarback
 
-        fetch_runs(org_id, since)
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        # Fetch in this process, with the same windows as the fetch_runs task.
+        backfill = RunBackfill(org, since, force=options['force'])
+        results = backfill.run(workers=options['workers'])
+        for message in RunBackfill.summarize(results):
+            self.stdout.write(message)
@@ -0,0 +1,25 @@
+from __future__ import absolute_import, unicode_literals
+
+from dash.orgs.models import Org
+from django.core.management.base import BaseCommand, CommandError
+
+from tracpro.polls.models import AnswerRollup
+
+
+class Command(BaseCommand):
+    args = "[org_id]"
+
+    help = 'Recomputes the answer rollups used by charts, for one org or all orgs'
+
+    def handle(self, *args, **options):
+        orgs = Org.objects.order_by('pk')
+        if args:
+            org_id = int(args[0])
+            orgs = orgs.filter(pk=org_id)
+            if not orgs.exists():
+                raise CommandError("No such org with id %d" % org_id)
+
+        for org in orgs:
+            AnswerRollup.objects.rebuild(org)
+            self.stdout.write("Rebuilt %d answer rollups for org #%d" % (
+                AnswerRollup.objects.filter(question__poll__org=org).count(), org.pk))
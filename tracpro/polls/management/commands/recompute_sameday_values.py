@@ -0,0 +1,65 @@
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+from optparse import make_option
+
+import pytz
+
+from dash.orgs.models import Org
+from django.core.management.base import BaseCommand, CommandError
+
+from tracpro.polls.models import Answer, AnswerRollup
+from tracpro.polls.utils import bump_chart_data_version
+
+
+class Command(BaseCommand):
+    args = "org_id [options]"
+    option_list = BaseCommand.option_list + (
+        make_option('--since',
+                    action='store',
+                    dest='since',
+                    default=None,
+                    help='First day (YYYY-MM-DD) of answers to recompute'),
+        make_option('--until',
+                    action='store',
+                    dest='until',
+                    default=None,
+                    help='Last day (YYYY-MM-DD) of answers to recompute'),
+        make_option('--batch-size',
+                    action='store',
+                    type='int',
+                    dest='batch_size',
+                    default=1000,
+                    help='Number of contact/question/day groups to recompute at a time'),)
+
+    help = 'Recomputes the last and summed same-day values of an org\'s answers'
+
+    def parse_date(self, value):
+        """Return midnight UTC of the given date, as answers are grouped by UTC day."""
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').replace(tzinfo=pytz.utc)
+        except ValueError:
+            raise CommandError("Invalid date %r, expected YYYY-MM-DD" % value)
+
+    def handle(self, *args, **options):
+        org_id = int(args[0]) if args else None
+        if not org_id:
+            raise CommandError("Must provide valid org id")
+        if not Org.objects.filter(pk=org_id).exists():
+            raise CommandError("No such org with id %d" % org_id)
+
+        answers = Answer.objects.filter(question__poll__org_id=org_id)
+        if options['since']:
+            answers = answers.filter(submitted_on__gte=self.parse_date(options['since']))
+        if options['until']:
+            until = self.parse_date(options['until']) + datetime.timedelta(days=1)
+            answers = answers.filter(submitted_on__lt=until)
+
+        keys = list(answers.same_day_keys())
+        batch_size = options['batch_size']
+        for start in range(0, len(keys), batch_size):
+            Answer.objects.recompute_same_day(keys[start:start + batch_size])
+            AnswerRollup.objects.refresh_same_day(keys[start:start + batch_size])
+            self.stdout.write("Recomputed %d of %d groups of answers" % (
+                min(start + batch_size, len(keys)), len(keys)))
+        bump_chart_data_version(org_id)
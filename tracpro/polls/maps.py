@@ -1,29 +1,77 @@
 from __future__ import unicode_literals
 
-from collections import Counter
-from itertools import groupby
-from operator import itemgetter
-
-import numpy
-
-from django.db.models import F
+from django.db import connection
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.expressions import RawSQL
 
 from tracpro.charts.formatters import format_number
 
-from .utils import get_numeric_values
 from . import rules
+from .models import Answer, AnswerRollup, Question
+
+
+ROLLUP_CATEGORY_COUNTS_SQL = """
+    SELECT r.question_id, r.boundary, c.pair->>0 AS category, SUM((c.pair->>1)::integer) AS count
+    FROM ({rollups}) AS r
+    CROSS JOIN LATERAL json_array_elements(r.category_counts::json) AS c(pair)
+    WHERE COALESCE(c.pair->>0, '') != ''
+    GROUP BY r.question_id, r.boundary, c.pair->>0
+"""
+
+TOP_CATEGORY_SQL = """
+    SELECT question_id, boundary, category
+    FROM (
+        SELECT question_id, boundary, category,
+               row_number() OVER (
+                   PARTITION BY question_id, boundary ORDER BY count DESC, category COLLATE "C") AS rank
+        FROM ({counts}) AS counts
+    ) AS ranked
+    WHERE rank = 1
+"""
+
+
+def get_map_data(questions, responses, use_rollups=True):
+    """
+    Return the map data of each numeric and multiple choice question, by
+    question id, aggregated by boundary in the database.
 
+    Answers are aggregated from the pre-aggregated answer rollups, unless
+    `use_rollups` is False (e.g. when responses are filtered by contact
+    data, which the rollups don't record).
+    """
+    numeric = [q for q in questions if q.question_type == Question.TYPE_NUMERIC]
+    multiple_choice = [q for q in questions if q.question_type == Question.TYPE_MULTIPLE_CHOICE]
 
-def get_map_data(responses, question):
-    answers = get_answers(responses, question)
+    map_data = {}
+    if numeric:
+        if use_rollups:
+            totals = get_rollups(numeric, responses).values('question', 'boundary').annotate(
+                numeric_count=Sum('numeric_count'), numeric_sum=Sum('numeric_sum'))
+        else:
+            answers = get_answers(numeric, responses)
+            sql, params = answers.numeric_value_sql(numeric)
+            number = RawSQL(sql, params, output_field=FloatField())
+            totals = answers.values('question', 'boundary').annotate(
+                numeric_count=Count(number), numeric_sum=Sum(number))
+        map_data.update(numeric_map_data(numeric, totals))
+
+    if multiple_choice:
+        if use_rollups:
+            rollups = get_rollups(multiple_choice, responses).values('question', 'boundary', 'category_counts')
+            sql, params = rollups.query.sql_with_params()
+            sql = ROLLUP_CATEGORY_COUNTS_SQL.format(rollups=sql)
+        else:
+            answers = get_answers(multiple_choice, responses)
+            answers = answers.exclude(category=None).exclude(category="")
+            counts = answers.values('question', 'boundary', 'category').annotate(count=Count('pk'))
+            sql, params = counts.query.sql_with_params()
+        map_data.update(multiple_choice_map_data(sql, params))
 
-    if question.question_type == question.TYPE_NUMERIC:
-        map_data = numeric_map_data(answers, question)
-    elif question.question_type == question.TYPE_MULTIPLE_CHOICE:
-        map_data = multiple_choice_map_data(answers, question)
-    else:
-        map_data = None
+    return map_data
 
+
+def format_map_data(map_data, question, answers):
+    """Return the map data with all categories of the answers, or None if there is none."""
     if map_data:
         return {
             'map-data': map_data,
@@ -33,47 +81,56 @@ def get_map_data(responses, question):
         return None
 
 
-def get_answers(responses, question):
-    """Return answers to the question from the responses, annotated with `boundary`.
+def get_answers(questions, responses):
+    """Return answers to the questions from the responses, annotated with `boundary`.
 
     Excludes answers that are not associated with a boundary.
     """
-    answers = question.answers.filter(response__in=responses)
+    answers = Answer.objects.filter(question__in=questions, response__in=responses)
     answers = answers.annotate(boundary=F('response__contact__region__boundary'))
     answers = answers.exclude(boundary=None)
-    return answers
+    return answers.order_by()
+
 
+def get_rollups(questions, responses):
+    """Return answer rollups of the questions for the responses, annotated with `boundary`.
 
-def numeric_map_data(answers, question):
-    """For each boundary, display the category of the average answer value."""
+    Excludes rollups of regions that are not associated with a boundary.
+    """
+    rollups = AnswerRollup.objects.filter(question__in=questions).for_responses(responses)
+    rollups = rollups.annotate(boundary=F('region__boundary'))
+    rollups = rollups.exclude(boundary=None)
+    return rollups.order_by()
+
+
+def numeric_map_data(questions, totals):
+    """
+    For each question and boundary, display the category of the average
+    answer value. `totals` are the numeric count and sum of the answers to
+    each question by boundary.
+    """
+    questions = {question.pk: question for question in questions}
     map_data = {}
-    answer_data = [
-        {
-            'boundary': answer.boundary,
-            'value_to_use': answer.value_to_use
-        }
-        for answer in answers.order_by('boundary')
-    ]
-
-    for boundary_id, _answers in groupby(answer_data, itemgetter('boundary')):
-        values = get_numeric_values(a['value_to_use'] for a in _answers)
-        if len(values) > 0:
-            average = round(numpy.mean(values), 2)
-            map_data[boundary_id] = {
+    for total in totals:
+        if total['numeric_count']:
+            question = questions[total['question']]
+            average = round(total['numeric_sum'] / total['numeric_count'], 2)
+            map_data.setdefault(question.pk, {})[total['boundary']] = {
                 'average': format_number(average, digits=2),
                 'category': question.categorize(average),
             }
     return map_data
 
 
-def multiple_choice_map_data(answers, question):
-    """For each boundary, display the most common answer category."""
+def multiple_choice_map_data(sql, params):
+    """
+    For each question and boundary, display the most common answer
+    category. Takes the SQL of the counts of each (question_id, boundary,
+    category). Ties are broken by category name.
+    """
     map_data = {}
-    answer_data = answers.exclude(category=None).exclude(category="")
-    answer_data = answer_data.order_by('boundary').values('boundary', 'category')
-    for boundary_id, _answers in groupby(answer_data, itemgetter('boundary')):
-        top_category = Counter(a['category'] for a in _answers).most_common(1)[0][0]
-        map_data[boundary_id] = {
-            'category': top_category,
-        }
+    with connection.cursor() as cursor:
+        cursor.execute(TOP_CATEGORY_SQL.format(counts=sql), params)
+        for question_id, boundary_id, category in cursor.fetchall():
+            map_data.setdefault(question_id, {})[boundary_id] = {'category': category}
     return map_data
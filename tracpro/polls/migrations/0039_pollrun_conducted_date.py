@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0038_compute_values_for_multiple_answers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollrun',
+            name='conducted_date',
+            field=models.DateField(help_text='The date in the org timezone when the poll was conducted', null=True, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE polls_pollrun
+            SET conducted_date = DATE(polls_pollrun.conducted_on AT TIME ZONE orgs_org.timezone)
+            FROM polls_poll, orgs_org
+            WHERE polls_pollrun.poll_id = polls_poll.id AND polls_poll.org_id = orgs_org.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterIndexTogether(
+            name='pollrun',
+            index_together=set([('poll', 'conducted_date')]),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0009_auto_20170307_1338'),
+        ('polls', '0039_pollrun_conducted_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('answer_count', models.IntegerField(default=0)),
+                ('numeric_count', models.IntegerField(default=0)),
+                ('numeric_sum', models.FloatField(default=0)),
+                ('numeric_sum_squares', models.FloatField(default=0)),
+                ('category_counts', models.TextField(default='[]', help_text='JSON list of [category, number of answers] pairs')),
+                ('pollrun', models.ForeignKey(related_name='answer_rollups', to='polls.PollRun')),
+                ('question', models.ForeignKey(related_name='rollups', to='polls.Question')),
+                ('region', models.ForeignKey(related_name='answer_rollups', to='groups.Region')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='answerrollup',
+            unique_together=set([('question', 'pollrun', 'region')]),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+"""
+Builds the answer rollups of all orgs with a single statement. Equivalent
+to running the rebuild_answer_rollups command for each org.
+"""
+
+NUMERIC_PATTERN = r'^\s*[-+]?([0-9]{1,200}(\.[0-9]{0,200})?|\.[0-9]{1,200})([eE][-+]?[0-9]{1,2})?\s*$'
+
+BUILD_ROLLUPS_SQL = """
+    INSERT INTO polls_answerrollup (
+        question_id, pollrun_id, region_id, answer_count,
+        numeric_count, numeric_sum, numeric_sum_squares, category_counts)
+    SELECT question_id, pollrun_id, region_id, SUM(answer_count),
+           SUM(numeric_count), COALESCE(SUM(numeric_sum), 0), COALESCE(SUM(numeric_sum_squares), 0),
+           json_agg(json_build_array(category, answer_count))::text
+    FROM (
+        SELECT a.question_id, r.pollrun_id, c.region_id, a.category,
+               COUNT(*) AS answer_count, COUNT(v.number) AS numeric_count,
+               SUM(v.number) AS numeric_sum, SUM(v.number * v.number) AS numeric_sum_squares
+        FROM polls_answer a
+        INNER JOIN polls_response r ON r.id = a.response_id AND r.is_active AND r.pollrun_id IS NOT NULL
+        INNER JOIN contacts_contact c ON c.id = r.contact_id AND c.is_active
+        INNER JOIN polls_question q ON q.id = a.question_id
+        INNER JOIN polls_poll p ON p.id = q.poll_id
+        INNER JOIN orgs_org o ON o.id = p.org_id
+        CROSS JOIN LATERAL (
+            SELECT CASE WHEN o.config != '' THEN o.config::json->>'how_to_handle_sameday_responses' END AS policy
+        ) AS s
+        CROSS JOIN LATERAL (
+            SELECT CASE
+                WHEN q.question_type = 'N' AND s.policy = 'sum' THEN a.sum_value
+                WHEN q.question_type = 'N' AND s.policy = 'use_last' THEN a.last_value
+                ELSE a.value END AS value
+        ) AS u
+        CROSS JOIN LATERAL (
+            SELECT CASE WHEN u.value ~ %s THEN u.value::double precision END AS number
+        ) AS v
+        GROUP BY a.question_id, r.pollrun_id, c.region_id, a.category
+    ) AS categories
+    GROUP BY question_id, pollrun_id, region_id
+"""
+
+
+def build_answer_rollups(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(BUILD_ROLLUPS_SQL, [NUMERIC_PATTERN])
+
+
+def delete_answer_rollups(apps, schema_editor):
+    apps.get_model('polls', 'AnswerRollup').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orgs', '0015_auto_20160209_0926'),
+        ('polls', '0040_answerrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_answer_rollups, delete_answer_rollups),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0041_build_answer_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='numeric_last_value',
+            field=models.FloatField(help_text='Last value parsed as a number, if it is numeric', null=True),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='numeric_sum_value',
+            field=models.FloatField(help_text='Sum value parsed as a number, if it is numeric', null=True),
+        ),
+        migrations.AddField(
+            model_name='answer',
+            name='numeric_value',
+            field=models.FloatField(help_text='Value parsed as a number, if it is numeric', null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# Values which can be cast to a double without overflow. New answers are
+# parsed in Python, which also accepts larger exponents.
+NUMERIC_PATTERN = r'^\s*[-+]?([0-9]{1,200}(\.[0-9]{0,200})?|\.[0-9]{1,200})([eE][-+]?[0-9]{1,2})?\s*$'
+
+SET_NUMERIC_VALUES_SQL = """
+    UPDATE polls_answer
+    SET numeric_value = CASE WHEN value ~ %(pattern)s THEN value::double precision END,
+        numeric_last_value = CASE WHEN last_value ~ %(pattern)s THEN last_value::double precision END,
+        numeric_sum_value = CASE WHEN sum_value ~ %(pattern)s THEN sum_value::double precision END
+"""
+
+
+def set_numeric_values(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(SET_NUMERIC_VALUES_SQL, {'pattern': NUMERIC_PATTERN})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0042_answer_numeric_values'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_numeric_values, migrations.RunPython.noop),
+    ]
@@ -1,33 +1,52 @@
 from __future__ import absolute_import, unicode_literals
 
 from collections import Counter
-from itertools import chain, groupby
+from itertools import groupby
 import json
+import logging
 from operator import itemgetter
 
 import numpy as np
 import pytz
 
+from dash.orgs.models import Org
+from dash.utils import get_obj_cacheable
+
 from django.conf import settings
-from django.db import models, transaction
-from django.db.models import Count, Q, F
+from django.db import connection, models, transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.expressions import RawSQL
 from django.utils import timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 
 from tracpro.charts.utils import midnight, end_of_day
 from tracpro.client import get_client
-from tracpro.contacts.models import Contact, NoMatchingCohortsWarning, NoContactInRapidProWarning
-from tracpro.utils import dunder_to_chained_attrs
+from tracpro.contacts.models import Contact
+from tracpro.groups.models import Region
 
 from . import rules
 from .tasks import pollrun_start
-from .utils import extract_words, natural_sort_key, get_numeric_values
+from .utils import (
+    bump_chart_data_version, count_words, natural_sort_key, get_numeric_value,
+    get_numeric_values, histogram_bin_edges, histogram_categories, summarize_by_pollrun,
+    summarize_by_region_and_pollrun)
+
 
+logger = logging.getLogger(__name__)
 
 SAMEDAY_LAST = 'use_last'
 SAMEDAY_SUM = 'sum'
 
+# First key of the Postgres advisory lock taken to create universal pollruns.
+UNIVERSAL_POLLRUN_LOCK = 7001
+
+
+def get_org_timezone(org):
+    if isinstance(org.timezone, basestring):
+        return pytz.timezone(org.timezone)
+    return org.timezone
+
 
 class PollQuerySet(models.QuerySet):
 
@@ -37,6 +56,35 @@ class PollQuerySet(models.QuerySet):
     def by_org(self, org):
         return self.filter(org=org)
 
+    def with_counts(self, region=None, include_subregions=True):
+        """
+        Annotate each poll with the number of its active questions as
+        `question_count`, and the number of its pollruns for the region and
+        the date the last of them was conducted as `pollrun_count` and
+        `last_conducted`, using subqueries of the same query.
+        """
+        pollrun_where = "polls_pollrun.poll_id = polls_poll.id"
+        pollrun_params = []
+        if region:
+            # The pollruns for the region are selected by an uncorrelated
+            # subquery, which is only run once rather than for each poll.
+            region_sql, pollrun_params = PollRun.objects.by_region(
+                region, include_subregions).values('pk').query.sql_with_params()
+            pollrun_where += " AND polls_pollrun.id IN (" + region_sql + ")"
+
+        def pollrun_aggregate(aggregate, output_field):
+            sql = "SELECT " + aggregate + " FROM polls_pollrun WHERE " + pollrun_where
+            return RawSQL(sql, list(pollrun_params), output_field=output_field)
+
+        return self.annotate(
+            question_count=RawSQL(
+                "SELECT COUNT(*) FROM polls_question "
+                "WHERE polls_question.poll_id = polls_poll.id AND polls_question.is_active", [],
+                output_field=models.IntegerField()),
+            pollrun_count=pollrun_aggregate("COUNT(*)", models.IntegerField()),
+            last_conducted=pollrun_aggregate("MAX(polls_pollrun.conducted_on)", models.DateTimeField()),
+        )
+
 
 class PollManager(models.Manager.from_queryset(PollQuerySet)):
 
@@ -65,7 +113,10 @@ class PollManager(models.Manager.from_queryset(PollQuerySet)):
 
         If an invalid UUID is given, a ValueError is raised and the transaction
         is rolled back.
+
+        Returns the list of Polls which were not active before.
         """
+        activated = list(org.polls.filter(flow_uuid__in=uuids, is_active=False))
         active_count = org.polls.filter(flow_uuid__in=uuids).update(is_active=True)
         if active_count != len(uuids):
             invalid_uuids = set(uuids) - set(org.polls.values_list('flow_uuid', flat=True))
@@ -73,6 +124,7 @@ class PollManager(models.Manager.from_queryset(PollQuerySet)):
                 "No Poll for {} matching these UUIDS: {}".format(
                     org.name, invalid_uuids))
         org.polls.exclude(flow_uuid__in=uuids).update(is_active=False)
+        return activated
 
     def sync(self, org):
         """Update the org's Polls from RapidPro."""
@@ -226,6 +278,8 @@ class Question(models.Model):
         """Name should default to the RapidPro name."""
         super(Question, self).__init__(*args, **kwargs)
         self.name = self.name or self.rapidpro_name
+        # The question type saved for the rollups, which depend on it.
+        self._rollup_question_type = self.__dict__.get('question_type')
 
     def __str__(self):
         return self.name
@@ -237,6 +291,19 @@ class Question(models.Model):
                 return rules.get_category(rule)
         return "Other"
 
+    def get_value_field(self):
+        """
+        Return the name of the Answer field whose values are charted for this
+        question, depending on how the org handles same-day responses.
+        """
+        if self.question_type == self.TYPE_NUMERIC:
+            policy = self.poll.org.how_to_handle_sameday_responses
+            if policy == SAMEDAY_SUM:
+                return 'sum_value'
+            elif policy == SAMEDAY_LAST:
+                return 'last_value'
+        return 'value'
+
     def get_rules(self):
         if not hasattr(self, "_rules"):
             self._rules = json.loads(self.json_rules) if self.json_rules else []
@@ -265,10 +332,19 @@ class Question(models.Model):
 
         This allows us to track changes to the name on RapidPro.
         """
+        is_new = self.pk is None
         self.name = "" if self.name == self.rapidpro_name else self.name.strip()
         super(Question, self).save(*args, **kwargs)
         self.name = self.name or self.rapidpro_name
 
+        # Whether numeric values are summed depends on the question type.
+        if not is_new and self.question_type != self._rollup_question_type:
+            AnswerRollup.objects.refresh_questions([self])
+        self._rollup_question_type = self.question_type
+
+        # Charts show the question's name, type and rules.
+        bump_chart_data_version(self.poll.org_id)
+
 
 class PollRunQuerySet(models.QuerySet):
 
@@ -289,10 +365,12 @@ class PollRunQuerySet(models.QuerySet):
         if not region:
             return self.all()
 
+        tree = Region.objects.get_tree(region.org_id)
+
         q = Q(region=region)
 
         # Include PollRuns that include this region as a sub-region.
-        q |= Q(region__in=region.get_ancestors(),
+        q |= Q(region__in=tree.get_ancestor_ids(region.pk),
                pollrun_type=PollRun.TYPE_PROPAGATED)
 
         # Include poll runs that weren't sent to a particular region.
@@ -300,7 +378,7 @@ class PollRunQuerySet(models.QuerySet):
 
         # Include PollRuns that were sent to the region's sub-regions.
         if include_subregions:
-            q |= Q(region__in=region.get_descendants())
+            q |= Q(region__in=tree.get_descendant_ids(region.pk))
 
         return self.filter(q)
 
@@ -312,6 +390,14 @@ class PollRunQuerySet(models.QuerySet):
         return self.filter(pollrun_type__in=types)
 
 
+CONDUCTED_DATE_SQL = """
+    UPDATE polls_pollrun
+    SET conducted_date = DATE(polls_pollrun.conducted_on AT TIME ZONE %s)
+    FROM polls_poll
+    WHERE polls_pollrun.poll_id = polls_poll.id AND polls_poll.org_id = %s
+"""
+
+
 class PollRunManager(models.Manager.from_queryset(PollRunQuerySet)):
 
     def create(self, poll, region=None, **kwargs):
@@ -343,29 +429,38 @@ class PollRunManager(models.Manager.from_queryset(PollRunQuerySet)):
         kwargs['pollrun_type'] = PollRun.TYPE_SPOOFED
         return self.create(**kwargs)
 
+    def get_local_date(self, org, for_date):
+        """Return the date of the given datetime in the org timezone."""
+        return for_date.astimezone(get_org_timezone(org)).date()
+
+    def recompute_conducted_dates(self, org):
+        """Recompute the local dates of the org's pollruns, e.g. after its timezone has changed."""
+        with connection.cursor() as cursor:
+            cursor.execute(CONDUCTED_DATE_SQL, [get_org_timezone(org).zone, org.pk])
+
     def get_or_create_universal(self, poll, for_date=None, **kwargs):
         """Create a poll run that is for all regions."""
         # Get the requested date in the org timezone
         for_date = for_date or timezone.now()
-        if isinstance(poll.org.timezone, basestring):
-            org_timezone = pytz.timezone(poll.org.timezone)
-        else:
-            org_timezone = poll.org.timezone
-        for_local_date = for_date.astimezone(org_timezone).date()
-
-        # look for a non-regional pollrun on that date
-        sql = ('SELECT * FROM polls_pollrun WHERE poll_id = %s AND '
-               'region_id IS NULL AND DATE(conducted_on AT TIME ZONE %s) = %s')
-        params = [poll.pk, org_timezone.zone, for_local_date]
-        existing = list(PollRun.objects.raw(sql, params))
-        if existing:
-            return existing[0]
-
-        kwargs['poll'] = poll
-        kwargs['region'] = None
-        kwargs['pollrun_type'] = PollRun.TYPE_UNIVERSAL
-        kwargs['conducted_on'] = for_date
-        return self.create(**kwargs)
+        for_local_date = self.get_local_date(poll.org, for_date)
+
+        with transaction.atomic():
+            # Runs may be fetched in parallel, so serialize the creation of
+            # the poll's universal pollruns until the transaction ends.
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s, %s)", [UNIVERSAL_POLLRUN_LOCK, poll.pk])
+
+            # look for a non-regional pollrun on that date
+            existing = self.filter(poll=poll, region=None, conducted_date=for_local_date)
+            existing = existing.order_by('pk').first()
+            if existing:
+                return existing
+
+            kwargs['poll'] = poll
+            kwargs['region'] = None
+            kwargs['pollrun_type'] = PollRun.TYPE_UNIVERSAL
+            kwargs['conducted_on'] = for_date
+            return self.create(**kwargs)
 
     def get_all(self, org, region, include_subregions=True):
         """
@@ -377,6 +472,24 @@ class PollRunManager(models.Manager.from_queryset(PollRunQuerySet)):
         qs = qs.by_region(region, include_subregions)
         return qs
 
+    def set_response_counts(self, pollruns, region=None, include_subregions=True):
+        """
+        Count the responses of all the pollruns with one query, and set the
+        counts of each, as returned by `PollRun.get_response_counts`, as its
+        `_response_counts`. Returns the pollruns as a list.
+        """
+        pollruns = list(pollruns)
+        responses = Response.objects.filter(
+            pollrun__in=pollruns,
+            contact__region__is_active=True,
+            contact__is_active=True,
+            is_active=True)
+        status_counts = responses.by_region(region, include_subregions).status_counts('pollrun')
+        for pollrun in pollruns:
+            pollrun._response_counts = {status[0]: 0 for status in Response.STATUS_CHOICES}
+            pollrun._response_counts.update(status_counts.get(pollrun.pk, {}))
+        return pollruns
+
 
 @python_2_unicode_compatible
 class PollRun(models.Model):
@@ -414,17 +527,41 @@ class PollRun(models.Model):
     conducted_on = models.DateTimeField(
         help_text=_("When the poll was conducted"), default=timezone.now)
 
+    conducted_date = models.DateField(
+        null=True, editable=False,
+        help_text=_("The date in the org timezone when the poll was conducted"))
+
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, null=True, related_name="pollruns_created")
 
     objects = PollRunManager()
 
+    class Meta:
+        index_together = [
+            ('poll', 'conducted_date'),
+        ]
+
     def __str__(self):
         return "{poll} ({when})".format(
             poll=self.poll.name,
             when=self.conducted_on.strftime(settings.SITE_DATE_FORMAT),
         )
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'conducted_on' in update_fields:
+            self.conducted_date = PollRun.objects.get_local_date(self.get_org(), self.conducted_on)
+            if update_fields is not None and 'conducted_date' not in update_fields:
+                kwargs['update_fields'] = list(update_fields) + ['conducted_date']
+        super(PollRun, self).save(*args, **kwargs)
+
+    def get_org(self):
+        """Return the poll's org, without loading the poll if it isn't already loaded."""
+        poll = getattr(self, '_poll_cache', None)
+        if poll is not None:
+            return poll.org
+        return Org.objects.get(polls=self.poll_id)
+
     def as_json(self, region=None, include_subregions=True):
         return {
             'id': self.pk,
@@ -434,7 +571,8 @@ class PollRun(models.Model):
             },
             'conducted_on': self.conducted_on,
             'region': {'id': self.region.pk, 'name': self.region.name} if self.region else None,
-            'responses': self.get_response_counts(region, include_subregions),
+            'responses': get_obj_cacheable(
+                self, '_response_counts', lambda: self.get_response_counts(region, include_subregions)),
         }
 
     def covers_region(self, region, include_subregions):
@@ -445,16 +583,18 @@ class PollRun(models.Model):
 
         if self.pollrun_type in (self.TYPE_UNIVERSAL, self.TYPE_SPOOFED):
             return True
+        tree = Region.objects.get_tree(region.org_id)
         if self.pollrun_type == self.TYPE_REGIONAL:
             if include_subregions:
-                return region in self.region.get_ancestors()
+                return tree.is_ancestor_of(region.pk, self.region_id)
             else:  # pragma: nocover
-                return region == self.region
+                return region.pk == self.region_id
         if self.pollrun_type == self.TYPE_PROPAGATED:
             if include_subregions:
-                return region in self.region.get_family()
+                return (tree.is_ancestor_of(region.pk, self.region_id) or
+                        tree.is_ancestor_of(self.region_id, region.pk))
             else:
-                return region in self.region.get_descendants()
+                return tree.is_ancestor_of(self.region_id, region.pk)
 
     def get_responses(self, region=None, include_subregions=True,
                       include_empty=True, include_inactive_responses=False):
@@ -473,12 +613,7 @@ class PollRun(models.Model):
         if not include_inactive_responses:
             # Filter out inactive responses (Multiple responses on same day from same contact)
             responses = responses.filter(is_active=True)
-        if region:
-            if include_subregions:
-                regions = region.get_descendants(include_self=True)
-                responses = responses.filter(contact__region__in=regions)
-            else:
-                responses = responses.filter(contact__region=region)
+        responses = responses.by_region(region, include_subregions)
         if not include_empty:
             responses = responses.exclude(status=Response.STATUS_EMPTY)
         return responses.select_related('contact', 'contact__region').prefetch_related('contact__groups')
@@ -516,13 +651,33 @@ class ResponseQuerySet(models.QuerySet):
     def active(self):
         return self.filter(is_active=True)
 
+    def by_region(self, region, include_subregions=True):
+        """Return all responses by contacts in the region, or its sub-regions if specified."""
+        if not region:
+            return self.all()
+        if include_subregions:
+            tree = Region.objects.get_tree(region.org_id)
+            return self.filter(contact__region__in=tree.get_descendant_ids(region.pk, include_self=True))
+        return self.filter(contact__region=region)
+
     def group_counts(self, *fields):
         """Group responses by the given fields then map to the count of matching responses."""
-        responses = self.order_by(*fields).values(*fields)
-        data = {}
-        for field_values, _responses in groupby(responses, itemgetter(*fields)):
-            data[field_values] = len(list(_responses))
-        return data
+        counts = self.order_by().values(*fields).annotate(count=Count('pk'))
+        key = itemgetter(*fields)
+        return {key(group): group['count'] for group in counts}
+
+    def status_counts(self, field):
+        """
+        Group responses by the given field then map to a dictionary of the
+        number of matching responses with each status, using one query.
+        """
+        statuses = [status for status, name in Response.STATUS_CHOICES]
+        counts = self.order_by().prefetch_related(None).values(field).annotate(**{
+            status: models.Sum(models.Case(
+                models.When(status=status, then=1), default=0, output_field=models.IntegerField()))
+            for status in statuses
+        })
+        return {group[field]: {status: group[status] for status in statuses} for group in counts}
 
 
 class Response(models.Model):
@@ -574,10 +729,46 @@ class Response(models.Model):
         # de-activate any existing responses for this contact
         pollrun.responses.filter(contact=contact).update(is_active=False)
 
-        return Response.objects.create(
+        response = Response.objects.create(
             flow_run_id=run.id, pollrun=pollrun, contact=contact,
             created_on=run.created_on, updated_on=run.created_on,
             status=Response.STATUS_EMPTY)
+        AnswerRollup.objects.refresh_pollruns([pollrun])
+        bump_chart_data_version(org.pk)
+        return response
+
+    @classmethod
+    def create_empties(cls, org, pollrun, runs):
+        """
+        Creates empty responses from a batch of runs, fetching all of their
+        contacts at once. Runs whose contacts can't be fetched are skipped.
+
+        Returns the list of created responses.
+        """
+        runs = list(runs)
+        contacts = Contact.get_or_fetch_many(org, set(run.contact for run in runs))
+        skipped = sorted(uuid for uuid, contact in contacts.items() if not isinstance(contact, Contact))
+        if skipped:
+            logger.warning("Skipping runs of pollrun #%d for contacts which couldn't be fetched: %s" % (
+                pollrun.pk, ", ".join("%s (%s)" % (uuid, contacts[uuid]) for uuid in skipped)))
+        runs = [run for run in runs if isinstance(contacts[run.contact], Contact)]
+        if not runs:
+            return []
+
+        # de-activate any existing responses for these contacts
+        contact_pks = set(contacts[run.contact].pk for run in runs)
+        pollrun.responses.filter(contact__in=contact_pks).update(is_active=False)
+
+        # only the last run for each contact is active
+        last_runs = {run.contact: run for run in runs}
+        responses = [
+            Response(
+                flow_run_id=run.id, pollrun=pollrun, contact=contacts[run.contact],
+                created_on=run.created_on, updated_on=run.created_on,
+                status=Response.STATUS_EMPTY, is_active=last_runs[run.contact] is run)
+            for run in runs]
+        Response.objects.bulk_create(responses)
+        return responses
 
     @classmethod
     def from_run(cls, org, run, poll=None):
@@ -595,97 +786,17 @@ class Response(models.Model):
         :param run: temba Run instance
         :param poll: tracpro Poll instance, or None
         """
+        from .ingest import RunIngester
+
         if not poll:
             poll = Poll.objects.active().by_org(org).get(flow_uuid=run.flow.uuid)
 
-        responses = Response.objects.filter(
-            flow_run_id=run.id,
-            pollrun__poll=poll,
-            contact__uuid=run.contact.uuid,
-            is_active=True,
-        )
-        response = responses.select_related('pollrun').first()
-        run_updated_on = cls.get_run_updated_on(run)
-
-        # if there is an up-to-date existing response for this run, return it
-        if response and response.updated_on == run_updated_on:
-            return response
-
-        try:
-            contact = Contact.get_or_fetch(poll.org, uuid=run.contact.uuid)
-        except NoContactInRapidProWarning as e:
-            # Callers expect an exception if we don't sync the response
-            raise ValueError("not syncing response because %s" % e.args[0], e)
-        except NoMatchingCohortsWarning:
-            # This happens regularly because tracpro users aren't necessarily interested
-            # in all contacts' responses. Just pass it on since we're not going to sync.
-            raise
-
-        # categorize completeness
-        if run.exit_type == u'completed':
-            status = Response.STATUS_COMPLETE
-        elif run.values:
-            status = Response.STATUS_PARTIAL
-        else:
-            status = Response.STATUS_EMPTY
-
-        if response:
-            # clear existing answers which will be replaced
-            response.answers.all().delete()
-
-            response.updated_on = run_updated_on
-            response.status = status
-            response.save(update_fields=('updated_on', 'status'))
-        else:
-            # if we don't have an existing response, then this poll started in
-            # RapidPro and is non-regional
-            pollrun = PollRun.objects.get_or_create_universal(
-                poll=poll,
-                for_date=run.created_on,
-            )
-
-            response, created = Response.objects.update_or_create(
-                flow_run_id=run.id,
-                pollrun=pollrun,
-                defaults=dict(
-                    is_active=True,
-                    contact=contact,
-                    created_on=run.created_on,
-                    updated_on=run_updated_on,
-                    status=status
-                )
-            )
-
-            # If more than one for this contact and pollrun,
-            # set the last one created as the active one.
-            if Response.objects.filter(pollrun=pollrun, contact=contact).count() > 1:
-                # Set them all False, then the one we want true
-                with transaction.atomic():
-                    Response.objects.filter(pollrun=pollrun, contact=contact).update(is_active=False)
-                    last = Response.objects.filter(pollrun=pollrun, contact=contact).order_by('-created_on').first()
-                    last.is_active = True
-                    last.save()
-
-            response.is_new = created
-
-        # organize values by ruleset UUID
-        questions = poll.questions.active()
-        valuesets_by_ruleset = {value.node: value for key, value in run.values.iteritems()}
-        valuesets_by_question = {q: valuesets_by_ruleset.get(q.ruleset_uuid, None)
-                                 for q in questions}
-
-        # convert valuesets to answers
-        for question, valueset in valuesets_by_question.iteritems():
-            if valueset:
-                Answer.objects.create(
-                    response=response,
-                    question=question,
-                    value=valueset.value,
-                    category=valueset.category,
-                    submitted_on=valueset.time,
-                )
-
-        return response
+        ingester = RunIngester(org)
+        responses = ingester.ingest(poll, [run])
+        if ingester.failures:
+            _, error = ingester.failures[0]
+            raise error
+        return responses[0]
 
     @classmethod
     def get_run_updated_on(cls, run):
@@ -698,31 +809,66 @@ class Response(models.Model):
 
         return last_value_on if last_value_on else run.created_on
 
+    @classmethod
+    def get_run_status(cls, run):
+        """Categorize the completeness of a run."""
+        if run.exit_type == u'completed':
+            return Response.STATUS_COMPLETE
+        elif run.values:
+            return Response.STATUS_PARTIAL
+        else:
+            return Response.STATUS_EMPTY
+
+
+SAME_DAY_BATCH_SIZE = 500
+
+# Answers of the same question by the same contact on the same (UTC) day,
+# latest first.
+SAME_DAY_VALUES_SQL = """
+    SELECT k.question_id, k.contact_id, k.day,
+           array_agg(a.value ORDER BY a.submitted_on DESC, a.id DESC)
+    FROM (VALUES {keys}) AS k(question_id, contact_id, day)
+    INNER JOIN polls_response r ON r.contact_id = k.contact_id
+    INNER JOIN polls_answer a ON a.response_id = r.id AND a.question_id = k.question_id
+    WHERE a.submitted_on >= k.day::timestamp AT TIME ZONE 'UTC'
+      AND a.submitted_on < (k.day + 1)::timestamp AT TIME ZONE 'UTC'
+    GROUP BY k.question_id, k.contact_id, k.day
+"""
+
+SAME_DAY_UPDATE_SQL = """
+    UPDATE polls_answer
+    SET last_value = v.last_value, sum_value = COALESCE(v.sum_value, polls_answer.value),
+        numeric_last_value = v.numeric_last_value,
+        numeric_sum_value = CASE WHEN v.sum_value IS NULL THEN polls_answer.numeric_value
+                                 ELSE v.numeric_sum_value END
+    FROM (VALUES {values}) AS v(question_id, contact_id, day, last_value, sum_value,
+                                numeric_last_value, numeric_sum_value),
+         polls_response r
+    WHERE r.id = polls_answer.response_id
+      AND polls_answer.question_id = v.question_id
+      AND r.contact_id = v.contact_id
+      AND polls_answer.submitted_on >= v.day::timestamp AT TIME ZONE 'UTC'
+      AND polls_answer.submitted_on < (v.day + 1)::timestamp AT TIME ZONE 'UTC'
+"""
+
 
 class AnswerQuerySet(models.QuerySet):
 
+    def same_day_keys(self):
+        """
+        Return the distinct (question id, contact id, date) keys of these
+        answers, as accepted by `Answer.objects.recompute_same_day`.
+        """
+        return self.extra(
+            select={'day': "(polls_answer.submitted_on AT TIME ZONE 'UTC')::date"},
+        ).order_by().values_list('question_id', 'response__contact_id', 'day').distinct()
+
     def values_to_use(self):
         return [a.value_to_use for a in self.select_related('response')]
 
     def word_counts(self):
         answers = [(answer.value_to_use, answer.response.contact.language) for answer in self]
-        words = [extract_words(*a) for a in answers]
-        counts = Counter(chain(*words))
-        return counts.most_common(50)
-
-    def group_values(self, *fields):
-        """Group answers by the given fields then map to a list of matching values."""
-        answers = [
-            dict(
-                value_to_use=answer.value_to_use,
-                **{fieldname: dunder_to_chained_attrs(answer, fieldname) for fieldname in fields}
-            )
-            for answer in self.order_by(*fields).select_related('response', 'question__poll__org')
-        ]
-        data = {}
-        for field_values, _answers in groupby(answers, itemgetter(*fields)):
-            data[field_values] = [a['value_to_use'] for a in _answers]
-        return data
+        return count_words(answers)
 
     def category_counts(self):
         categories = self.values_list('category', flat=True)
@@ -735,7 +881,8 @@ class AnswerQuerySet(models.QuerySet):
         on ranges where there are bunches of responses.
 
         See http://numpy.readthedocs.io/en/stable/reference/generated/numpy.histogram.html
-        where we're using the 'sqrt' bin assignment algorithm.
+        where we're using the 'sqrt' bin assignment algorithm. The histogram
+        is computed in the database.
 
         Silently ignores answers where `category` != "numeric", and any whose value
         can't be successfully converted to a float.
@@ -747,35 +894,185 @@ class AnswerQuerySet(models.QuerySet):
 
         Category names are of the form "N.N-N.N".
         """
-        answers_to_numeric_questions = self.filter(question__question_type=Question.TYPE_NUMERIC)
-        answers = get_numeric_values(answers_to_numeric_questions.values_to_use())
-        if not answers:
-            return {
-                'categories': [],
-                'data': [],
-            }
-
-        hist, bin_edges = np.histogram(answers, bins='sqrt')
-        category_names = [
-            "%r-%r" % (round(bin_edges[i], 2), round(bin_edges[i+1], 2))
-            for i in range(len(hist))
-        ]
-        data = list(hist)
+        answers = self.filter(question__question_type=Question.TYPE_NUMERIC)
+        histograms = answers._histograms(by_question=False)
+        return histograms.get(None, histogram_categories([], []))
+
+    def autocategorize_by_question(self, questions=None):
+        """
+        Equivalent of `autocategorize` for the answers to each question, by
+        question id, computed with two queries whatever the number of
+        questions. Questions without numeric answers are left out.
+        """
+        return self._histograms(questions, by_question=True)
+
+    def _histograms(self, questions=None, by_question=True):
+        answers = self.order_by()
+        sql, params = answers.numeric_value_sql(questions)
 
+        def number():
+            return RawSQL(sql, params, output_field=models.FloatField())
+
+        stats = dict(count=Count(number()), minimum=Min(number()), maximum=Max(number()))
+        if by_question:
+            stats = answers.values('question').annotate(**stats)
+        else:
+            stats = [dict(answers.aggregate(**stats), question=None)]
+        bin_edges = {
+            stat['question']: histogram_bin_edges(stat['count'], stat['minimum'], stat['maximum'])
+            for stat in stats if stat['count']
+        }
+        if not bin_edges:
+            return {}
+
+        # Bin on the lower edges, so that values on an edge fall in the same
+        # bin as with numpy. The last bin includes the maximum.
+        buckets = []
+        bucket_params = []
+        for question_id, edges in bin_edges.items():
+            thresholds = [float(edge) for edge in edges[:-1]]
+            bucket = "width_bucket(({})::double precision, ARRAY[{}]::double precision[])".format(
+                sql, ", ".join(["%s"] * len(thresholds)))
+            if by_question:
+                buckets.append("WHEN %s THEN {}".format(bucket))
+                bucket_params.append(question_id)
+            else:
+                buckets.append(bucket)
+            bucket_params.extend(params + thresholds)
+        if by_question:
+            buckets = ["CASE polls_answer.question_id {} END".format(" ".join(buckets))]
+        bucket = RawSQL(buckets[0], bucket_params, output_field=models.IntegerField())
+
+        fields = ['question', 'bucket'] if by_question else ['bucket']
+        hists = {question_id: [0] * (len(edges) - 1) for question_id, edges in bin_edges.items()}
+        for row in answers.annotate(bucket=bucket).values(*fields).annotate(count=Count('pk')):
+            question_id = row['question'] if by_question else None
+            if row['bucket'] is not None and question_id in hists:
+                hists[question_id][row['bucket'] - 1] = row['count']
         return {
-            'categories': category_names,
-            'data': data,
+            question_id: histogram_categories(hist, bin_edges[question_id])
+            for question_id, hist in hists.items()
         }
 
+    def numeric_value_sql(self, questions=None):
+        """
+        Return SQL and params for the numeric value to use of each answer,
+        or NULL if it isn't numeric.
+
+        The field to use for each question is looked up once, rather than
+        the org's same-day policy being checked for every answer. Pass the
+        `questions` of the answers, with their polls and orgs, if known.
+        """
+        if questions is None:
+            questions = Question.objects.filter(pk__in=self.values('question')).select_related('poll__org')
+        cases = []
+        params = []
+        for question in questions:
+            value_field = question.get_value_field()
+            if value_field != 'value':
+                cases.append("WHEN %s THEN polls_answer.numeric_{}".format(value_field))
+                params.append(question.pk)
+        if cases:
+            sql = "CASE polls_answer.question_id {} ELSE polls_answer.numeric_value END".format(" ".join(cases))
+        else:
+            sql = "polls_answer.numeric_value"
+        return sql, params
+
+    def with_numeric_value_to_use(self, questions=None):
+        """Select the numeric value to use of each answer, as `numeric_value_to_use`."""
+        sql, params = self.numeric_value_sql(questions)
+        return self.extra(select={'numeric_value_to_use': sql}, select_params=params)
+
+    def numeric_values_to_use(self):
+        """Return an array of the numeric values to use of the answers, ignoring non-numeric ones."""
+        values = self.with_numeric_value_to_use().values_list('numeric_value_to_use', flat=True)
+        return np.array([value for value in values if value is not None], dtype=float)
+
+    def numeric_totals(self, by_region=False):
+        """
+        Return the number of answers, and the sum, average and population
+        standard deviation of their numeric values to use, computed in the
+        database. Maps pollrun id, or (region id, pollrun id) if
+        `by_region`, to a dictionary of the totals.
+        """
+        fields = ['response__pollrun']
+        if by_region:
+            fields.insert(0, 'response__contact__region')
+
+        sql, params = self.numeric_value_sql()
+
+        def number():
+            return RawSQL(sql, params, output_field=models.FloatField())
+
+        totals = self.order_by().values(*fields).annotate(
+            answer_count=Count('pk'),
+            numeric_sum=models.Sum(number()),
+            numeric_avg=models.Avg(number()),
+            numeric_stdev=models.StdDev(number()),
+        )
+        return {itemgetter(*fields)(total): total for total in totals}
+
+    def numeric_stdevs(self, questions=None, by_region=False):
+        """
+        Return the population standard deviation of the numeric values to
+        use of the answers, computed in the database. Maps (question id,
+        pollrun id), or (question id, region id, pollrun id) if `by_region`,
+        to the standard deviation.
+        """
+        fields = ['question', 'response__pollrun']
+        if by_region:
+            fields.insert(1, 'response__contact__region')
+
+        sql, params = self.numeric_value_sql(questions)
+        stdevs = self.order_by().values(*fields).annotate(
+            numeric_stdev=models.StdDev(RawSQL(sql, params, output_field=models.FloatField())))
+        return {itemgetter(*fields)(stdev): stdev['numeric_stdev'] for stdev in stdevs}
+
+    def category_totals(self, questions=None):
+        """
+        Return the number of answers, and the count, sum and sum of squares
+        of their numeric values to use, computed in the database for each
+        question, contact region, pollrun and category. These are the
+        totals that the answer rollups record, before categories are
+        combined.
+        """
+        sql, params = self.numeric_value_sql(questions)
+
+        def number():
+            return RawSQL(sql, params, output_field=models.FloatField())
+
+        def square():
+            return RawSQL("({0}) * ({0})".format(sql), params * 2, output_field=models.FloatField())
+
+        return self.order_by().values(
+            'question', 'response__contact__region', 'response__pollrun', 'category',
+        ).annotate(
+            answer_count=Count('pk'),
+            numeric_count=Count(number()),
+            numeric_sum=models.Sum(number()),
+            numeric_sum_squares=models.Sum(square()),
+        )
+
+    def summarize_by_pollrun(self, responses):
+        return summarize_by_pollrun(self, responses)
+
+    def summarize_by_region_and_pollrun(self, responses):
+        return summarize_by_region_and_pollrun(self, responses)
+
+    def categories(self):
+        """Return the distinct categories of the answers, ignoring empty ones."""
+        answers = self.exclude(category=None).exclude(category='').order_by('category')
+        return list(answers.values_list('category', flat=True).distinct('category'))
+
     def category_counts_by_pollrun(self):
         """
         Returns list of (categoryname, Counter) tuples, sorted by category name.
         Each Counter breaks down the number of answers per poll run.
         """
         counts = []
-        answers = self.order_by('category').values('category', 'response__pollrun')
-        for category, _answers in groupby(answers, itemgetter('category')):
-            pollrun_counts = Counter(a['response__pollrun'] for a in _answers)
+        groups = self.order_by('category').values('category', 'response__pollrun').annotate(count=Count('pk'))
+        for category, _groups in groupby(groups, itemgetter('category')):
+            pollrun_counts = Counter({g['response__pollrun']: g['count'] for g in _groups})
             counts.append((category, pollrun_counts))
 
         # Order the data by the category name.
@@ -785,7 +1082,44 @@ class AnswerQuerySet(models.QuerySet):
 
 class AnswerManager(models.Manager.from_queryset(AnswerQuerySet)):
 
-    def create(self, category, **kwargs):
+    def recompute_same_day(self, keys):
+        """
+        Recompute `last_value` and `sum_value` of all answers matching the
+        given (question id, contact id, date) keys.
+
+        Returns a dictionary mapping each key to its (last value, sum value).
+        The sum value is None when no answers for the key are numeric, in
+        which case each answer keeps its own value as its sum.
+        """
+        keys = list(set(keys))
+        results = {}
+        for start in range(0, len(keys), SAME_DAY_BATCH_SIZE):
+            batch = keys[start:start + SAME_DAY_BATCH_SIZE]
+            params = [param for key in batch for param in key]
+            with connection.cursor() as cursor:
+                cursor.execute(SAME_DAY_VALUES_SQL.format(
+                    keys=", ".join(["(%s::integer, %s::integer, %s::date)"] * len(batch)),
+                ), params)
+                rows = cursor.fetchall()
+
+            params = []
+            for question_id, contact_id, day, values in rows:
+                float_values = get_numeric_values(values)
+                sum_value = str(sum(float_values)) if float_values else None
+                results[(question_id, contact_id, day)] = (values[0], sum_value)
+                params.extend([question_id, contact_id, day, values[0], sum_value,
+                               get_numeric_value(values[0]), get_numeric_value(sum_value)])
+
+            if rows:
+                with connection.cursor() as cursor:
+                    cursor.execute(SAME_DAY_UPDATE_SQL.format(
+                        values=", ".join(
+                            ["(%s::integer, %s::integer, %s::date, %s::varchar, %s::varchar, "
+                             "%s::double precision, %s::double precision)"] * len(rows)),
+                    ), params)
+        return results
+
+    def clean_category(self, category):
         # category can be a string or a multi-language dict
         if isinstance(category, dict):
             if 'base' in category:
@@ -796,6 +1130,10 @@ class AnswerManager(models.Manager.from_queryset(AnswerQuerySet)):
         if category == 'All Responses':
             category = None
 
+        return category
+
+    def create(self, category, **kwargs):
+        category = self.clean_category(category)
         return super(AnswerManager, self).create(category=category, **kwargs)
 
 
@@ -823,6 +1161,18 @@ class Answer(models.Model):
                   "day for same question. Otherwise, same as value."
     )
 
+    numeric_value = models.FloatField(
+        null=True,
+        help_text="Value parsed as a number, if it is numeric")
+
+    numeric_last_value = models.FloatField(
+        null=True,
+        help_text="Last value parsed as a number, if it is numeric")
+
+    numeric_sum_value = models.FloatField(
+        null=True,
+        help_text="Sum value parsed as a number, if it is numeric")
+
     category = models.CharField(max_length=36, null=True)
     submitted_on = models.DateTimeField(
         help_text=_("When this answer was submitted"))
@@ -831,25 +1181,24 @@ class Answer(models.Model):
 
     def save(self, *args, **kwargs):
         is_new = self.pk is None
+        self.numeric_value = get_numeric_value(self.value)
         super(Answer, self).save(*args, **kwargs)
         if is_new:
             # If there have been multiple answers by the same contact on the same
             # day, we might want to show either the last answer or the sum of the
             # numeric answers, depending on other things. Compute those in advance.
-            answers = self.same_question_contact_and_day().order_by('-submitted_on')
-
-            # This failed once in a test with an index out of range?!  Could not reproduce.
-            last_value = answers[0].value
-
-            self.last_value = last_value
-            float_values = get_numeric_values([a.value for a in answers])
-            if len(float_values) > 0:
-                sum_value = str(sum(float_values))
-                self.sum_value = sum_value
-            else:
-                sum_value = F('value')  # Just use each records' value
-                self.sum_value = self.value
-            answers.update(last_value=last_value, sum_value=sum_value)
+            key = self.same_day_key()
+            self.last_value, sum_value = Answer.objects.recompute_same_day([key])[key]
+            self.sum_value = self.value if sum_value is None else sum_value
+            self.numeric_last_value = get_numeric_value(self.last_value)
+            self.numeric_sum_value = get_numeric_value(self.sum_value)
+            AnswerRollup.objects.refresh_same_day([key])
+            bump_chart_data_version(self.question.poll.org_id)
+
+    def delete(self, *args, **kwargs):
+        super(Answer, self).delete(*args, **kwargs)
+        AnswerRollup.objects.refresh([(self.question_id, self.response.pollrun_id)])
+        bump_chart_data_version(self.question.poll.org_id)
 
     @property
     def org(self):
@@ -857,6 +1206,10 @@ class Answer(models.Model):
             self.cached_org = self.question.poll.org
         return self.cached_org
 
+    def same_day_key(self):
+        """Identify the answers which share this answer's same-day values."""
+        return (self.question_id, self.response.contact_id, self.submitted_on.astimezone(pytz.utc).date())
+
     def same_question_contact_and_day(self):
         return Answer.objects.filter(
             question_id=self.question_id,
@@ -874,6 +1227,16 @@ class Answer(models.Model):
         else:
             return self.value
 
+    @property
+    def numeric_value_to_use(self):
+        """The value to use as a float, or None if it isn't numeric."""
+        if self.should_use_sum():
+            return self.numeric_sum_value
+        elif self.should_use_last():
+            return self.numeric_last_value
+        else:
+            return self.numeric_value
+
     def should_use_sum(self):
         """
         Return true if we should use a sum of response values from
@@ -891,3 +1254,173 @@ class Answer(models.Model):
         """
         return (self.org.how_to_handle_sameday_responses == SAMEDAY_LAST and
                 self.question.question_type == Question.TYPE_NUMERIC)
+
+
+ROLLUP_BATCH_SIZE = 500
+
+# Refreshes of the same (question, pollrun) rollups take this lock, keyed on
+# (question id << 32) | pollrun id. Single bigint keys don't overlap the
+# two-key locks above.
+ROLLUP_LOCK_SQL = "SELECT pg_advisory_xact_lock(key) FROM unnest(%s::bigint[]) AS key"
+
+ROLLUP_DELETE_SQL = """
+    DELETE FROM polls_answerrollup
+    USING (VALUES {keys}) AS k(question_id, pollrun_id, region_id)
+    WHERE polls_answerrollup.question_id = k.question_id
+      AND polls_answerrollup.pollrun_id = k.pollrun_id
+      AND (k.region_id IS NULL OR polls_answerrollup.region_id = k.region_id)
+"""
+
+ROLLUP_INSERT_SQL = """
+    INSERT INTO polls_answerrollup (
+        question_id, pollrun_id, region_id, answer_count,
+        numeric_count, numeric_sum, numeric_sum_squares, category_counts)
+    SELECT question_id, pollrun_id, region_id, SUM(answer_count),
+           SUM(numeric_count), COALESCE(SUM(numeric_sum), 0), COALESCE(SUM(numeric_sum_squares), 0),
+           json_agg(json_build_array(category, answer_count))::text
+    FROM (
+        SELECT k.question_id, k.pollrun_id, c.region_id, a.category,
+               COUNT(*) AS answer_count, COUNT(v.number) AS numeric_count,
+               SUM(v.number) AS numeric_sum, SUM(v.number * v.number) AS numeric_sum_squares
+        FROM (VALUES {keys}) AS k(question_id, pollrun_id, region_id, value_field)
+        INNER JOIN polls_response r ON r.pollrun_id = k.pollrun_id AND r.is_active
+        INNER JOIN contacts_contact c ON c.id = r.contact_id AND c.is_active
+            AND (k.region_id IS NULL OR c.region_id = k.region_id)
+        INNER JOIN polls_answer a ON a.response_id = r.id AND a.question_id = k.question_id
+        CROSS JOIN LATERAL (
+            SELECT CASE k.value_field
+                WHEN 'sum_value' THEN a.numeric_sum_value
+                WHEN 'last_value' THEN a.numeric_last_value
+                ELSE a.numeric_value END AS number
+        ) AS v
+        GROUP BY k.question_id, k.pollrun_id, c.region_id, a.category
+    ) AS categories
+    GROUP BY question_id, pollrun_id, region_id
+"""
+
+ROLLUP_SAME_DAY_GROUPS_SQL = """
+    SELECT DISTINCT a.question_id, r.pollrun_id, c.region_id
+    FROM (VALUES {keys}) AS k(question_id, contact_id, day)
+    INNER JOIN contacts_contact c ON c.id = k.contact_id
+    INNER JOIN polls_response r ON r.contact_id = k.contact_id
+    INNER JOIN polls_answer a ON a.response_id = r.id AND a.question_id = k.question_id
+    WHERE a.submitted_on >= k.day::timestamp AT TIME ZONE 'UTC'
+      AND a.submitted_on < (k.day + 1)::timestamp AT TIME ZONE 'UTC'
+"""
+
+
+class AnswerRollupQuerySet(models.QuerySet):
+
+    def for_responses(self, responses):
+        """Limit to the pollruns and contact regions of the responses."""
+        return self.filter(
+            pollrun__in=responses.values('pollrun'),
+            region__in=responses.values('contact__region'))
+
+
+class AnswerRollupManager(models.Manager.from_queryset(AnswerRollupQuerySet)):
+
+    def refresh(self, keys):
+        """
+        Recompute the rollups of the given (question id, pollrun id) pairs,
+        or of the given regions of them as (question id, pollrun id, region
+        id) keys, from their answers.
+
+        Each pair is locked until the end of the transaction, so that
+        overlapping refreshes wait for each other instead of inserting the
+        same rollups. Pairs are locked in order to avoid deadlocks.
+        """
+        keys = set(tuple(key) + (None,) * (3 - len(key)) for key in keys)
+        # Refreshing all regions of a pair covers each of its regions.
+        whole_pairs = set(key[:2] for key in keys if key[2] is None)
+        keys = sorted(key for key in keys if key[2] is None or key[:2] not in whole_pairs)
+        if not keys:
+            return
+        questions = Question.objects.filter(pk__in=set(key[0] for key in keys)).select_related('poll__org')
+        value_fields = {question.pk: question.get_value_field() for question in questions}
+
+        for start in range(0, len(keys), ROLLUP_BATCH_SIZE):
+            batch = [key for key in keys[start:start + ROLLUP_BATCH_SIZE] if key[0] in value_fields]
+            if not batch:
+                continue
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(ROLLUP_LOCK_SQL, [sorted(set((q << 32) | p for q, p, r in batch))])
+                cursor.execute(ROLLUP_DELETE_SQL.format(
+                    keys=", ".join(["(%s::integer, %s::integer, %s::integer)"] * len(batch)),
+                ), [param for key in batch for param in key])
+                cursor.execute(ROLLUP_INSERT_SQL.format(
+                    keys=", ".join(["(%s::integer, %s::integer, %s::integer, %s)"] * len(batch)),
+                ), [param for q, p, r in batch for param in (q, p, r, value_fields[q])])
+
+    def refresh_pollruns(self, pollruns):
+        """Recompute the rollups of all answers in the pollruns."""
+        pollruns = [getattr(pollrun, 'pk', pollrun) for pollrun in pollruns]
+        answers = Answer.objects.filter(response__pollrun__in=pollruns).order_by()
+        pairs = set(answers.values_list('question_id', 'response__pollrun_id').distinct())
+        pairs.update(self.filter(pollrun__in=pollruns).values_list('question_id', 'pollrun_id'))
+        self.refresh(pairs)
+
+    def refresh_questions(self, questions):
+        """Recompute the rollups of all answers to the questions."""
+        questions = [getattr(question, 'pk', question) for question in questions]
+        answers = Answer.objects.filter(question__in=questions).order_by()
+        pairs = set(answers.values_list('question_id', 'response__pollrun_id').distinct())
+        pairs.update(self.filter(question__in=questions).values_list('question_id', 'pollrun_id'))
+        self.refresh(pairs)
+
+    def refresh_same_day(self, keys):
+        """
+        Recompute the rollups of the answers matching the given (question
+        id, contact id, date) keys, whose same-day values may have changed.
+        """
+        keys = list(set(keys))
+        groups = set()
+        for start in range(0, len(keys), SAME_DAY_BATCH_SIZE):
+            batch = keys[start:start + SAME_DAY_BATCH_SIZE]
+            with connection.cursor() as cursor:
+                cursor.execute(ROLLUP_SAME_DAY_GROUPS_SQL.format(
+                    keys=", ".join(["(%s::integer, %s::integer, %s::date)"] * len(batch)),
+                ), [param for key in batch for param in key])
+                groups.update(cursor.fetchall())
+        self.refresh(groups)
+
+    def refresh_for_contacts(self, contacts):
+        """Recompute the rollups of all answers by the contacts."""
+        answers = Answer.objects.filter(response__contact__in=contacts).order_by()
+        self.refresh(answers.values_list('question_id', 'response__pollrun_id').distinct())
+
+    def rebuild(self, org):
+        """Recompute all rollups of the org."""
+        answers = Answer.objects.filter(question__poll__org=org).order_by()
+        with transaction.atomic():
+            self.filter(question__poll__org=org).delete()
+            self.refresh(answers.values_list('question_id', 'response__pollrun_id').distinct())
+        bump_chart_data_version(org.pk)
+
+
+class AnswerRollup(models.Model):
+    """
+    Pre-aggregated answers to a question in a pollrun, by contact region.
+
+    Only answers of active responses by active contacts are included, and
+    numeric values are those charted for the question (see
+    `Answer.value_to_use`).
+    """
+
+    question = models.ForeignKey('polls.Question', related_name='rollups')
+    pollrun = models.ForeignKey('polls.PollRun', related_name='answer_rollups')
+    region = models.ForeignKey('groups.Region', related_name='answer_rollups')
+    answer_count = models.IntegerField(default=0)
+    numeric_count = models.IntegerField(default=0)
+    numeric_sum = models.FloatField(default=0)
+    numeric_sum_squares = models.FloatField(default=0)
+    category_counts = models.TextField(
+        default='[]',
+        help_text="JSON list of [category, number of answers] pairs")
+
+    objects = AnswerRollupManager()
+
+    class Meta:
+        unique_together = [
+            ('question', 'pollrun', 'region'),
+        ]
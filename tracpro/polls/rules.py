@@ -24,8 +24,8 @@ def get_category(rule):
 def get_all_categories(question, answers=None):
     """Return the names of all possible Answer categories, and Other.
 
-    Pass `answers` to include any categories those Answers have that aren't in
-    the rules.
+    Pass `answers` (or answer rollups) to include any categories those Answers
+    have that aren't in the rules.
     """
     categories = []
 
@@ -38,10 +38,7 @@ def get_all_categories(question, answers=None):
     if answers is not None:
         # Flow definitions change over time.
         # Find any categories that aren't in the rules.
-        extra = answers.exclude(category__in=categories + [''])
-        extra = extra.exclude(category=None)
-        extra = extra.values_list('category', flat=True).distinct('category')
-        categories.extend(list(extra))
+        categories.extend([c for c in answers.categories() if c not in categories])
 
     # The last category should be "Other."
     other = str(_("Other"))  # Evaluate to keep the list JSON serializable.
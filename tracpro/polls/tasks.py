@@ -1,8 +1,12 @@
 from __future__ import absolute_import, unicode_literals
 
+import json
+
 from django.apps import apps
+from django.conf import settings
 from django.utils import timezone
 
+from celery import chord
 from celery.utils.log import get_task_logger
 from djcelery_transactions import task
 from django_redis import get_redis_connection
@@ -12,13 +16,138 @@ from temba_client.utils import parse_iso8601, format_iso8601
 from dash.utils import datetime_to_ms
 
 from tracpro.client import get_client
-from tracpro.contacts.models import Contact, NoMatchingCohortsWarning
+from tracpro.contacts.models import Contact
 from tracpro.orgs_ext.tasks import OrgTask
 
+from .utils import bump_chart_data_version
+
 logger = get_task_logger(__name__)
 
+# Deprecated: runs are now fetched up to a separate time for each poll.
 LAST_FETCHED_RUN_TIME_KEY = 'org:%d:last_fetched_run_time'
 
+POLL_LAST_FETCHED_RUN_TIME_KEY = 'org:%d:flow:%s:last_fetched_run_time'
+
+FETCH_RUNS_CHECKPOINT_KEY = 'org:%d:poll:%d:fetch_runs_checkpoint'
+
+BACKFILL_CHECKPOINT_KEY = 'org:%d:poll:%d:backfill_checkpoint'
+
+POLL_BACKFILL_LOCK = 'poll_backfill:%d'
+
+POLL_BACKFILL_LOCK_TIMEOUT = 60 * 60 * 6  # 6 hours
+
+FETCH_RUNS_CHECKPOINT_TIMEOUT = 60 * 60 * 24 * 7  # 7 days
+
+
+def get_last_fetched_run_time(poll):
+    """
+    Return the time up to which the poll's runs have been fetched, or None
+    if they have never been fetched.
+    """
+    from tracpro.polls.models import PollRun, Response
+
+    redis_connection = get_redis_connection()
+    last_time = redis_connection.get(POLL_LAST_FETCHED_RUN_TIME_KEY % (poll.org_id, poll.flow_uuid))
+    if last_time is None:
+        # Fall back to the watermark shared by all polls of the org, from
+        # before watermarks were tracked per poll.
+        last_time = redis_connection.get(LAST_FETCHED_RUN_TIME_KEY % poll.org_id)
+
+    if last_time is not None:
+        return parse_iso8601(last_time)
+
+    newest_runs = Response.objects.filter(pollrun__poll=poll).order_by('-created_on')
+    newest_runs = newest_runs.exclude(pollrun__pollrun_type=PollRun.TYPE_SPOOFED)
+    newest_run = newest_runs.first()
+    return newest_run.created_on if newest_run else None
+
+
+def fetch_poll_runs(client, ingester, poll, checkpoint_key, after, before):
+    """
+    Fetch and save the poll's runs modified in the given window, one page
+    at a time.
+
+    After each page is saved, the cursor of the next page is stored as a
+    checkpoint so that an interrupted fetch can resume from there.
+    """
+    redis_connection = get_redis_connection()
+    checkpoint = redis_connection.get(checkpoint_key)
+    if checkpoint is not None:
+        # A previous fetch of this poll was interrupted. Finish its
+        # window from where it stopped, then carry on to the end.
+        checkpoint = json.loads(checkpoint)
+        checkpoint_after = parse_iso8601(checkpoint['after']) if checkpoint['after'] else None
+        checkpoint_before = parse_iso8601(checkpoint['before'])
+        windows = [(checkpoint_after, checkpoint_before, checkpoint['cursor'])]
+        if checkpoint_before < before:
+            windows.append((checkpoint_before, before, None))
+    else:
+        windows = [(after, before, None)]
+
+    num_runs = 0
+    for window_after, window_before, cursor in windows:
+        query = client.get_runs(flow=poll.flow_uuid, after=window_after, before=window_before, responded=True)
+        fetches = query.iterfetches(retry_on_rate_exceed=True, resume_cursor=cursor)
+        for page in fetches:
+            # convert flow "runs" (one per responding contact) into poll responses
+            num_runs += ingester.ingest_all(poll, page)
+
+            next_cursor = fetches.get_cursor()
+            if next_cursor:
+                checkpoint = {
+                    'after': format_iso8601(window_after) if window_after else None,
+                    'before': format_iso8601(window_before),
+                    'cursor': next_cursor,
+                }
+                redis_connection.set(checkpoint_key, json.dumps(checkpoint), ex=FETCH_RUNS_CHECKPOINT_TIMEOUT)
+
+    redis_connection.delete(checkpoint_key)
+    return num_runs
+
+
+def log_ingest_failures(ingester):
+    """Log the runs which couldn't be saved and return the error messages."""
+    errors = []
+    for run, error in ingester.failures:
+        # NoMatchingCohorts happens normally so don't complain about that.
+        if isinstance(error, ValueError):
+            txt = "Unable to save flow run #%d for contact due to error: %s" % (run.id, error.message)
+            logger.error(txt)
+            errors.append(txt)
+    return errors
+
+
+def fetch_new_poll_runs(client, ingester, poll, until):
+    """
+    Fetch and save the poll's runs modified since they were last fetched, up
+    to `until`. Returns the number of runs fetched.
+    """
+    redis_connection = get_redis_connection()
+    backfill_checkpoint = redis_connection.get(BACKFILL_CHECKPOINT_KEY % (poll.org_id, poll.pk))
+    if backfill_checkpoint and not redis_connection.exists(POLL_BACKFILL_LOCK % poll.pk):
+        # The poll's backfill was interrupted, so restart it.
+        before = parse_iso8601(json.loads(backfill_checkpoint)['before'])
+        backfill_poll_runs.delay(poll.pk, before)
+
+    last_time = get_last_fetched_run_time(poll)
+    checkpoint_key = FETCH_RUNS_CHECKPOINT_KEY % (poll.org_id, poll.pk)
+    num_runs = fetch_poll_runs(client, ingester, poll, checkpoint_key, last_time, until)
+    redis_connection.set(
+        POLL_LAST_FETCHED_RUN_TIME_KEY % (poll.org_id, poll.flow_uuid), format_iso8601(until))
+
+    logger.info("Fetched %d new and updated runs for poll #%d (since=%s)"
+                % (num_runs, poll.pk, format_iso8601(last_time) if last_time else 'Never'))
+    return num_runs
+
+
+def set_fetch_runs_result(org, total_runs):
+    from tracpro.orgs_ext.constants import TaskType
+
+    logger.info("Fetched %d new and updated runs for org #%d" % (total_runs, org.id))
+
+    task_result = dict(time=datetime_to_ms(timezone.now()), counts=dict(fetched=total_runs))
+    org.set_task_result(TaskType.fetch_runs, task_result)
+
 
 class FetchOrgRuns(OrgTask):
 
@@ -26,61 +155,154 @@ class FetchOrgRuns(OrgTask):
         """
         Fetches new and modified flow runs for the given org and creates/updates
         poll responses.
+
+        If settings.FETCH_RUNS_FAN_OUT is set, each poll is fetched by its own
+        FetchPollRuns task instead, and the counts are recorded once they have
+        all finished.
         """
-        from tracpro.orgs_ext.constants import TaskType
-        from tracpro.polls.models import Poll, PollRun, Response
+        from tracpro.polls.ingest import RunIngester
+        from tracpro.polls.models import Poll
 
-        errors = []
+        polls = Poll.objects.active().by_org(org)
 
-        client = get_client(org)
-        redis_connection = get_redis_connection()
-        last_time_key = LAST_FETCHED_RUN_TIME_KEY % org.pk
-        last_time = redis_connection.get(last_time_key)
-
-        if last_time is not None:
-            last_time = parse_iso8601(last_time)
-        else:
-            newest_runs = Response.objects.filter(pollrun__poll__org=org).order_by('-created_on')
-            newest_runs = newest_runs.exclude(pollrun__pollrun_type=PollRun.TYPE_SPOOFED)
-            newest_run = newest_runs.first()
-            last_time = newest_run.created_on if newest_run else None
+        if settings.FETCH_RUNS_FAN_OUT:
+            header = [FetchPollRuns().si(org.pk, poll.pk) for poll in polls]
+            if header:
+                chord(header)(record_fetch_runs_result.s(org.pk))
+            return []
 
+        client = get_client(org)
         until = timezone.now()
 
+        ingester = RunIngester(org)
         total_runs = 0
-        for poll in Poll.objects.active().by_org(org):
-            poll_runs = client.get_runs(flow=poll.flow_uuid, after=last_time, before=until, responded=True)
-            total_runs += len(poll_runs.all())
+        for poll in polls:
+            total_runs += fetch_new_poll_runs(client, ingester, poll, until)
 
-            # convert flow "runs" (one per responding contact) into poll responses
-            for run in poll_runs:
-                try:
-                    Response.from_run(org, run, poll=poll)
-                except NoMatchingCohortsWarning:
-                    # NoMatchingCohorts happens normally so don't complain about that.
-                    pass
-                except ValueError as e:
-                    txt = "Unable to save flow run #%d for contact due to error: %s" % (run.id, e.message)
-                    logger.error(txt)
-                    errors.append(txt)
-
-        logger.info("Fetched %d new and updated runs for org #%d (since=%s)"
-                    % (total_runs, org.id, format_iso8601(last_time) if last_time else 'Never'))
-
-        task_result = dict(time=datetime_to_ms(timezone.now()), counts=dict(fetched=total_runs))
-        org.set_task_result(TaskType.fetch_runs, task_result)
-
-        redis_connection.set(last_time_key, format_iso8601(until))
+        errors = log_ingest_failures(ingester)
+        set_fetch_runs_result(org, total_runs)
         return errors
 
 
+class FetchPollRuns(OrgTask):
+    """
+    Fetches new and modified flow runs for a single poll of an org.
+
+    The lock, rate limit and failure count are kept separately for each poll,
+    so that a slow flow doesn't hold up the org's other polls.
+    """
+
+    def get_cache_scope(self, org, poll_pk):
+        return '{}:poll:{}'.format(org.pk, poll_pk)
+
+    def org_task(self, org, poll_pk):
+        from tracpro.polls.ingest import RunIngester
+        from tracpro.polls.models import Poll
+
+        poll = Poll.objects.active().by_org(org).filter(pk=poll_pk).first()
+        if poll is None:
+            # The poll was deactivated after the task was queued.
+            self.log_info(org, "Skipping poll #{poll} as it is no longer active.", poll=poll_pk)
+            return None
+
+        ingester = RunIngester(org)
+        num_runs = fetch_new_poll_runs(get_client(org), ingester, poll, timezone.now())
+        return dict(fetched=num_runs, errors=log_ingest_failures(ingester))
+
+
+@task
+def record_fetch_runs_result(results, org_pk):
+    """
+    Record the combined counts of the FetchPollRuns tasks for an org, and
+    return their combined error messages.
+    """
+    org = apps.get_model('orgs', 'Org').objects.get(pk=org_pk)
+    # Results are None for polls which were skipped by their lock or rate limit.
+    results = [result for result in results if result]
+    total_runs = sum(result['fetched'] for result in results)
+    errors = [error for result in results for error in result['errors']]
+    if errors:
+        logger.error("Unable to save %d flow runs for org #%d:\n%s" % (len(errors), org.pk, "\n".join(errors)))
+    set_fetch_runs_result(org, total_runs)
+    return errors
+
+
+def start_poll_backfills(polls):
+    """
+    Fetch the history of newly activated polls in the background.
+
+    Polls which have been fetched before are caught up by FetchOrgRuns as
+    usual. Those fetched before watermarks were tracked per poll have their
+    watermark seeded from the org's. The others are backfilled up to now.
+
+    The backfill is recorded as a checkpoint of the poll, so that
+    FetchOrgRuns restarts it if the task is lost.
+    """
+    if not polls:
+        return
+
+    redis_connection = get_redis_connection()
+    now = timezone.now()
+    for poll in polls:
+        key = POLL_LAST_FETCHED_RUN_TIME_KEY % (poll.org_id, poll.flow_uuid)
+        if redis_connection.exists(key):
+            continue
+        legacy_time = redis_connection.get(LAST_FETCHED_RUN_TIME_KEY % poll.org_id)
+        if legacy_time is not None and poll.pollruns.exists():
+            redis_connection.set(key, legacy_time, nx=True)
+        else:
+            checkpoint = {'after': None, 'before': format_iso8601(now), 'cursor': None}
+            redis_connection.set(
+                BACKFILL_CHECKPOINT_KEY % (poll.org_id, poll.pk), json.dumps(checkpoint),
+                ex=FETCH_RUNS_CHECKPOINT_TIMEOUT, nx=True)
+            backfill_poll_runs.delay(poll.pk, now)
+
+
+@task
+def backfill_poll_runs(poll_id, before):
+    """
+    Fetches all runs of a poll modified before the given time.
+
+    The poll's watermark is set to that time, if it has none yet, so that
+    FetchOrgRuns only fetches the runs modified since. The poll's questions
+    are synced first so that answers can be saved for them.
+    """
+    from tracpro.polls.ingest import RunIngester
+    from tracpro.polls.models import Poll
+
+    poll = Poll.objects.select_related('org').get(pk=poll_id)
+    redis_connection = get_redis_connection()
+    lock = redis_connection.lock(POLL_BACKFILL_LOCK % poll.pk, timeout=POLL_BACKFILL_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        logger.info("Skipping backfill of poll #%d as it is already running" % poll.pk)
+        return
+
+    try:
+        checkpoint_key = BACKFILL_CHECKPOINT_KEY % (poll.org_id, poll.pk)
+        if not redis_connection.exists(checkpoint_key):
+            logger.info("Skipping backfill of poll #%d as it has finished" % poll.pk)
+            return
+
+        redis_connection.set(
+            POLL_LAST_FETCHED_RUN_TIME_KEY % (poll.org_id, poll.flow_uuid), format_iso8601(before), nx=True)
+        sync_questions_categories(poll.org, [poll])
+
+        ingester = RunIngester(poll.org)
+        num_runs = fetch_poll_runs(get_client(poll.org), ingester, poll, checkpoint_key, None, before)
+        log_ingest_failures(ingester)
+    finally:
+        lock.release()
+
+    logger.info("Backfilled %d runs for poll #%d" % (num_runs, poll.pk))
+
+
 @task
 def pollrun_start(pollrun_id):
     """
     Starts a newly created pollrun by creating runs in RapidPro and creating
     empty responses for them.
     """
-    from tracpro.polls.models import PollRun, Response
+    from tracpro.polls.models import AnswerRollup, PollRun, Response
 
     pollrun = PollRun.objects.select_related('poll', 'region').get(pk=pollrun_id)
     if pollrun.pollrun_type not in (PollRun.TYPE_PROPAGATED, PollRun.TYPE_REGIONAL):
@@ -107,8 +329,10 @@ def pollrun_start(pollrun_id):
         )
         contact_uuids = contact_uuids[100:]
 
-    for run in runs:
-        Response.create_empty(org, pollrun, run)
+    Response.create_empties(org, pollrun, runs)
+    # Previous responses of the contacts no longer count.
+    AnswerRollup.objects.refresh_pollruns([pollrun])
+    bump_chart_data_version(org.pk)
 
     logger.info("Created %d new runs for new poll pollrun #%d" % (len(runs), pollrun.pk))
 
@@ -119,7 +343,7 @@ def pollrun_restart_participants(pollrun_id, contact_uuids):
     Restarts the given contacts in the given poll pollrun by replacing any
     existing response they have with an empty one.
     """
-    from tracpro.polls.models import PollRun, Response
+    from tracpro.polls.models import AnswerRollup, PollRun, Response
 
     pollrun = PollRun.objects.select_related('poll', 'region').get(pk=pollrun_id)
     if pollrun.pollrun_type not in (PollRun.TYPE_REGIONAL, PollRun.TYPE_PROPAGATED):
@@ -133,12 +357,28 @@ def pollrun_restart_participants(pollrun_id, contact_uuids):
 
     runs = client.create_flow_start(
         flow=pollrun.poll.flow_uuid, contacts=contact_uuids, restart_participants=True)
-    for run in runs:
-        Response.create_empty(org, pollrun, run)
+    Response.create_empties(org, pollrun, runs)
+    AnswerRollup.objects.refresh_pollruns([pollrun])
+    bump_chart_data_version(org.pk)
 
     logger.info("Created %d restart runs for poll pollrun #%d" % (len(runs), pollrun.pk))
 
 
+@task
+def rebuild_answer_rollups(org_id):
+    """
+    Recomputes all answer rollups of the org, e.g. after it has changed how
+    same-day responses are handled.
+    """
+    from tracpro.polls.models import AnswerRollup
+
+    org = apps.get_model('orgs', 'Org').objects.get(pk=org_id)
+    AnswerRollup.objects.rebuild(org)
+    bump_chart_data_version(org.pk)
+
+    logger.info("Rebuilt answer rollups for org #%d" % org.pk)
+
+
 class SyncOrgPolls(OrgTask):
 
     def org_task(self, org):
@@ -0,0 +1,121 @@
+from __future__ import unicode_literals
+
+import datetime
+from StringIO import StringIO
+
+import mock
+import pytz
+import redis
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from tracpro.test import factories
+from tracpro.test.cases import TracProDataTest
+
+from ..backfill import RunBackfill, BACKFILL_TIMEOUT
+from ..models import Response
+
+
+class TestRunBackfill(TracProDataTest):
+
+    def setUp(self):
+        super(TestRunBackfill, self).setUp()
+        self.since = datetime.datetime(2016, 3, 1, 15, 0, tzinfo=pytz.UTC)
+        self.until = datetime.datetime(2016, 3, 3, 12, 0, tzinfo=pytz.UTC)
+        self.backfill = RunBackfill(self.unicef, self.since, self.until)
+
+        # Tests use the dummy cache, so point the backfill at the test redis db.
+        self.redis = redis.StrictRedis(host='localhost', db=10)
+        redis_patcher = mock.patch('tracpro.polls.backfill.get_redis_connection', return_value=self.redis)
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+
+        self.get_runs = self.mock_temba_client.get_runs
+        self.get_runs.return_value.iterfetches.side_effect = lambda **kwargs: iter([
+            [factories.TembaRun(id=run_id, flow__uuid='F-001', contact__uuid=uuid, exit_type='')]
+            for run_id, uuid in ((1, 'C-001'), (2, 'C-002'))
+        ])
+
+    def test_get_windows(self):
+        self.assertEqual(self.backfill.get_windows(), [
+            (self.poll1.pk, datetime.datetime(2016, 3, 1, tzinfo=pytz.UTC),
+             datetime.datetime(2016, 3, 2, tzinfo=pytz.UTC)),
+            (self.poll1.pk, datetime.datetime(2016, 3, 2, tzinfo=pytz.UTC),
+             datetime.datetime(2016, 3, 3, tzinfo=pytz.UTC)),
+            (self.poll1.pk, datetime.datetime(2016, 3, 3, tzinfo=pytz.UTC), self.until),
+        ])
+
+    def test_fetch_window(self):
+        windows = self.backfill.get_windows()
+        self.backfill.start(windows)
+
+        result = self.backfill.fetch_window(*windows[0])
+        self.assertEqual(result, {
+            'poll': self.poll1.pk, 'fetched': 2, 'created': 2, 'updated': 0, 'errors': []})
+        self.get_runs.assert_called_with(flow='F-001', after=windows[0][1], before=windows[0][2])
+        self.assertEqual(Response.objects.count(), 2)
+
+        progress = RunBackfill.get_progress(self.unicef)
+        self.assertEqual(progress['since'], self.since)
+        self.assertEqual((progress['total'], progress['done'], progress['failed'], progress['runs']),
+                         (3, 1, 0, 2))
+
+        # The last window hasn't ended, so is fetched again next time.
+        self.backfill.fetch_window(*windows[2])
+        self.assertEqual(self.backfill.get_windows(), windows[1:])
+
+    def test_fetch_window_failure(self):
+        self.backfill.start([])
+        self.get_runs.side_effect = Exception("Boom")
+        result = self.backfill.fetch_window(*self.backfill.get_windows()[0])
+        self.assertEqual(len(result['errors']), 1)
+        self.assertEqual(RunBackfill.get_progress(self.unicef)['failed'], 1)
+        self.assertFalse(self.redis.exists(self.backfill.done_key))
+
+    def test_run(self):
+        results = self.backfill.run()
+        self.assertEqual(len(results), 3)
+        # The same runs were fetched for each window.
+        self.assertEqual(Response.objects.count(), 2)
+        self.assertEqual(RunBackfill.summarize(results), [
+            "Fetched 6 runs for poll F-001.",
+            "Created 2 new responses and updated 4 existing responses.",
+        ])
+
+        # Only the unfinished window is fetched again.
+        self.get_runs.reset_mock()
+        self.assertEqual(len(self.backfill.run()), 1)
+        self.assertEqual(self.get_runs.call_count, 1)
+        self.assertEqual(RunBackfill.get_progress(self.unicef)['total'], 1)
+
+    def test_run_forced(self):
+        self.backfill.run()
+        self.get_runs.reset_mock()
+        self.assertEqual(len(RunBackfill(self.unicef, self.since, self.until, force=True).run()), 3)
+        self.assertEqual(self.get_runs.call_count, 3)
+
+    def test_done_windows_per_backfill(self):
+        self.backfill.run()
+        self.assertLessEqual(self.redis.ttl(self.backfill.done_key), BACKFILL_TIMEOUT)
+
+        # A backfill since another day fetches its windows again.
+        since = self.since - datetime.timedelta(days=1)
+        self.assertEqual(len(RunBackfill(self.unicef, since, self.until).get_windows()), 4)
+
+    def test_fetchruns_command(self):
+        stdout = StringIO()
+        call_command('fetchruns', str(self.unicef.pk), days=1, stdout=stdout)
+        self.assertEqual(Response.objects.count(), 2)
+        self.assertIn("Fetched 4 runs for poll F-001.", stdout.getvalue())
+
+        # Only the unfinished window is fetched again, unless forced.
+        stdout = StringIO()
+        call_command('fetchruns', str(self.unicef.pk), days=1, stdout=stdout)
+        self.assertIn("Fetched 2 runs for poll F-001.", stdout.getvalue())
+        stdout = StringIO()
+        call_command('fetchruns', str(self.unicef.pk), days=1, force=True, stdout=stdout)
+        self.assertIn("Fetched 4 runs for poll F-001.", stdout.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('fetchruns', str(self.unicef.pk), days=1, workers=0)
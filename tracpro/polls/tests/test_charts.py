@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 
 from tracpro.test import factories
 from tracpro.test.cases import TracProTest
@@ -75,11 +76,25 @@ class PollChartTest(TracProTest):
         self.pollruns = models.PollRun.objects.filter(pk=self.pollrun.pk)
         self.responses = models.Response.objects.filter(pollrun=self.pollrun)
 
+    def multiple_pollruns(self, question, split_regions=False, contact_filters=None):
+        """Return the chart type, data and summary table of the question over the pollruns."""
+        questions = models.Question.objects.filter(pk=question.pk)
+        poll_charts = charts.PollCharts(questions, self.responses, contact_filters)
+        (_, chart_type, chart_data, map_data, summary_table), = poll_charts.multiple_pollruns(
+            self.pollruns, split_regions)
+        return chart_type, chart_data, summary_table
+
+    def single_pollrun(self, question, contact_filters=None):
+        """Return the chart type, data and summary table of the question for the pollrun."""
+        questions = models.Question.objects.filter(pk=question.pk)
+        poll_charts = charts.PollCharts(questions, self.responses, contact_filters)
+        (_, chart_type, chart_data, map_data, summary_table), = poll_charts.single_pollrun(self.pollrun)
+        return chart_type, chart_data, summary_table
+
     def test_multiple_pollruns_multiple_choice(self):
-        answers = models.Answer.objects.filter(question=self.question1)
-        data, summary_table = charts.multiple_pollruns_multiple_choice(
-            self.pollruns, answers, self.responses, contact_filters={})
+        chart_type, data, summary_table = self.multiple_pollruns(self.question1)
 
+        self.assertEqual(chart_type, "multiple-choice")
         self.assertEqual(
             data['dates'],
             [self.pollrun.conducted_on.strftime('%Y-%m-%d')])
@@ -91,17 +106,16 @@ class PollChartTest(TracProTest):
         ])
 
     def test_word_cloud_data(self):
-        answers = models.Answer.objects.filter(question=self.question2)
-        data = charts.word_cloud_data(answers)
+        chart_type, data, summary_table = self.multiple_pollruns(self.question2)
+
+        self.assertEqual(chart_type, "open-ended")
         self.assertEqual(data, [
             {"text": "rainy", "weight": 3},
             {"text": "sunny", "weight": 2},
         ])
 
     def test_multiple_pollruns_numeric(self):
-        chart_type, data, summary_table = charts.multiple_pollruns(
-            self.pollruns, self.responses, self.question3, split_regions=False,
-            contact_filters={})
+        chart_type, data, summary_table = self.multiple_pollruns(self.question3)
         summary_data = dict(summary_table)
 
         self.assertEqual(chart_type, "numeric")
@@ -150,9 +164,7 @@ class PollChartTest(TracProTest):
         # Remove an answer, thus changing the response rate.
         self.response1.answers.get(question=self.question3).delete()
 
-        chart_type, data, summary_table = charts.multiple_pollruns(
-            self.pollruns, self.responses, self.question3, split_regions=False,
-            contact_filters={})
+        chart_type, data, summary_table = self.multiple_pollruns(self.question3)
         summary_data = dict(summary_table)
 
         self.assertEqual(chart_type, "numeric")
@@ -165,9 +177,7 @@ class PollChartTest(TracProTest):
         self.assertEqual(summary_data['Response rate average (%)'], 66.7)
 
     def test_multiple_pollruns_numeric_split(self):
-        chart_type, data, summary_table = charts.multiple_pollruns(
-            self.pollruns, self.responses, self.question3, split_regions=True,
-            contact_filters={})
+        chart_type, data, summary_table = self.multiple_pollruns(self.question3, split_regions=True)
         summary_data = dict(summary_table)
 
         self.assertEqual(chart_type, "numeric")
@@ -227,9 +237,9 @@ class PollChartTest(TracProTest):
         self.assertEqual(summary_data['Response rate average (%)'], 100.0)
 
     def test_single_pollrun_multiple_choice(self):
-        answers = models.Answer.objects.filter(question=self.question1)
-        data = charts.single_pollrun_multiple_choice(answers, self.pollrun)
+        chart_type, data, summary_table = self.single_pollrun(self.question1)
 
+        self.assertEqual(chart_type, 'bar')
         self.assertEqual(
             data['data'],
             [2, 1])
@@ -238,8 +248,7 @@ class PollChartTest(TracProTest):
             ['1 - 5', '6 - 10'])
 
     def test_single_pollrun_open(self):
-        chart_type, chart_data, summary_table = charts.single_pollrun(
-            self.pollrun, self.responses, self.question2)
+        chart_type, chart_data, summary_table = self.single_pollrun(self.question2)
 
         self.assertEqual(chart_type, 'open-ended')
         self.assertEqual(chart_data[0], {'text': 'rainy', 'weight': 3})
@@ -252,8 +261,7 @@ class PollChartTest(TracProTest):
         self.question3.save()
         # Answers for question 3 = 8, 3 and 4
         # Average = 5, Response Rate = 100%, STDEV = 2.2
-        chart_type, chart_data, summary_table = charts.single_pollrun(
-            self.pollrun, self.responses, self.question3)
+        chart_type, chart_data, summary_table = self.single_pollrun(self.question3)
         summary_data = dict(summary_table)
 
         self.assertEqual(chart_type, 'bar')
@@ -264,3 +272,92 @@ class PollChartTest(TracProTest):
         # Results are autocategorized
         self.assertEqual([2, 1], chart_data['data'])
         self.assertEqual(2, len(chart_data['categories']))
+
+    def test_rollups_match_answers(self):
+        # Contact data filters can't be applied to rollups, so answers are
+        # charted instead.
+        self.region1.boundary = factories.Boundary(org=self.org)
+        self.region1.save()
+        questions = models.Question.objects.filter(poll=self.poll).order_by('pk')
+        contact_filters = {'contact_gender': 'f'}
+        for split_regions in (False, True):
+            from_rollups = charts.PollCharts(questions, self.responses)
+            from_answers = charts.PollCharts(questions, self.responses, contact_filters)
+            # Chart links keep the contact data filters.
+            self.assertEqual(
+                [d[:2] + d[3:] for d in from_rollups.multiple_pollruns(self.pollruns, split_regions)],
+                [d[:2] + d[3:] for d in from_answers.multiple_pollruns(self.pollruns, split_regions)])
+
+        from_rollups = charts.PollCharts(questions, self.responses)
+        from_answers = charts.PollCharts(questions, self.responses, contact_filters)
+        self.assertEqual(
+            from_rollups.single_pollrun(self.pollrun),
+            from_answers.single_pollrun(self.pollrun))
+
+    def test_stdev_computed_in_database(self):
+        # The variance of large values is lost to rounding when computed
+        # from their sum of squares.
+        for answer, value in zip(self.question3.answers.order_by('pk'), [0.1, 0.3, 0.2]):
+            answer.value = str(1e9 + value)
+            answer.save()
+        questions = models.Question.objects.filter(pk=self.question3.pk)
+        poll_charts = charts.PollCharts(questions, self.responses, {'contact_gender': 'f'})
+        poll_charts._load(poll_charts.questions, histograms=False)
+        answers = poll_charts.answers[self.question3.pk]
+        self.assertAlmostEqual(answers.numeric_totals()[self.pollrun.pk]['numeric_stdev'], 0.0816, places=4)
+        self.assertAlmostEqual(
+            answers.numeric_totals(by_region=True)[(self.region1.pk, self.pollrun.pk)]['numeric_stdev'],
+            0.1, places=4)
+
+    def test_poll_charts_queries(self):
+        questions = models.Question.objects.filter(poll=self.poll)
+        poll_charts = charts.PollCharts(questions, self.responses)
+        # Pollruns, response counts, regions, rollups and open-ended answers.
+        with self.assertNumQueries(5):
+            data = poll_charts.multiple_pollruns(self.pollruns, split_regions=True)
+        self.assertEqual([chart_type for _, chart_type, _, _, _ in data],
+                         ['multiple-choice', 'open-ended', 'numeric'])
+
+        # The number of queries doesn't depend on the number of questions.
+        for i in range(3):
+            factories.Question(poll=self.poll, question_type=models.Question.TYPE_MULTIPLE_CHOICE)
+        poll_charts = charts.PollCharts(questions.all(), self.responses)
+        with self.assertNumQueries(5):
+            self.assertEqual(len(poll_charts.multiple_pollruns(self.pollruns, split_regions=True)), 6)
+
+    def test_poll_charts_single_pollrun_queries(self):
+        questions = models.Question.objects.filter(poll=self.poll)
+        poll_charts = charts.PollCharts(questions, self.responses)
+        # Response counts, regions, rollups, histogram bins and counts, and
+        # open-ended answers.
+        with self.assertNumQueries(6):
+            data = poll_charts.single_pollrun(self.pollrun)
+        self.assertEqual([chart_type for _, chart_type, _, _, _ in data],
+                         ['bar', 'open-ended', 'bar'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_poll_charts_cache(self):
+        questions = models.Question.objects.filter(poll=self.poll)
+
+        def get_data(split_regions=False, cache_scope=[None, False]):
+            poll_charts = charts.PollCharts(questions.all(), self.responses, cache_scope=cache_scope)
+            return poll_charts.multiple_pollruns(self.pollruns, split_regions)
+
+        data = get_data()
+        # Questions, pollruns and the cached data.
+        with self.assertNumQueries(2):
+            self.assertEqual(get_data(), data)
+
+        # Each set of parameters is cached separately.
+        with self.assertNumQueries(6):
+            get_data(split_regions=True)
+        with self.assertNumQueries(6):
+            get_data(cache_scope=[self.region1.pk, True])
+
+        # Editing a question changes the org's chart data version.
+        self.question3.name = "Rainfall"
+        self.question3.save()
+        data = get_data()
+        self.assertEqual(data[2][2]['sum'][0]['name'], "Rainfall")
+        with self.assertNumQueries(2):
+            self.assertEqual(get_data(), data)
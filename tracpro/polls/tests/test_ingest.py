@@ -0,0 +1,299 @@
+# coding=utf-8
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import json
+
+import mock
+import pytz
+
+from django.db import connection
+
+from tracpro.contacts.models import NoMatchingCohortsWarning
+from tracpro.test import factories
+from tracpro.test.cases import TracProDataTest
+
+from ..ingest import RunIngester
+from ..models import Answer, AnswerRollup, PollRun, Response
+
+
+def make_run(id, contact, values=(), exit_type='completed', created_on=None, flow='F-001'):
+    return factories.TembaRun(
+        id=id,
+        flow__uuid=flow,
+        contact__uuid=contact,
+        exit_type=exit_type,
+        values={
+            node: factories.TembaRunValue(node=node, value=value, category=category, time=time)
+            for node, value, category, time in values
+        },
+        created_on=created_on or datetime.datetime(2014, 1, 2, 3, 4, 5, 6, pytz.UTC),
+    )
+
+
+class TestRunIngester(TracProDataTest):
+
+    def setUp(self):
+        super(TestRunIngester, self).setUp()
+        self.ingester = RunIngester(self.unicef)
+        self.time1 = datetime.datetime(2014, 1, 2, 4, 0, 0, 0, pytz.UTC)
+        self.time2 = datetime.datetime(2014, 1, 2, 5, 0, 0, 0, pytz.UTC)
+
+    def test_ingest_batch(self):
+        runs = [
+            make_run(1, 'C-001', values=[
+                ('RS-001', "6", "1 - 50", self.time1),
+                ('RS-002', "rain", dict(base="Rain", rwa="Imvura"), self.time2),
+            ]),
+            make_run(2, 'C-002', exit_type='foo', values=[
+                ('RS-001', "3", "All Responses", self.time1),
+            ]),
+            make_run(3, 'C-003', exit_type=''),
+        ]
+        responses = self.ingester.ingest(self.poll1, runs)
+
+        self.assertEqual(len(responses), 3)
+        self.assertTrue(all(r.is_new for r in responses))
+        self.assertEqual(self.ingester.created, 3)
+        self.assertEqual(self.ingester.updated, 0)
+        self.assertEqual(self.ingester.failures, [])
+
+        # All runs were on the same day so they share a universal pollrun.
+        self.assertEqual(PollRun.objects.count(), 1)
+        pollrun = PollRun.objects.get()
+        self.assertEqual(pollrun.pollrun_type, PollRun.TYPE_UNIVERSAL)
+
+        response1 = Response.objects.get(flow_run_id=1)
+        self.assertEqual(response1.contact, self.contact1)
+        self.assertEqual(response1.pollrun, pollrun)
+        self.assertEqual(response1.status, Response.STATUS_COMPLETE)
+        self.assertEqual(response1.updated_on, self.time2)
+        answers = list(response1.answers.order_by('question__order'))
+        self.assertEqual([a.value for a in answers], ["6", "rain"])
+        self.assertEqual([a.category for a in answers], ["1 - 50", "Rain"])
+        self.assertEqual([a.last_value for a in answers], ["6", "rain"])
+        self.assertEqual([a.numeric_value for a in answers], [6.0, None])
+        self.assertEqual([a.numeric_sum_value for a in answers], [6.0, None])
+
+        response2 = Response.objects.get(flow_run_id=2)
+        self.assertEqual(response2.status, Response.STATUS_PARTIAL)
+        self.assertIsNone(response2.answers.get().category)
+
+        response3 = Response.objects.get(flow_run_id=3)
+        self.assertEqual(response3.status, Response.STATUS_EMPTY)
+        self.assertEqual(response3.updated_on, response3.created_on)
+        self.assertFalse(response3.answers.exists())
+
+    def test_ingest_bumps_chart_data_version(self):
+        with mock.patch('tracpro.polls.ingest.bump_chart_data_version') as bump_chart_data_version:
+            self.ingester.ingest(self.poll1, [make_run(1, 'C-001', exit_type='')])
+            bump_chart_data_version.assert_called_once_with(self.unicef.pk)
+
+            # Nothing changed the second time.
+            self.ingester.ingest(self.poll1, [make_run(1, 'C-001', exit_type='')])
+            self.assertEqual(bump_chart_data_version.call_count, 1)
+
+    def test_universal_pollruns_memoised(self):
+        self.ingester.ingest(self.poll1, [make_run(1, 'C-001', exit_type='')])
+        with self.assertNumQueries(0):
+            pollrun = self.ingester._get_universal_pollrun(self.poll1, self.time1)
+        self.assertEqual(pollrun, Response.objects.get(flow_run_id=1).pollrun)
+
+    def test_universal_pollruns_resolved_before_batch_transaction(self):
+        """The lock taken to create a pollrun is not held for the whole batch."""
+        depth = len(connection.savepoint_ids)
+        depths = []
+        get_or_create_universal = PollRun.objects.get_or_create_universal
+
+        def get_pollrun(*args, **kwargs):
+            depths.append(len(connection.savepoint_ids))
+            return get_or_create_universal(*args, **kwargs)
+
+        with mock.patch.object(PollRun.objects, 'get_or_create_universal', side_effect=get_pollrun):
+            self.ingester.ingest(self.poll1, [make_run(1, 'C-001', exit_type='')])
+        self.assertEqual(depths, [depth])
+
+    def test_ingest_updated_run(self):
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', exit_type='foo', values=[
+                ('RS-001', "6", "1 - 50", self.time1),
+            ]),
+        ])
+        response = Response.objects.get(flow_run_id=1)
+        self.assertEqual(response.status, Response.STATUS_PARTIAL)
+
+        # The same run again is left alone.
+        responses = self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', exit_type='foo', values=[
+                ('RS-001', "6", "1 - 50", self.time1),
+            ]),
+        ])
+        self.assertEqual(responses, [response])
+        self.assertFalse(responses[0].is_new)
+
+        # The run has progressed in RapidPro.
+        responses = self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', values=[
+                ('RS-001', "7", "1 - 50", self.time1),
+                ('RS-002', "sunny", "Sunny", self.time2),
+            ]),
+        ])
+        self.assertEqual(responses, [response])
+        response.refresh_from_db()
+        self.assertEqual(response.status, Response.STATUS_COMPLETE)
+        self.assertEqual(response.updated_on, self.time2)
+        self.assertEqual(
+            sorted(response.answers.values_list('value', flat=True)), ["7", "sunny"])
+        self.assertEqual(Answer.objects.count(), 2)
+        self.assertEqual(self.ingester.created, 1)
+        self.assertEqual(self.ingester.updated, 2)
+
+    def test_ingest_updated_run_diffs_answers(self):
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', exit_type='foo', values=[
+                ('RS-001', "6", "1 - 50", self.time1),
+            ]),
+        ])
+        answer1 = Answer.objects.get(question=self.poll1_question1)
+
+        # Unchanged answers are kept and new ones added.
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', exit_type='foo', values=[
+                ('RS-001', "6", "1 - 50", self.time1),
+                ('RS-002', "rain", "Rain", self.time2),
+            ]),
+        ])
+        self.assertEqual(Answer.objects.get(question=self.poll1_question1), answer1)
+        answer2 = Answer.objects.get(question=self.poll1_question2)
+
+        # Changed answers are updated in place, and missing ones removed.
+        time3 = datetime.datetime(2014, 1, 2, 6, 0, 0, 0, pytz.UTC)
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', values=[
+                ('RS-002', "sunny", "Sunny", time3),
+            ]),
+        ])
+        self.assertFalse(Answer.objects.filter(question=self.poll1_question1).exists())
+        answer = Answer.objects.get(question=self.poll1_question2)
+        self.assertEqual(answer.pk, answer2.pk)
+        self.assertEqual(answer.value, "sunny")
+        self.assertIsNone(answer.numeric_value)
+        self.assertEqual(answer.category, "Sunny")
+        self.assertEqual(answer.submitted_on, time3)
+        self.assertEqual(answer.last_value, "sunny")
+
+    def test_ingest_selects_last_created_response(self):
+        earlier = datetime.datetime(2014, 1, 2, 3, 0, 0, 0, pytz.UTC)
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-003', exit_type=''),
+            make_run(2, 'C-003', exit_type='', created_on=earlier),
+        ])
+        self.assertTrue(Response.objects.get(flow_run_id=1).is_active)
+        self.assertFalse(Response.objects.get(flow_run_id=2).is_active)
+
+        later = datetime.datetime(2014, 1, 2, 6, 0, 0, 0, pytz.UTC)
+        self.ingester.ingest(self.poll1, [make_run(3, 'C-003', exit_type='', created_on=later)])
+        self.assertEqual(
+            list(Response.objects.filter(is_active=True).values_list('flow_run_id', flat=True)), [3])
+
+    def test_ingest_upserts_on_run_and_pollrun(self):
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-002', values=[('RS-001', "6", "1 - 50", self.time1)]),
+        ])
+        response = Response.objects.get(flow_run_id=1)
+        Response.objects.filter(pk=response.pk).update(is_active=False)
+
+        # The run's inactive response is re-used, even for another contact.
+        responses = self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', values=[('RS-001', "4", "1 - 50", self.time1)]),
+            make_run(1, 'C-001', values=[('RS-001', "5", "1 - 50", self.time1)]),
+        ])
+        self.assertEqual(responses, [response])
+        self.assertFalse(responses[0].is_new)
+        response.refresh_from_db()
+        self.assertTrue(response.is_active)
+        self.assertEqual(response.contact, self.contact1)
+        self.assertEqual(list(response.answers.values_list('value', flat=True)), ["5"])
+        self.assertEqual(Response.objects.count(), 1)
+
+    def test_ingest_same_day_values(self):
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', values=[('RS-001', "6", "1 - 50", self.time1)]),
+            make_run(2, 'C-001', values=[('RS-001', "4", "1 - 50", self.time2)]),
+        ])
+        answers = Answer.objects.filter(question=self.poll1_question1)
+        self.assertEqual(set(answers.values_list('last_value', flat=True)), {"4"})
+        self.assertEqual(set(answers.values_list('sum_value', flat=True)), {"10.0"})
+
+    def get_rollups(self):
+        return sorted(
+            (question_id, pollrun_id, region_id, answer_count, numeric_sum, sorted(json.loads(category_counts)))
+            for question_id, pollrun_id, region_id, answer_count, numeric_sum, category_counts
+            in AnswerRollup.objects.values_list(
+                'question', 'pollrun', 'region', 'answer_count', 'numeric_sum', 'category_counts'))
+
+    def assertRollupsMatchAnswers(self):
+        rollups = self.get_rollups()
+        AnswerRollup.objects.rebuild(self.unicef)
+        self.assertEqual(rollups, self.get_rollups())
+
+    def test_ingest_refreshes_changed_rollups(self):
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', values=[('RS-001', "6", "1 - 50", self.time1)]),
+            make_run(2, 'C-003', values=[('RS-001', "4", "1 - 50", self.time1)]),
+        ])
+        self.assertRollupsMatchAnswers()
+        pollrun = PollRun.objects.get()
+
+        # Only the rollups of the changed answers are refreshed.
+        with mock.patch.object(AnswerRollup.objects, 'refresh', wraps=AnswerRollup.objects.refresh) as refresh:
+            self.ingester.ingest(self.poll1, [
+                make_run(1, 'C-001', values=[
+                    ('RS-001', "7", "1 - 50", self.time1),
+                    ('RS-002', "rain", "Rain", self.time2),
+                ]),
+            ])
+        self.assertEqual(set(refresh.call_args_list[0][0][0]), {
+            (self.poll1_question1.pk, pollrun.pk, self.region1.pk),
+            (self.poll1_question2.pk, pollrun.pk, self.region1.pk),
+        })
+        self.assertRollupsMatchAnswers()
+
+        # Answers are removed, responses re-used for other contacts, and
+        # contacts' earlier responses deactivated.
+        Response.objects.filter(flow_run_id=2).update(is_active=False)
+        self.ingester.ingest(self.poll1, [
+            make_run(1, 'C-001', values=[('RS-002', "sun", "Sunny", self.time2)]),
+            make_run(2, 'C-001', values=[('RS-001', "5", "1 - 50", self.time2)],
+                     created_on=self.time2),
+        ])
+        self.assertRollupsMatchAnswers()
+
+    def test_ingest_failures(self):
+        # The mock client returns a contact which is in no regions.
+        runs = [
+            make_run(1, 'C-001', values=[('RS-001', "6", "1 - 50", self.time1)]),
+            make_run(2, 'C-999', values=[('RS-001', "6", "1 - 50", self.time1)]),
+        ]
+        responses = self.ingester.ingest(self.poll1, runs)
+        self.assertEqual([r.flow_run_id for r in responses], [1])
+        self.assertEqual(len(self.ingester.failures), 1)
+        run, error = self.ingester.failures[0]
+        self.assertEqual(run.id, 2)
+        self.assertIsInstance(error, NoMatchingCohortsWarning)
+
+    def test_ingest_all(self):
+        runs = [make_run(i, 'C-00%d' % (i % 5 + 1), exit_type='') for i in range(1, 8)]
+        self.assertEqual(self.ingester.ingest_all(self.poll1, iter(runs), batch_size=3), 7)
+        self.assertEqual(Response.objects.count(), 7)
+        self.assertEqual(Response.objects.filter(is_active=True).count(), 5)
+
+    def test_from_run(self):
+        run = make_run(1, 'C-001', values=[('RS-001', "6", "1 - 50", self.time1)])
+        response = Response.from_run(self.unicef, run)
+        self.assertTrue(response.is_new)
+        self.assertEqual(response.answers.count(), 1)
+        self.assertEqual(Response.from_run(self.unicef, run, poll=self.poll1), response)
+
+        with self.assertRaises(NoMatchingCohortsWarning):
+            Response.from_run(self.unicef, make_run(2, 'C-999'))
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 from tracpro.test import factories
 from tracpro.test.cases import TracProTest
 
+from .. import charts
 from .. import maps
 from .. import models
 
@@ -38,6 +39,13 @@ class BaseMapsTest(TracProTest):
         return factories.Answer(
             question=question or self.question, response=response, **kwargs)
 
+    def get_map_data(self, responses, contact_filters=None):
+        """Return the map data of the question, as charted for the pollrun."""
+        questions = models.Question.objects.filter(pk=self.question.pk)
+        poll_charts = charts.PollCharts(questions, responses, contact_filters)
+        (question, chart_type, chart_data, map_data, summary_table), = poll_charts.single_pollrun(self.pollrun)
+        return map_data
+
     def _create_region(self, boundary):
         """Wrapper to create a region for the boundary."""
         return factories.Region(org=self.org, boundary=boundary)
@@ -70,7 +78,7 @@ class TestGetAnswers(BaseMapsTest):
             question=factories.Question(poll=self.poll),
             response=answer1.response)
 
-        answers = maps.get_answers(self.pollrun.responses.all(), self.question)
+        answers = maps.get_answers([self.question], self.pollrun.responses.all())
         self.assertEqual(len(answers), 4, answers)
         self.assertIn(answer1, answers)
         self.assertIn(answer2, answers)
@@ -87,7 +95,7 @@ class TestGetAnswers(BaseMapsTest):
         """Return no answers if the responses have no associated Boundaries."""
         # Ensure that a related answer exists.
         self._create_answer(boundary=None)
-        answers = maps.get_answers(self.pollrun.responses.all(), self.question)
+        answers = maps.get_answers([self.question], self.pollrun.responses.all())
         self.assertEqual(len(answers), 0)
 
 
@@ -113,20 +121,20 @@ class TestNumericMapData(BaseMapsTest):
         """Returns None if an empty response queryset is passed."""
         # Ensure that a relevant answer exists.
         self._create_answer(boundary=self.boundary_a)
-        data = maps.get_map_data(self.pollrun.responses.none(), self.question)
+        data = self.get_map_data(self.pollrun.responses.none())
         self.assertEqual(data, None)
 
     def test_numeric__no_boundaries(self):
         """Responses not associated with a boundary should be filtered out."""
         self._create_answer(boundary=None)
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(data, None)
 
     def test_numeric__multiple_regions_per_boundary(self):
         """Responses should be grouped by Boundary rather than region."""
         self._create_answer(boundary=self.boundary_a, category="1-5", value="3")
         self._create_answer(boundary=self.boundary_a, category=">5", value="11")
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['1-5', '>5', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -141,7 +149,7 @@ class TestNumericMapData(BaseMapsTest):
         region = self._create_region(self.boundary_a)
         self._create_answer(region=region, category="1-5", value="3")
         self._create_answer(region=region, category=">5", value="11")
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['1-5', '>5', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -155,7 +163,7 @@ class TestNumericMapData(BaseMapsTest):
         """Categorize average as "Other" if no rule matches."""
         self._create_answer(boundary=self.boundary_a, category="1-5", value="3")
         self._create_answer(boundary=self.boundary_a, category="", value="-5")
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['1-5', '>5', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -169,7 +177,7 @@ class TestNumericMapData(BaseMapsTest):
         """Non-numeric answers should be silently ignored."""
         self._create_answer(boundary=self.boundary_a, category="1-5", value="3")
         self._create_answer(boundary=self.boundary_a, category="1-5", value="invalid")
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['1-5', '>5', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -195,7 +203,7 @@ class TestNumericMapData(BaseMapsTest):
             question=factories.Question(poll=self.poll),
             region=region_a1, category="zero", value="0")
 
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['1-5', '>5', 'foo', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -209,6 +217,17 @@ class TestNumericMapData(BaseMapsTest):
             },
         })
 
+        # Rollups, or answers when filtering by contact data, are aggregated
+        # by boundary with one query.
+        questions = list(models.Question.objects.filter(pk=self.question.pk).select_related('poll__org'))
+        for use_rollups in (True, False):
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    maps.get_map_data(questions, self.pollrun.responses.all(), use_rollups),
+                    {self.question.pk: data['map-data']})
+        self.assertEqual(
+            self.get_map_data(self.pollrun.responses.all(), {'contact_gender': 'f'}), data)
+
 
 class TestCategoryMapData(BaseMapsTest):
 
@@ -227,20 +246,20 @@ class TestCategoryMapData(BaseMapsTest):
         """Returns None if an empty response queryset is passed."""
         # Ensure that a relevant answer exists.
         self._create_answer(boundary=self.boundary_a, category='orange')
-        data = maps.get_map_data(self.pollrun.responses.none(), self.question)
+        data = self.get_map_data(self.pollrun.responses.none())
         self.assertEqual(data, None)
 
     def test_multiple_choice__no_boundaries(self):
         """Responses not associated with a boundary should be filtered out."""
         self._create_answer(boundary=None, category='orange')
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(data, None)
 
     def test_multiple_choice__no_category(self):
         """Answers with a null or blank category should be ignored."""
         self._create_answer(boundary=self.boundary_a, category='')
         self._create_answer(boundary=self.boundary_a, category=None)
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(data, None)
 
     def test_multiple_choice__disregard_no_category(self):
@@ -248,7 +267,7 @@ class TestCategoryMapData(BaseMapsTest):
         self._create_answer(boundary=self.boundary_a, category='red')
         self._create_answer(boundary=self.boundary_a, category='')
         self._create_answer(boundary=self.boundary_a, category='')
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['orange', 'red', 'purple', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -262,7 +281,7 @@ class TestCategoryMapData(BaseMapsTest):
         self._create_answer(boundary=self.boundary_a, category='orange')
         self._create_answer(boundary=self.boundary_a, category='orange')
         self._create_answer(boundary=self.boundary_a, category='red')
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['orange', 'red', 'purple', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -277,7 +296,7 @@ class TestCategoryMapData(BaseMapsTest):
         self._create_answer(region=region, category='orange')
         self._create_answer(region=region, category='red')
         self._create_answer(region=region, category='red')
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['orange', 'red', 'purple', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -291,7 +310,7 @@ class TestCategoryMapData(BaseMapsTest):
         self._create_answer(boundary=self.boundary_a, category='red')
         self._create_answer(boundary=self.boundary_a, category='foo')
         self._create_answer(boundary=self.boundary_a, category='foo')
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['orange', 'red', 'purple', 'foo', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -318,7 +337,7 @@ class TestCategoryMapData(BaseMapsTest):
             question=factories.Question(poll=self.poll),
             region=region_a1, category="bar")
 
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertEqual(set(data), set(('all-categories', 'map-data')))
         self.assertEqual(data['all-categories'], ['orange', 'red', 'purple', 'foo', 'Other'])
         self.assertEqual(data['map-data'], {
@@ -330,6 +349,29 @@ class TestCategoryMapData(BaseMapsTest):
             },
         })
 
+        # Rollups, or answers when filtering by contact data, are aggregated
+        # by boundary with one query.
+        questions = list(models.Question.objects.filter(pk=self.question.pk).select_related('poll__org'))
+        for use_rollups in (True, False):
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    maps.get_map_data(questions, self.pollrun.responses.all(), use_rollups),
+                    {self.question.pk: data['map-data']})
+        self.assertEqual(
+            self.get_map_data(self.pollrun.responses.all(), {'contact_gender': 'f'}), data)
+
+    def test_multiple_choice__tied_categories(self):
+        """Ties for the most common category are broken by category name."""
+        region = self._create_region(self.boundary_a)
+        for category in ("red", "orange", "orange", "red"):
+            self._create_answer(region=region, category=category)
+
+        responses = self.pollrun.responses.all()
+        expected = {self.boundary_a.pk: {'category': 'orange'}}
+        self.assertEqual(self.get_map_data(responses)['map-data'], expected)
+        self.assertEqual(
+            self.get_map_data(responses, {'contact_gender': 'f'})['map-data'], expected)
+
 
 class TestOpenEndedMapData(BaseMapsTest):
 
@@ -344,5 +386,5 @@ class TestOpenEndedMapData(BaseMapsTest):
         """Map data is only supported for numeric and multiple choice questions."""
         # Ensure that a relevant answer exists.
         self._create_answer(boundary=self.boundary_a)
-        data = maps.get_map_data(self.pollrun.responses.all(), self.question)
+        data = self.get_map_data(self.pollrun.responses.all())
         self.assertIsNone(data)
@@ -3,17 +3,22 @@ from __future__ import absolute_import, unicode_literals
 
 import datetime
 import json
+from StringIO import StringIO
+import threading
 
 import mock
+import numpy
 
 import pytz
 
 from unittest import skip
 
 from django.utils.timezone import now
-from temba_client.v2.types import Run
+from temba_client.v2.types import Contact, Run
 
-from django.db import IntegrityError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TransactionTestCase
 from django.utils import timezone
 
 from tracpro.polls.models import SAMEDAY_LAST
@@ -21,7 +26,9 @@ from tracpro.test import factories
 from tracpro.test.cases import TracProTest, TracProDataTest
 
 from ..models import Poll, PollRun, Response, SAMEDAY_SUM
+from .. import charts
 from .. import models
+from .. import utils
 
 
 class TestPollQuerySet(TracProTest):
@@ -39,6 +46,33 @@ class TestPollQuerySet(TracProTest):
         factories.Poll()
         self.assertEqual(list(models.Poll.objects.by_org(org)), [poll])
 
+    def test_with_counts(self):
+        org = factories.Org()
+        region1 = factories.Region(org=org)
+        region2 = factories.Region(org=org, parent=region1)
+        region3 = factories.Region(org=org)
+        poll1 = factories.Poll(org=org)
+        poll2 = factories.Poll(org=org)
+        factories.Question(poll=poll1, is_active=True)
+        factories.Question(poll=poll1, is_active=False)
+        factories.UniversalPollRun(poll=poll1, conducted_on=datetime.datetime(2016, 1, 1, tzinfo=pytz.UTC))
+        factories.RegionalPollRun(
+            poll=poll1, region=region2, conducted_on=datetime.datetime(2016, 2, 1, tzinfo=pytz.UTC))
+        factories.RegionalPollRun(
+            poll=poll1, region=region3, conducted_on=datetime.datetime(2016, 3, 1, tzinfo=pytz.UTC))
+
+        for region, include_subregions in [(None, True), (region1, True), (region1, False), (region3, True)]:
+            polls = models.Poll.objects.by_org(org).with_counts(region, include_subregions).order_by('pk')
+            with self.assertNumQueries(1):
+                polls = list(polls)
+            for poll in polls:
+                pollruns = poll.pollruns.by_region(region, include_subregions)
+                last_pollrun = pollruns.order_by('-conducted_on').first()
+                self.assertEqual(poll.question_count, poll.questions.active().count())
+                self.assertEqual(poll.pollrun_count, pollruns.count())
+                self.assertEqual(poll.last_conducted, last_pollrun.conducted_on if last_pollrun else None)
+            self.assertEqual(polls, [poll1, poll2])
+
 
 class TestPollManager(TracProTest):
 
@@ -56,7 +90,10 @@ class TestPollManager(TracProTest):
         polls.append(factories.Poll(org=other_org, is_active=True, flow_uuid='4'))
         polls.append(factories.Poll(org=other_org, is_active=False, flow_uuid='5'))
 
-        models.Poll.objects.set_active_for_org(org, ['0', '2'])
+        activated = models.Poll.objects.set_active_for_org(org, ['0', '2'])
+
+        # Only newly active polls are returned.
+        self.assertEqual(activated, [polls[2]])
 
         # Refresh from database.
         polls = [models.Poll.objects.get(pk=p.pk) for p in polls]
@@ -353,6 +390,8 @@ class PollRunTest(TracProDataTest):
             self.assertEqual(
                 pollrun3.conducted_on,
                 datetime.datetime(2014, 1, 1, 20, 0, 0, 0, pytz.utc))
+            self.assertEqual(pollrun1.conducted_date, datetime.date(2014, 1, 1))
+            self.assertEqual(pollrun3.conducted_date, datetime.date(2014, 1, 2))
 
         # 2014-Jan-02 04:30 in org's Afg timezone
         with mock.patch.object(timezone, 'now') as mock_now:
@@ -361,6 +400,28 @@ class PollRunTest(TracProDataTest):
             pollrun4 = PollRun.objects.get_or_create_universal(self.poll1)
             self.assertEqual(pollrun3, pollrun4)
 
+    def test_save_conducted_date(self):
+        pollrun = factories.UniversalPollRun(
+            poll=self.poll1, conducted_on=datetime.datetime(2014, 1, 1, 12, tzinfo=pytz.UTC))
+        self.assertEqual(pollrun.conducted_date, datetime.date(2014, 1, 1))
+
+        # The conducted date is saved along with a change of conducted_on.
+        pollrun = PollRun.objects.get(pk=pollrun.pk)
+        pollrun.conducted_on = datetime.datetime(2014, 1, 1, 20, tzinfo=pytz.UTC)
+        with self.assertNumQueries(2):  # The org and the update.
+            pollrun.save(update_fields=['conducted_on'])
+        self.assertEqual(PollRun.objects.get(pk=pollrun.pk).conducted_date, datetime.date(2014, 1, 2))
+
+        # The org isn't loaded again when it is already loaded with the poll.
+        pollrun = PollRun.objects.select_related('poll__org').get(pk=pollrun.pk)
+        with self.assertNumQueries(1):
+            pollrun.save()
+
+        # Or when the conducted date isn't being saved.
+        pollrun = PollRun.objects.get(pk=pollrun.pk)
+        with self.assertNumQueries(1):
+            pollrun.save(update_fields=['region'])
+
     def test_completion(self):
         date1 = datetime.datetime(2014, 1, 1, 7, tzinfo=pytz.UTC)
 
@@ -456,6 +517,26 @@ class PollRunTest(TracProDataTest):
             Response.STATUS_COMPLETE: 1,
         })
 
+    def test_set_response_counts(self):
+        pollrun1 = factories.UniversalPollRun(poll=self.poll1)
+        pollrun2 = factories.UniversalPollRun(
+            poll=self.poll1, conducted_on=timezone.now() - datetime.timedelta(days=1))
+        for pollrun, contact, status in [(pollrun1, self.contact1, Response.STATUS_COMPLETE),
+                                         (pollrun1, self.contact2, Response.STATUS_PARTIAL),
+                                         (pollrun1, self.contact3, Response.STATUS_EMPTY),
+                                         (pollrun2, self.contact1, Response.STATUS_EMPTY)]:
+            factories.Response(pollrun=pollrun, contact=contact, status=status)
+        factories.Response(pollrun=pollrun2, contact=self.contact2, is_active=False)
+
+        for region in (None, self.region1, self.region2):
+            pollruns = [PollRun.objects.get(pk=pollrun1.pk), PollRun.objects.get(pk=pollrun2.pk)]
+            # Region scoping loads the org's region tree when it isn't cached.
+            with self.assertNumQueries(2 if region else 1):
+                PollRun.objects.set_response_counts(pollruns, region)
+            for pollrun in pollruns:
+                self.assertEqual(pollrun._response_counts, pollrun.get_response_counts(region))
+                self.assertEqual(pollrun.as_json(region)['responses'], pollrun._response_counts)
+
     def test_is_last_for_region(self):
         self.mock_temba_client.create_flow_start.return_value = []
         pollrun1 = factories.RegionalPollRun(
@@ -521,6 +602,47 @@ class PollRunTest(TracProDataTest):
 
 class TestResponse(TracProDataTest):
 
+    def test_create_empties(self):
+        self.mock_temba_client.get_contacts.return_value = []
+        self.mock_temba_client.create_flow_start.return_value = []
+        pollrun = factories.RegionalPollRun(poll=self.poll1, region=self.region1)
+        old_response = factories.Response(pollrun=pollrun, contact=self.contact1, flow_run_id=999)
+        now = timezone.now()
+
+        with self.assertNumQueries(3):
+            with mock.patch('tracpro.polls.models.logger') as logger:
+                responses = Response.create_empties(self.unicef, pollrun, [
+                    Run.create(id=123, contact='C-001', created_on=now),
+                    Run.create(id=234, contact='C-002', created_on=now),
+                    Run.create(id=345, contact='C-001', created_on=now),
+                    Run.create(id=456, contact='C-999', created_on=now),
+                ])
+
+        self.assertEqual(len(responses), 3)
+        self.assertEqual(logger.warning.call_count, 1)
+        self.assertIn("C-999", logger.warning.call_args[0][0])
+        self.assertFalse(Response.objects.get(pk=old_response.pk).is_active)
+        active = pollrun.responses.filter(is_active=True)
+        self.assertEqual(
+            sorted(active.values_list('flow_run_id', flat=True)), [234, 345])
+        self.assertEqual(set(r.status for r in responses), set([Response.STATUS_EMPTY]))
+
+    def test_group_counts(self):
+        pollrun1 = factories.UniversalPollRun(poll=self.poll1)
+        pollrun2 = factories.UniversalPollRun(poll=self.poll1, conducted_on=timezone.now() - datetime.timedelta(days=1))
+        for pollrun, contact in [(pollrun1, self.contact1), (pollrun1, self.contact2),
+                                 (pollrun1, self.contact3), (pollrun2, self.contact1)]:
+            factories.Response(pollrun=pollrun, contact=contact)
+        responses = Response.objects.all()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(responses.group_counts('pollrun'), {pollrun1.pk: 3, pollrun2.pk: 1})
+        self.assertEqual(responses.group_counts('contact__region', 'pollrun'), {
+            (self.region1.pk, pollrun1.pk): 2,
+            (self.region2.pk, pollrun1.pk): 1,
+            (self.region1.pk, pollrun2.pk): 1,
+        })
+
     @skip("Skipping test_from_run() for now, fixing functionality for API v2.")
     def test_from_run(self):
         # a complete run
@@ -740,6 +862,78 @@ class TestAnswer(TracProDataTest):
         self.assertEqual(3, len(answer3.same_question_contact_and_day()))
 
 
+class TestAnswerSameDayValues(TracProDataTest):
+
+    def setUp(self):
+        super(TestAnswerSameDayValues, self).setUp()
+        pollrun = factories.UniversalPollRun(poll=self.poll1, conducted_on=timezone.now())
+        self.day = datetime.datetime(2016, 3, 4, 10, 0, 0, tzinfo=pytz.utc)
+        self.answers = []
+        for minutes, value in [(0, "4"), (5, "eight"), (10, "8")]:
+            response = factories.Response(pollrun=pollrun, contact=self.contact1)
+            self.answers.append(factories.Answer(
+                response=response, question=self.poll1_question1, value=value,
+                submitted_on=self.day + datetime.timedelta(minutes=minutes)))
+        # Another day
+        response = factories.Response(pollrun=pollrun, contact=self.contact1)
+        self.other = factories.Answer(
+            response=response, question=self.poll1_question1, value="1",
+            submitted_on=self.day + datetime.timedelta(days=1))
+
+    def test_recompute_same_day(self):
+        models.Answer.objects.update(last_value=None, sum_value=None)
+        key = (self.poll1_question1.pk, self.contact1.pk, self.day.date())
+        results = models.Answer.objects.recompute_same_day([key])
+        self.assertEqual(results, {key: ("8", "12.0")})
+        for answer in self.answers:
+            answer.refresh_from_db()
+            self.assertEqual(answer.last_value, "8")
+            self.assertEqual(answer.sum_value, "12.0")
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other.last_value)
+
+    def test_numeric_values(self):
+        for answer in self.answers:
+            answer.refresh_from_db()
+        self.assertEqual([a.numeric_value for a in self.answers], [4.0, None, 8.0])
+        self.assertEqual(set((a.numeric_last_value, a.numeric_sum_value) for a in self.answers),
+                         {(8.0, 12.0)})
+
+        self.unicef.how_to_handle_sameday_responses = SAMEDAY_SUM
+        self.unicef.save()
+        self.assertEqual(list(models.Answer.objects.order_by('pk').numeric_values_to_use()),
+                         [12.0, 12.0, 12.0, 1.0])
+        self.assertEqual(models.Answer.objects.get(pk=self.other.pk).numeric_value_to_use, 1.0)
+
+    def test_recompute_same_day_not_numeric(self):
+        self.answers[0].delete()
+        self.answers[2].delete()
+        key = (self.poll1_question1.pk, self.contact1.pk, self.day.date())
+        self.assertEqual(models.Answer.objects.recompute_same_day([key]), {key: ("eight", None)})
+        self.answers[1].refresh_from_db()
+        self.assertEqual(self.answers[1].sum_value, "eight")
+
+    def test_same_day_keys(self):
+        self.assertEqual(
+            sorted(models.Answer.objects.same_day_keys()),
+            [(self.poll1_question1.pk, self.contact1.pk, self.day.date()),
+             (self.poll1_question1.pk, self.contact1.pk, self.day.date() + datetime.timedelta(days=1))])
+
+    def test_recompute_command(self):
+        models.Answer.objects.update(last_value=None, sum_value=None)
+        call_command('recompute_sameday_values', str(self.unicef.pk),
+                     since='2016-03-04', until='2016-03-04', stdout=StringIO())
+        self.assertEqual(
+            set(models.Answer.objects.exclude(pk=self.other.pk).values_list('last_value', 'sum_value')),
+            {("8", "12.0")})
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other.sum_value)
+
+        call_command('recompute_sameday_values', str(self.unicef.pk), stdout=StringIO())
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.sum_value, "1.0")
+
+
 class TestAnswerSumming(TracProDataTest):
     how_to_handle_sameday_responses = SAMEDAY_SUM
 
@@ -878,6 +1072,62 @@ class TestAnswerQuerySet(TracProDataTest):
         self.assertEqual(2, len(result['categories']))
         self.assertEqual([2, 1], result['data'])
 
+    def test_autocategorize_matches_numpy(self):
+        # Binning in the database gives the same histogram as numpy,
+        # including values which fall on the bin edges.
+        response = factories.Response(
+            contact__org=self.org, contact__region=self.region1, pollrun=self.pollrun)
+        for value in (-1.5, 0, 0.1, 2, 2, 5.25, 7, 9.5, 10, 10, 11.75, 12, 13, 100):
+            factories.Answer(
+                response=response, question=self.question1,
+                value=str(value), category="numeric")
+        answers = models.Answer.objects.filter(response__pollrun=self.pollrun)
+        hist, bin_edges = numpy.histogram(answers.numeric_values_to_use(), bins='sqrt')
+        self.assertEqual(answers.autocategorize(), utils.histogram_categories(hist, bin_edges))
+        self.assertEqual(sum(answers.autocategorize()['data']), 17)
+
+    def test_autocategorize_single_value(self):
+        answers = models.Answer.objects.filter(response__pollrun=self.pollrun, value="8.0")
+        self.assertEqual(answers.autocategorize(), {'categories': ["7.5-8.5"], 'data': [1]})
+
+    def test_autocategorize_by_question(self):
+        question2 = factories.Question(poll=self.poll, question_type=models.Question.TYPE_NUMERIC)
+        question3 = factories.Question(poll=self.poll, question_type=models.Question.TYPE_NUMERIC)
+        for value in ("1", "1.5", "20", "abcd"):
+            factories.Answer(
+                response__contact__org=self.org, response__contact__region=self.region1,
+                response__pollrun=self.pollrun, question=question2, value=value)
+        factories.Answer(
+            response__contact__org=self.org, response__contact__region=self.region1,
+            response__pollrun=self.pollrun, question=question3, value="abcd")
+        questions = [self.question1, question2, question3]
+        answers = models.Answer.objects.filter(question__in=questions)
+
+        with self.assertNumQueries(2):
+            histograms = answers.autocategorize_by_question(questions)
+        self.assertEqual(histograms, {
+            self.question1.pk: answers.filter(question=self.question1).autocategorize(),
+            question2.pk: answers.filter(question=question2).autocategorize(),
+        })
+        self.assertEqual(histograms[question2.pk]['data'], [2, 1])
+
+    def test_category_counts_by_pollrun(self):
+        pollrun2 = factories.UniversalPollRun(
+            poll=self.poll, conducted_on=timezone.now() - datetime.timedelta(days=1))
+        for pollrun, category in [(self.pollrun, "10"), (pollrun2, "10"), (pollrun2, "9"), (pollrun2, "10")]:
+            factories.Answer(
+                response__contact__org=self.org, response__contact__region=self.region1,
+                response__pollrun=pollrun, question=self.question1, category=category)
+        answers = models.Answer.objects.filter(question=self.question1)
+
+        with self.assertNumQueries(1):
+            counts = answers.category_counts_by_pollrun()
+        self.assertEqual(counts, [
+            ("9", {pollrun2.pk: 1}),
+            ("10", {self.pollrun.pk: 1, pollrun2.pk: 2}),
+            ("numeric", {self.pollrun.pk: 3}),
+        ])
+
     def test_autocategorize_none(self):
         # autocategorize doesn't blow up when passed no data
         result = models.Answer.objects.none().autocategorize()
@@ -917,3 +1167,145 @@ class TestAnswerQuerySet(TracProDataTest):
         result = answers.autocategorize()
         self.assertEqual(2, len(result['categories']))
         self.assertEqual(2, len(result['data']))
+
+
+class TestAnswerRollupRefresh(TransactionTestCase):
+
+    def setUp(self):
+        super(TestAnswerRollupRefresh, self).setUp()
+        patcher = mock.patch('tracpro.client.make_client')
+        patcher.start().return_value.get_contacts.return_value = [Contact.create(groups=[])]
+        self.addCleanup(patcher.stop)
+
+    def test_overlapping_refreshes(self):
+        answer = factories.Answer(question__question_type=models.Question.TYPE_NUMERIC, value="4")
+        pair = (answer.question_id, answer.response.pollrun_id)
+        errors = []
+
+        def refresh():
+            try:
+                models.AnswerRollup.objects.refresh([pair])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        # The second refresh waits for the first to be committed, rather
+        # than inserting the same rollups.
+        with transaction.atomic():
+            models.AnswerRollup.objects.refresh([pair])
+            thread = threading.Thread(target=refresh)
+            thread.start()
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(models.AnswerRollup.objects.get().numeric_sum, 4.0)
+
+
+class TestAnswerRollup(TracProDataTest):
+
+    def setUp(self):
+        super(TestAnswerRollup, self).setUp()
+        self.pollrun = factories.UniversalPollRun(poll=self.poll1)
+        self.day = datetime.datetime(2016, 3, 4, 10, 0, 0, tzinfo=pytz.utc)
+        for contact, value, category in [(self.contact1, "4", "1 - 5"),
+                                         (self.contact2, "6", "6 - 10"),
+                                         (self.contact3, "abc", None)]:
+            self.add_answer(contact, value, category)
+        # A contact with no answer still counts towards the response rate.
+        factories.Response(pollrun=self.pollrun, contact=self.contact4)
+        self.responses = models.Response.objects.filter(pollrun=self.pollrun, is_active=True)
+
+    def add_answer(self, contact, value, category, minutes=0):
+        response = factories.Response(pollrun=self.pollrun, contact=contact)
+        return factories.Answer(
+            response=response, question=self.poll1_question1, value=value, category=category,
+            submitted_on=self.day + datetime.timedelta(minutes=minutes))
+
+    def get_rollups(self):
+        rollups = models.AnswerRollup.objects.filter(question=self.poll1_question1)
+        return {
+            rollup.region: (rollup.answer_count, rollup.numeric_count, rollup.numeric_sum,
+                            rollup.numeric_sum_squares, sorted(json.loads(rollup.category_counts)))
+            for rollup in rollups
+        }
+
+    def test_refreshed_on_answer_save(self):
+        self.assertEqual(self.get_rollups(), {
+            self.region1: (2, 2, 10.0, 52.0, [["1 - 5", 1], ["6 - 10", 1]]),
+            self.region2: (1, 0, 0.0, 0.0, [[None, 1]]),
+        })
+
+    def test_summaries_match_answers(self):
+        self.add_answer(self.contact4, "2.5", "1 - 5")
+        answers = models.Answer.objects.filter(response__in=self.responses)
+        questions = models.Question.objects.filter(pk=self.poll1_question1.pk)
+        poll_charts = charts.PollCharts(questions, self.responses)
+        poll_charts._load(poll_charts.questions, histograms=False)
+        rollups = poll_charts.answers[self.poll1_question1.pk]
+        self.assertEqual(rollups.summarize_by_pollrun(self.responses),
+                         answers.summarize_by_pollrun(self.responses))
+        self.assertEqual(rollups.summarize_by_region_and_pollrun(self.responses),
+                         answers.summarize_by_region_and_pollrun(self.responses))
+        self.assertEqual(rollups.category_counts_by_pollrun(), answers.category_counts_by_pollrun())
+        self.assertEqual(rollups.categories(), answers.categories())
+
+    def test_refreshed_on_contact_change(self):
+        self.contact2.region = self.region2
+        self.contact2.save()
+        self.contact3.is_active = False
+        self.contact3.save()
+        self.assertEqual(self.get_rollups(), {
+            self.region1: (1, 1, 4.0, 16.0, [["1 - 5", 1]]),
+            self.region2: (1, 1, 6.0, 36.0, [["6 - 10", 1]]),
+        })
+
+    def test_contact_change_bumps_chart_data_version(self):
+        with mock.patch('tracpro.contacts.signals.bump_chart_data_version') as bump_chart_data_version:
+            self.contact2.region = self.region2
+            self.contact2.save()
+            bump_chart_data_version.assert_called_once_with(self.unicef.pk)
+
+            # Other changes don't affect the charts.
+            self.contact2.name = "Bob"
+            self.contact2.save()
+            self.assertEqual(bump_chart_data_version.call_count, 1)
+
+    def test_same_day_policy(self):
+        # Both of the contact's answers that day are charted with their same-day value.
+        self.add_answer(self.contact1, "3", "1 - 5", minutes=5)
+
+        self.unicef.how_to_handle_sameday_responses = SAMEDAY_SUM
+        self.unicef.save()
+        models.AnswerRollup.objects.rebuild(self.unicef)
+        self.assertEqual(self.get_rollups()[self.region1][:3], (3, 3, 20.0))
+
+        self.unicef.how_to_handle_sameday_responses = SAMEDAY_LAST
+        self.unicef.save()
+        models.AnswerRollup.objects.rebuild(self.unicef)
+        self.assertEqual(self.get_rollups()[self.region1][:3], (3, 3, 12.0))
+
+    def test_refreshed_on_question_type_change(self):
+        self.add_answer(self.contact1, "3", "1 - 5", minutes=5)
+        self.unicef.how_to_handle_sameday_responses = SAMEDAY_SUM
+        self.unicef.save()
+        models.AnswerRollup.objects.rebuild(self.unicef)
+        self.assertEqual(self.get_rollups()[self.region1][:3], (3, 3, 20.0))
+
+        # Only numeric questions chart the same-day values.
+        question = models.Question.objects.get(pk=self.poll1_question1.pk)
+        question.question_type = models.Question.TYPE_OPEN
+        question.save()
+        self.assertEqual(self.get_rollups()[self.region1][:3], (3, 3, 13.0))
+
+        question.question_type = models.Question.TYPE_NUMERIC
+        question.save()
+        self.assertEqual(self.get_rollups()[self.region1][:3], (3, 3, 20.0))
+
+    def test_rebuild_command(self):
+        models.AnswerRollup.objects.all().delete()
+        stdout = StringIO()
+        call_command('rebuild_answer_rollups', str(self.unicef.pk), stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Rebuilt 2 answer rollups for org #%d\n" % self.unicef.pk)
+        self.assertEqual(len(self.get_rollups()), 2)
@@ -1,13 +1,51 @@
 from __future__ import unicode_literals
 
+import datetime
+import json
+
 import mock
+import pytz
+import redis
+
+from dash.orgs.models import Org
+
+from temba_client.utils import format_iso8601
+
+from django.test.utils import override_settings
+from django.utils import timezone
 
 from tracpro.polls.models import PollRun
 from tracpro.test import factories
-from tracpro.test.cases import TracProTest
+from tracpro.test.cases import TracProTest, TracProDataTest
 
 from .. import models
-from ..tasks import sync_questions_categories, pollrun_start
+from ..tasks import (
+    sync_questions_categories, pollrun_start, start_poll_backfills, backfill_poll_runs,
+    record_fetch_runs_result, FetchOrgRuns, FetchPollRuns,
+    FETCH_RUNS_CHECKPOINT_KEY, LAST_FETCHED_RUN_TIME_KEY, POLL_LAST_FETCHED_RUN_TIME_KEY)
+
+
+class FakeFetches(object):
+    """Iterates over pages of runs like a temba CursorIterator."""
+
+    def __init__(self, pages, fail_at=None):
+        self.pages = pages
+        self.index = 0
+        self.fail_at = fail_at
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.index == self.fail_at:
+            raise RuntimeError("Interrupted")
+        if self.index >= len(self.pages):
+            raise StopIteration()
+        self.index += 1
+        return self.pages[self.index - 1]
+
+    def get_cursor(self):
+        return 'cursor-%d' % self.index if self.index < len(self.pages) else None
 
 
 class TestPollTask(TracProTest):
@@ -143,3 +181,179 @@ class TestPollTask(TracProTest):
         contacts_passed = set(call_args[0][1]['contacts']) | set(call_args[1][1]['contacts'])
         self.assertEqual(150, len(contacts_passed))
         self.assertEqual(contacts_passed, set([c.uuid for c in contacts]))
+
+
+class TestFetchOrgRuns(TracProDataTest):
+
+    def setUp(self):
+        super(TestFetchOrgRuns, self).setUp()
+        self.pages = [
+            [factories.TembaRun(flow__uuid='F-001', contact__uuid=contact.uuid, exit_type='')]
+            for contact in (self.contact1, self.contact2, self.contact3)
+        ]
+        self.checkpoint_key = FETCH_RUNS_CHECKPOINT_KEY % (self.unicef.pk, self.poll1.pk)
+
+        # Tests use the dummy cache, so point the task at the test redis db.
+        self.redis = redis.StrictRedis(host='localhost', db=10)
+        redis_patcher = mock.patch('tracpro.polls.tasks.get_redis_connection', return_value=self.redis)
+        redis_patcher.start()
+        self.addCleanup(redis_patcher.stop)
+
+    def test_fetch_pages(self):
+        self.mock_temba_client.get_runs.return_value.iterfetches.return_value = FakeFetches(self.pages)
+        FetchOrgRuns().org_task(self.unicef)
+        self.assertEqual(models.Response.objects.count(), 3)
+        self.assertIsNone(self.redis.get(self.checkpoint_key))
+
+    def test_resume_from_checkpoint(self):
+        iterfetches = self.mock_temba_client.get_runs.return_value.iterfetches
+        iterfetches.return_value = FakeFetches(self.pages, fail_at=2)
+        with self.assertRaises(RuntimeError):
+            FetchOrgRuns().org_task(self.unicef)
+
+        # The pages before the interruption were saved.
+        self.assertEqual(models.Response.objects.count(), 2)
+        checkpoint = json.loads(self.redis.get(self.checkpoint_key))
+        self.assertEqual(checkpoint['cursor'], 'cursor-2')
+
+        # The next fetch picks up from the checkpoint, then fetches any runs
+        # modified since the interrupted fetch started.
+        iterfetches.reset_mock()
+        iterfetches.side_effect = [FakeFetches(self.pages[2:]), FakeFetches([])]
+        FetchOrgRuns().org_task(self.unicef)
+        self.assertEqual(models.Response.objects.count(), 3)
+        self.assertEqual(iterfetches.call_args_list, [
+            mock.call(retry_on_rate_exceed=True, resume_cursor='cursor-2'),
+            mock.call(retry_on_rate_exceed=True, resume_cursor=None),
+        ])
+        self.assertIsNone(self.redis.get(self.checkpoint_key))
+
+    def test_poll_watermarks(self):
+        poll3 = factories.Poll(org=self.unicef, flow_uuid='F-003')
+        poll1_time = datetime.datetime(2016, 1, 2, tzinfo=pytz.utc)
+        org_time = datetime.datetime(2015, 1, 2, tzinfo=pytz.utc)
+        self.redis.set(POLL_LAST_FETCHED_RUN_TIME_KEY % (self.unicef.pk, 'F-001'), format_iso8601(poll1_time))
+        self.redis.set(LAST_FETCHED_RUN_TIME_KEY % self.unicef.pk, format_iso8601(org_time))
+
+        get_runs = self.mock_temba_client.get_runs
+        get_runs.return_value.iterfetches.side_effect = lambda **kwargs: FakeFetches([])
+        FetchOrgRuns().org_task(self.unicef)
+
+        # Each poll is fetched from its own watermark, falling back to the
+        # org watermark.
+        after_by_flow = {c[1]['flow']: c[1]['after'] for c in get_runs.call_args_list}
+        self.assertEqual(after_by_flow, {'F-001': poll1_time, 'F-003': org_time})
+
+        # Both polls are now fetched up to the same time.
+        until = get_runs.call_args[1]['before']
+        for poll in (self.poll1, poll3):
+            key = POLL_LAST_FETCHED_RUN_TIME_KEY % (self.unicef.pk, poll.flow_uuid)
+            self.assertEqual(self.redis.get(key), format_iso8601(until))
+
+    def test_start_poll_backfills(self):
+        self.mock_temba_client.get_definitions.return_value = factories.TembaExport(flows=[])
+        get_runs = self.mock_temba_client.get_runs
+        get_runs.return_value.iterfetches.side_effect = lambda **kwargs: FakeFetches(self.pages)
+
+        start_poll_backfills([self.poll1])
+        self.assertEqual(models.Response.objects.count(), 3)
+        self.assertEqual(get_runs.call_count, 1)
+        self.assertIsNone(get_runs.call_args[1]['after'])
+
+        # Runs are fetched by FetchOrgRuns from the time the backfill started.
+        before = get_runs.call_args[1]['before']
+        key = POLL_LAST_FETCHED_RUN_TIME_KEY % (self.unicef.pk, 'F-001')
+        self.assertEqual(self.redis.get(key), format_iso8601(before))
+
+        # The poll has been fetched before, so is not backfilled again.
+        start_poll_backfills([self.poll1])
+        self.assertEqual(get_runs.call_count, 1)
+
+    def test_start_poll_backfills_lost_task(self):
+        self.mock_temba_client.get_definitions.return_value = factories.TembaExport(flows=[])
+        get_runs = self.mock_temba_client.get_runs
+        get_runs.return_value.iterfetches.side_effect = lambda **kwargs: FakeFetches(self.pages)
+
+        # The backfill task never runs, so the poll has no watermark yet.
+        with mock.patch('tracpro.polls.tasks.backfill_poll_runs'):
+            start_poll_backfills([self.poll1])
+        key = POLL_LAST_FETCHED_RUN_TIME_KEY % (self.unicef.pk, 'F-001')
+        self.assertIsNone(self.redis.get(key))
+
+        # FetchOrgRuns restarts the backfill, then fetches runs since it began.
+        FetchOrgRuns().org_task(self.unicef)
+        self.assertEqual(models.Response.objects.count(), 3)
+        afters = [c[1]['after'] for c in get_runs.call_args_list]
+        self.assertEqual(afters[0], None)
+        self.assertEqual(afters[1], get_runs.call_args_list[0][1]['before'])
+
+        # The finished backfill isn't run again.
+        get_runs.reset_mock()
+        backfill_poll_runs(self.poll1.pk, timezone.now())
+        self.assertFalse(get_runs.called)
+
+    def test_start_poll_backfills_legacy_watermark(self):
+        # The first poll was fetched before watermarks were tracked per poll.
+        poll3 = factories.Poll(org=self.unicef, flow_uuid='F-003')
+        factories.UniversalPollRun(poll=self.poll1)
+        org_time = format_iso8601(datetime.datetime(2015, 1, 2, tzinfo=pytz.utc))
+        self.redis.set(LAST_FETCHED_RUN_TIME_KEY % self.unicef.pk, org_time)
+
+        with mock.patch('tracpro.polls.tasks.backfill_poll_runs') as backfill_poll_runs:
+            start_poll_backfills([self.poll1, poll3])
+        backfill_poll_runs.delay.assert_called_once_with(poll3.pk, mock.ANY)
+        self.assertEqual(self.redis.get(POLL_LAST_FETCHED_RUN_TIME_KEY % (self.unicef.pk, 'F-001')), org_time)
+
+    @override_settings(FETCH_RUNS_FAN_OUT=True)
+    @mock.patch.object(Org, 'set_task_result')
+    def test_fan_out(self, mock_set_task_result):
+        poll3 = factories.Poll(org=self.unicef, flow_uuid='F-003')
+        fetches = {
+            'F-001': FakeFetches(self.pages[:2]),
+            'F-003': FakeFetches([[factories.TembaRun(flow__uuid='F-003', contact__uuid='C-004')]]),
+        }
+        get_runs = self.mock_temba_client.get_runs
+        get_runs.side_effect = lambda flow, **kwargs: mock.Mock(
+            iterfetches=mock.Mock(return_value=fetches[flow]))
+
+        FetchOrgRuns().org_task(self.unicef)
+
+        self.assertEqual(models.Response.objects.filter(pollrun__poll=self.poll1).count(), 2)
+        self.assertEqual(models.Response.objects.filter(pollrun__poll=poll3).count(), 1)
+        self.assertEqual(mock_set_task_result.call_count, 1)
+        self.assertEqual(mock_set_task_result.call_args[0][1]['counts'], {'fetched': 3})
+
+    @override_settings(
+        FETCH_RUNS_FAN_OUT=True,
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    @mock.patch.object(Org, 'set_task_result')
+    def test_fan_out_locks_by_poll(self, mock_set_task_result):
+        poll3 = factories.Poll(org=self.unicef, flow_uuid='F-003')
+        get_runs = self.mock_temba_client.get_runs
+        get_runs.side_effect = lambda flow, **kwargs: mock.Mock(
+            iterfetches=mock.Mock(return_value=FakeFetches([])))
+
+        # Another worker is fetching the first poll.
+        task = FetchPollRuns()
+        self.assertTrue(task.lock_acquire(self.unicef, task.get_cache_scope(self.unicef, self.poll1.pk)))
+        FetchOrgRuns().org_task(self.unicef)
+        self.assertEqual([c[1]['flow'] for c in get_runs.call_args_list], [poll3.flow_uuid])
+
+    def test_fetch_poll_runs_deactivated_poll(self):
+        self.poll1.is_active = False
+        self.poll1.save()
+        self.assertIsNone(FetchPollRuns().org_task(self.unicef, self.poll1.pk))
+        self.assertFalse(self.mock_temba_client.get_runs.called)
+
+    @mock.patch.object(Org, 'set_task_result')
+    def test_record_fetch_runs_result(self, mock_set_task_result):
+        results = [
+            {'fetched': 2, 'errors': ["Unable to save flow run #1"]},
+            None,
+            {'fetched': 1, 'errors': ["Unable to save flow run #2"]},
+        ]
+        with mock.patch('tracpro.polls.tasks.logger') as logger:
+            errors = record_fetch_runs_result(results, self.unicef.pk)
+        self.assertEqual(errors, ["Unable to save flow run #1", "Unable to save flow run #2"])
+        self.assertEqual(logger.error.call_count, 1)
+        self.assertEqual(mock_set_task_result.call_args[0][1]['counts'], {'fetched': 3})
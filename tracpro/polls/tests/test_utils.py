@@ -1,9 +1,20 @@
 # coding=utf-8
 from __future__ import absolute_import, unicode_literals
 
-from tracpro.test.cases import TracProTest
+import datetime
+import random
+
+import numpy
+import pytz
+
+from django.test.utils import override_settings
+
+from tracpro.test import factories
+from tracpro.test.cases import TracProTest, TracProDataTest
+from tracpro.utils import dunder_to_chained_attrs
 
 from .. import utils
+from ..models import Answer, Response, SAMEDAY_LAST, SAMEDAY_SUM
 
 
 class TestExtractWords(TracProTest):
@@ -26,3 +37,94 @@ class TestNaturalSortKey(TracProTest):
         categories = ['11-20', '1-10', '<100', None, 'Other', '21-999', '21-99']
         categories.sort(key=utils.natural_sort_key)
         self.assertEqual(categories, [None, '1-10', '11-20', '21-99', '21-999', '<100', 'Other'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestChartDataVersion(TracProTest):
+
+    def test_bump_chart_data_version(self):
+        # Nothing has been cached, so there is nothing to invalidate.
+        utils.bump_chart_data_version(1)
+
+        version = utils.get_chart_data_version(1)
+        self.assertEqual(utils.get_chart_data_version(1), version)
+        utils.bump_chart_data_version(1)
+        self.assertEqual(utils.get_chart_data_version(1), version + 1)
+
+
+class TestSummarizeTotals(TracProTest):
+
+    def test_rounding_error_variance_clamped(self):
+        values = [1e9 + 0.1, 1e9 + 0.3, 1e9 + 0.2]
+        totals = utils.summarize_totals(3, 3, sum(values), sum(value * value for value in values))
+        self.assertEqual(totals['numeric_stdev'], 0.0)
+
+    def test_no_numeric_values(self):
+        totals = utils.summarize_totals(2, 0, 0.0, 0.0)
+        self.assertEqual(totals, {
+            'answer_count': 2, 'numeric_sum': None, 'numeric_avg': None, 'numeric_stdev': None})
+
+
+class TestSummarize(TracProDataTest):
+
+    def setUp(self):
+        super(TestSummarize, self).setUp()
+        rand = random.Random(1234)
+        day = datetime.datetime(2016, 3, 4, 10, 0, 0, tzinfo=pytz.utc)
+        contacts = [self.contact1, self.contact2, self.contact3, self.contact4, self.contact5]
+        for days in range(3):
+            pollrun = factories.UniversalPollRun(
+                poll=self.poll1, conducted_on=day + datetime.timedelta(days=days))
+            for contact in contacts:
+                # Some contacts answer more than once on a day.
+                for minutes in range(rand.choice([0, 1, 1, 2])):
+                    response = factories.Response(pollrun=pollrun, contact=contact)
+                    factories.Answer(
+                        response=response, question=self.poll1_question1,
+                        value=rand.choice(["1", "2.5", "-3", "7", "10.25", "x", " 4 ", "1e2"]),
+                        submitted_on=day + datetime.timedelta(days=days, minutes=minutes))
+                if not contact.responses.filter(pollrun=pollrun).exists():
+                    factories.Response(pollrun=pollrun, contact=contact)
+        self.answers = Answer.objects.filter(question=self.poll1_question1)
+        self.responses = Response.objects.filter(pollrun__poll=self.poll1)
+
+    def group_values(self, answers, *fields):
+        """Map the values of the given fields to the values to use of the matching answers."""
+        data = {}
+        for answer in answers.select_related('response__contact', 'question__poll__org'):
+            key = tuple(dunder_to_chained_attrs(answer, field) for field in fields)
+            data.setdefault(key if len(fields) > 1 else key[0], []).append(answer.value_to_use)
+        return data
+
+    def summarize(self, values, response_count):
+        """The previous implementation, which summarized values in Python."""
+        numeric_values = utils.get_numeric_values(values)
+        return (
+            round(numpy.sum(numeric_values), 1),
+            round(numpy.mean(numeric_values) if numeric_values else 0, 1),
+            round(numpy.std(numeric_values) if numeric_values else 0, 1),
+            round(100.0 * len(values) / response_count, 1),
+        )
+
+    def test_matches_python_summaries(self):
+        for sameday in (None, SAMEDAY_SUM, SAMEDAY_LAST):
+            self.unicef.how_to_handle_sameday_responses = sameday
+            self.unicef.save()
+            answers = self.answers.all()
+
+            values = self.group_values(answers, 'response__pollrun_id')
+            expected = ({}, {}, {}, {})
+            for pollrun_id, response_count in self.responses.group_counts('pollrun').items():
+                summary = self.summarize(values.get(pollrun_id, []), response_count)
+                for index, value in enumerate(summary):
+                    expected[index][pollrun_id] = value
+            with self.assertNumQueries(3):
+                self.assertEqual(utils.summarize_by_pollrun(answers, self.responses), expected)
+
+            values = self.group_values(answers, 'response__contact__region_id', 'response__pollrun_id')
+            expected = {}
+            for key, response_count in self.responses.group_counts('contact__region', 'pollrun').items():
+                summary = self.summarize(values.get(key, []), response_count)
+                for index, value in enumerate(summary):
+                    expected.setdefault(key[0], ({}, {}, {}, {}))[index][key[1]] = value
+            self.assertEqual(utils.summarize_by_region_and_pollrun(answers, self.responses), expected)
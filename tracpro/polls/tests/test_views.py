@@ -2,17 +2,20 @@
 from __future__ import absolute_import, unicode_literals
 
 import csv
+import json
 import datetime
 from StringIO import StringIO
 
 import pytz
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from tracpro.test import factories
 from tracpro.test.cases import TracProDataTest
 
 from ..models import Response
-from . import factories
 
 
 class PollCRUDLTest(TracProDataTest):
@@ -27,6 +30,143 @@ class PollCRUDLTest(TracProDataTest):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['object_list']), 1)
 
+        # Questions and pollruns are counted in the same query as the polls.
+        factories.UniversalPollRun(poll=self.poll1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.url_get('unicef', url)
+        poll = response.context['object_list'][0]
+        self.assertEqual((poll.question_count, poll.pollrun_count), (2, 1))
+        poll = factories.Poll(org=self.unicef, is_active=True)
+        factories.Question(poll=poll)
+        factories.UniversalPollRun(poll=poll)
+        with self.assertNumQueries(len(queries)):
+            response = self.url_get('unicef', url)
+        self.assertEqual(len(response.context['object_list']), 2)
+
+    def test_read(self):
+        url = reverse('polls.poll_read', args=[self.poll1.pk])
+        self.login(self.admin)
+
+        # Only a panel is rendered for each question.
+        response = self.url_get('unicef', url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['questions']), [self.poll1_question1, self.poll1_question2])
+        self.assertNotIn('question_data', response.context)
+        self.assertContains(response, 'data-url="{}?"'.format(
+            reverse('polls.poll_question_chart', args=[self.poll1.pk, self.poll1_question1.pk])))
+
+        # No questions are shown for invalid filters.
+        response = self.url_get('unicef', url, {'date_range': 'foo'})
+        self.assertIsNone(response.context['questions'])
+
+    def test_question_chart(self):
+        factories.Answer(
+            response__pollrun=factories.UniversalPollRun(poll=self.poll1),
+            response__contact=self.contact1,
+            question=self.poll1_question1, value="4", category="1 - 5")
+        url = reverse('polls.poll_question_chart', args=[self.poll1.pk, self.poll1_question1.pk])
+        self.login(self.admin)
+
+        response = self.url_get('unicef', url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['chart_type'], 'numeric')
+        self.assertEqual(data['chart_data']['sum'], [{'name': self.poll1_question1.name, 'data': [4.0]}])
+        self.assertEqual(data['summary_table'][0], ['Mean', 4.0])
+        self.assertIn('class="chart-numeric"', data['html'])
+
+        response = self.url_get('unicef', url, {'date_range': 'foo'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date_range', json.loads(response.content)['errors'])
+
+        # Only questions of the poll can be charted.
+        url = reverse('polls.poll_question_chart', args=[self.poll1.pk, self.poll2_question1.pk])
+        response = self.url_get('unicef', url)
+        self.assertEqual(response.status_code, 404)
+
+
+class PollRunCRUDLTest(TracProDataTest):
+
+    def setUp(self):
+        super(PollRunCRUDLTest, self).setUp()
+        self.region2.parent = self.region1
+        self.region2.save()
+        self.pollrun = factories.UniversalPollRun(poll=self.poll1)
+        for contact, status in [(self.contact1, Response.STATUS_COMPLETE),
+                                (self.contact2, Response.STATUS_EMPTY),
+                                (self.contact3, Response.STATUS_PARTIAL)]:
+            factories.Response(pollrun=self.pollrun, contact=contact, status=status)
+        self.url = reverse('polls.pollrun_participation', args=[self.pollrun.pk])
+        self.login(self.admin)
+
+    def test_participation_by_cohort(self):
+        response = self.url_get('unicef', self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['per_group_counts'], {
+            self.group1: {'E': 1, 'P': 0, 'C': 1, 'X': "50%"},
+            self.group2: {'E': 0, 'P': 1, 'C': 1, 'X': "50%"},
+            self.group3: {'E': 0, 'P': 1, 'C': 0, 'X': "0%"},
+            self.group5: {'E': 1, 'P': 0, 'C': 0, 'X': "0%"},
+        })
+        # Contacts are counted once for each of their cohorts.
+        self.assertEqual(response.context['overall_counts'], {'E': 2, 'P': 2, 'C': 2, 'X': "33%"})
+
+    def test_participation_by_panel(self):
+        response = self.url_get('unicef', self.url, {'group-by': 'region'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['per_group_counts'], {
+            self.region1: {'E': 1, 'P': 0, 'C': 1, 'X': "50%"},
+            self.region2: {'E': 0, 'P': 1, 'C': 0, 'X': "0%"},
+        })
+        self.assertEqual(response.context['overall_counts'], {'E': 1, 'P': 1, 'C': 1, 'X': "33%"})
+        self.assertEqual(response.context['all_participants_count'], 3)
+
+        # Parent panels can include the responses of their sub-panels.
+        response = self.url_get('unicef', self.url, {'group-by': 'region', 'rollup': '1'})
+        self.assertTrue(response.context['rollup_subregions'])
+        self.assertEqual(response.context['per_group_counts'], {
+            self.region1: {'E': 1, 'P': 1, 'C': 1, 'X': "33%"},
+            self.region2: {'E': 0, 'P': 1, 'C': 0, 'X': "0%"},
+        })
+        self.assertEqual(response.context['overall_counts'], {'E': 1, 'P': 1, 'C': 1, 'X': "33%"})
+
+    def test_participation_queries(self):
+        # The number of queries doesn't depend on the number of panels.
+        self.url_get('unicef', self.url, {'group-by': 'region'})
+        with CaptureQueriesContext(connection) as queries:
+            self.url_get('unicef', self.url, {'group-by': 'region'})
+        for i in range(5):
+            factories.Response(
+                pollrun=self.pollrun, contact__org=self.unicef,
+                contact__region=factories.Region(org=self.unicef, parent=self.region3))
+        with self.assertNumQueries(len(queries)):
+            self.url_get('unicef', self.url, {'group-by': 'region'})
+
+    def test_list(self):
+        url = reverse('polls.pollrun_list')
+        response = self.url_get('unicef', url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['view'].get_participants(self.pollrun), 3)
+        self.assertEqual(response.context['view'].get_responses(self.pollrun), "1 (1)")
+
+        # Responses are counted once for the whole page.
+        with CaptureQueriesContext(connection) as queries:
+            self.url_get('unicef', url)
+        for days in range(1, 4):
+            pollrun = factories.UniversalPollRun(
+                poll=self.poll1, conducted_on=self.pollrun.conducted_on - datetime.timedelta(days=days))
+            factories.Response(pollrun=pollrun, contact=self.contact1)
+        with self.assertNumQueries(len(queries)):
+            self.url_get('unicef', url)
+
+    def test_latest(self):
+        url = reverse('polls.pollrun_latest')
+        response = self.url_get('unicef', url)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['results'][0]['responses'], {'E': 1, 'P': 1, 'C': 1})
+
 
 class ResponseCRUDLTest(TracProDataTest):
 
@@ -1,12 +1,20 @@
 from __future__ import unicode_literals
 
+from collections import Counter
 from decimal import InvalidOperation
+from itertools import chain
+import math
 import re
 
 import numpy
 import pycountry
 import stop_words
 
+from tracpro.utils import bump_cache_version, get_cache_version
+
+
+CHART_DATA_VERSION_KEY = 'org:%d:chart_data_version'
+
 
 def extract_words(text, language):
     """
@@ -26,6 +34,40 @@ def extract_words(text, language):
     return [w for w in words if w not in ignore_words and len(w) > 1]
 
 
+def count_words(answers):
+    """Return the 50 most common words of the (text, language) answers, with their counts."""
+    words = [extract_words(*a) for a in answers]
+    counts = Counter(chain(*words))
+    return counts.most_common(50)
+
+
+def histogram_bin_edges(count, minimum, maximum):
+    """
+    Return the bin edges that `numpy.histogram(values, bins='sqrt')` would
+    use for `count` values ranging from `minimum` to `maximum`, so that
+    values can be binned without fetching them all.
+    """
+    first, last = float(minimum), float(maximum)
+    width = (last - first) / numpy.sqrt(count)
+    if first == last:
+        first -= 0.5
+        last += 0.5
+    bins = int(numpy.ceil((last - first) / width)) if width else 1
+    return numpy.linspace(first, last, bins + 1, endpoint=True)
+
+
+def histogram_categories(hist, bin_edges):
+    """Name the bins of a histogram, in the format returned by `Answer.objects.autocategorize`."""
+    category_names = [
+        "%r-%r" % (round(bin_edges[i], 2), round(bin_edges[i+1], 2))
+        for i in range(len(hist))
+    ]
+    return {
+        'categories': category_names,
+        'data': list(hist),
+    }
+
+
 def _convert(text):
     """If text is numeric, convert to an integer. Otherwise, force lowercase."""
     return int(text) if text.isdigit() else text.lower()
@@ -38,6 +80,15 @@ def natural_sort_key(text):
     return [_convert(t) for t in alphanumeric_parts if t]
 
 
+def get_numeric_value(value):
+    """Return the value parsed as a finite float, or None."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+    return number if numpy.isfinite(number) else None
+
+
 def get_numeric_values(values):
     """Return all values that can be parsed as a float."""
     numeric = []
@@ -49,8 +100,34 @@ def get_numeric_values(values):
     return numeric
 
 
+def summarize_totals(answer_count, numeric_count, numeric_sum, numeric_sum_squares):
+    """
+    Return the totals of answers in the form of `AnswerQuerySet.numeric_totals`,
+    from the count, sum and sum of squares of their numeric values.
+    """
+    totals = {
+        'answer_count': answer_count,
+        'numeric_sum': None,
+        'numeric_avg': None,
+        'numeric_stdev': None,
+    }
+    if numeric_count:
+        totals['numeric_sum'] = numeric_sum
+        totals['numeric_avg'] = numeric_sum / numeric_count
+        variance = numeric_sum_squares / numeric_count - totals['numeric_avg'] ** 2
+        totals['numeric_stdev'] = math.sqrt(max(variance, 0))
+    return totals
+
+
 def summarize_by_pollrun(answers, responses):
-    answer_values = answers.group_values('response__pollrun_id')
+    """
+    Return the sums, averages, standard deviations and response rates of the
+    answers by pollrun id.
+
+    `answers` may be answers or answer rollups; either way the totals are
+    computed by the database.
+    """
+    totals = answers.numeric_totals()
     response_counts = responses.group_counts('pollrun')
 
     answer_sums = {}
@@ -61,39 +138,36 @@ def summarize_by_pollrun(answers, responses):
     # Note: Each pollrun has response(s), even if it has no answer(s) -
     # so iterating over the response pollruns will cover all pollruns.
     for pollrun_id, response_count in response_counts.items():
-        values = answer_values.get(pollrun_id, [])
         (answer_sums[pollrun_id],
          answer_avgs[pollrun_id],
          answer_stdevs[pollrun_id],
-         response_rates[pollrun_id]) = _summarize(values, response_count)
+         response_rates[pollrun_id]) = _summarize(totals.get(pollrun_id), response_count)
 
     return answer_sums, answer_avgs, answer_stdevs, response_rates
 
 
 def summarize_by_region_and_pollrun(answers, responses):
-    answer_values = answers.group_values(
-        'response__contact__region_id', 'response__pollrun_id')
+    totals = answers.numeric_totals(by_region=True)
     response_counts = responses.group_counts(
         'contact__region', 'pollrun')
 
     data = {}
     for (region_id, pollrun_id), response_count in response_counts.items():
         data.setdefault(region_id, ({}, {}, {}, {}))
-        values = answer_values.get((region_id, pollrun_id), [])
         (data[region_id][0][pollrun_id],
          data[region_id][1][pollrun_id],
          data[region_id][2][pollrun_id],
-         data[region_id][3][pollrun_id]) = _summarize(values, response_count)
+         data[region_id][3][pollrun_id]) = _summarize(totals.get((region_id, pollrun_id)), response_count)
     return data
 
 
-def _summarize(values, response_count):
-    numeric_values = get_numeric_values(values)
+def _summarize(totals, response_count):
+    totals = totals or {}
 
-    answer_sum = round(numpy.sum(numeric_values), 1)
-    answer_avg = round(numpy.mean(numeric_values) if numeric_values else 0, 1)
-    answer_stdev = round(numpy.std(numeric_values) if numeric_values else 0, 1)
-    response_rate = round(100.0 * len(values) / response_count, 1)
+    answer_sum = round(totals.get('numeric_sum') or 0, 1)
+    answer_avg = round(totals.get('numeric_avg') or 0, 1)
+    answer_stdev = round(totals.get('numeric_stdev') or 0, 1)
+    response_rate = round(100.0 * totals.get('answer_count', 0) / response_count, 1)
 
     return answer_sum, answer_avg, answer_stdev, response_rate
 
@@ -108,3 +182,13 @@ def overall_stdev(pollruns, data, default=0, round_to=1):
     """Return the standard deviation of data values for each pollrun."""
     padded_data = [data.get(pollrun.pk, default) for pollrun in pollruns]
     return round(numpy.std(padded_data), round_to)
+
+
+def get_chart_data_version(org_id):
+    """Return the current version of the org's cached chart data."""
+    return get_cache_version(CHART_DATA_VERSION_KEY % org_id)
+
+
+def bump_chart_data_version(org_id):
+    """Invalidate all of the org's cached chart data."""
+    bump_cache_version(CHART_DATA_VERSION_KEY % org_id)
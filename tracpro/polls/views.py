@@ -11,8 +11,9 @@ from django.conf import settings
 from django.contrib import messages
 from django.core.urlresolvers import reverse
 from django.http import (
-    HttpResponse, HttpResponseBadRequest, JsonResponse)
+    Http404, HttpResponse, HttpResponseBadRequest, JsonResponse)
 from django.shortcuts import get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 
 from smartmin import views as smartmin
@@ -22,13 +23,13 @@ from tracpro.contacts.models import Contact
 from tracpro.groups.models import Group, Region
 from tracpro.polls.tasks import FetchOrgRuns
 
-from . import charts, forms, maps, tasks
+from . import charts, forms, tasks
 from .models import Poll, Question, PollRun, Response
 
 
 class PollCRUDL(smartmin.SmartCRUDL):
     model = Poll
-    actions = ('read', 'update', 'list', 'select')
+    actions = ('read', 'question_chart', 'update', 'list', 'select')
 
     class PollMixin(object):
 
@@ -36,17 +37,11 @@ class PollCRUDL(smartmin.SmartCRUDL):
             """Only allow viewing active polls for the current org."""
             return Poll.objects.active().by_org(self.request.org)
 
-    class Read(PollMixin, OrgObjPermsMixin, smartmin.SmartReadView):
+    class PollChartsMixin(object):
+        """Charts the data of the poll's questions for the filter form."""
 
-        def get(self, request, *args, **kwargs):
-            self.object = self.get_object()
-            self.filter_form = forms.PollChartFilterForm(
-                org=self.object.org, data=request.GET)
-            return self.render_to_response(self.get_context_data(
-                object=self.object,
-                form=self.filter_form,
-                question_data=self.get_question_data(),
-            ))
+        def get_filter_form(self):
+            return forms.PollChartFilterForm(org=self.object.org, data=self.request.GET)
 
         def get_pollruns(self):
             """The x-axis of each chart shows the PollRun date."""
@@ -77,14 +72,14 @@ class PollCRUDL(smartmin.SmartCRUDL):
             contacts = self.filter_form.filter_contacts(contacts)
 
             if self.request.region:
-                contacts = contacts.filter(region__in=self.request.data_regions)
+                contacts = contacts.filter(region__in=self.request.data_region_ids)
 
             responses = Response.objects.active()
             responses = responses.filter(contact__in=contacts)
             responses = responses.filter(pollrun__in=pollruns)
             return responses
 
-        def get_question_data(self):
+        def get_question_data(self, questions):
             # Do not display any data if invalid data was submitted.
             if not self.filter_form.is_valid():
                 return None
@@ -98,19 +93,65 @@ class PollCRUDL(smartmin.SmartCRUDL):
                 if fieldname.startswith('contact'):
                     contact_filters[fieldname] = self.filter_form.cleaned_data[fieldname]
 
-            data = []
-            for question in self.object.questions.active():
-                chart_type, chart_data, summary_table = charts.multiple_pollruns(
-                    pollruns, responses, question, split_regions, contact_filters)
-                map_data = maps.get_map_data(responses, question)
-                data.append((
-                    question,
-                    chart_type,
-                    chart_data,
-                    map_data,
-                    summary_table,
-                ))
-            return data
+            poll_charts = charts.PollCharts(
+                questions, responses, contact_filters, cache_scope=self.get_cache_scope())
+            return poll_charts.multiple_pollruns(pollruns, split_regions)
+
+        def get_cache_scope(self):
+            """The chart data also depends on the region being viewed."""
+            region = self.request.region
+            return [region.pk if region else None, self.request.include_subregions]
+
+    class Read(PollMixin, PollChartsMixin, OrgObjPermsMixin, smartmin.SmartReadView):
+        """
+        Renders a panel for each question, whose data is then loaded from
+        QuestionChart as the panel is scrolled into view.
+        """
+
+        def get(self, request, *args, **kwargs):
+            self.object = self.get_object()
+            self.filter_form = self.get_filter_form()
+            # Do not display any questions if invalid data was submitted.
+            questions = self.object.questions.active() if self.filter_form.is_valid() else None
+            return self.render_to_response(self.get_context_data(
+                object=self.object,
+                form=self.filter_form,
+                questions=questions,
+            ))
+
+    class QuestionChart(PollMixin, PollChartsMixin, OrgObjPermsMixin, smartmin.SmartReadView):
+        """The chart, map and summary data of one question of the poll, as JSON."""
+        permission = 'polls.poll_read'
+
+        @classmethod
+        def derive_url_pattern(cls, path, action):
+            return r'^%s/%s/(?P<pk>\d+)/(?P<question>\d+)/$' % (path, action)
+
+        def get(self, request, *args, **kwargs):
+            self.object = self.get_object()
+            self.filter_form = self.get_filter_form()
+            questions = self.object.questions.active().filter(pk=self.kwargs['question'])
+            question_data = self.get_question_data(questions)
+            if question_data is None:
+                return JsonResponse({'errors': self.filter_form.errors}, status=400)
+            if not question_data:
+                raise Http404("No active question matches the given query.")
+
+            question, chart_type, chart_data, map_data, summary_table = question_data[0]
+            html = render_to_string('polls/question_chart.html', {
+                'question': question,
+                'chart_type': chart_type,
+                'chart_data': chart_data,
+                'map_data': map_data,
+                'summary_table': summary_table,
+            }, request=request)
+            return JsonResponse({
+                'chart_type': chart_type,
+                'chart_data': chart_data,
+                'map_data': map_data,
+                'summary_table': summary_table,
+                'html': html,
+            })
 
     class Update(PollMixin, OrgObjPermsMixin, smartmin.SmartUpdateView):
         form_class = forms.PollForm
@@ -157,20 +198,18 @@ class PollCRUDL(smartmin.SmartCRUDL):
         link_fields = ('name', 'pollruns')
         default_order = ('name',)
 
-        def derive_pollruns(self, obj):
-            return obj.pollruns.active().by_region(
-                self.request.region,
-                self.request.include_subregions)
+        def get_queryset(self):
+            polls = super(PollCRUDL.List, self).get_queryset()
+            return polls.with_counts(self.request.region, self.request.include_subregions)
 
         def get_questions(self, obj):
-            return obj.questions.active().count()
+            return obj.question_count
 
         def get_pollruns(self, obj):
-            return self.derive_pollruns(obj).count()
+            return obj.pollrun_count
 
         def get_last_conducted(self, obj):
-            last_pollrun = self.derive_pollruns(obj).order_by('-conducted_on').first()
-            return last_pollrun.conducted_on if last_pollrun else _("Never")
+            return obj.last_conducted or _("Never")
 
         def lookup_field_link(self, context, field, obj):
             if field == 'pollruns':
@@ -202,6 +241,14 @@ class PollCRUDL(smartmin.SmartCRUDL):
 class PollRunListMixin(object):
     default_order = ('-conducted_on',)
 
+    def get_context_data(self, **kwargs):
+        context = super(PollRunListMixin, self).get_context_data(**kwargs)
+        # Count the responses of the whole page at once. This evaluates the
+        # page's queryset, so the pollruns with counts are the ones rendered.
+        PollRun.objects.set_response_counts(
+            context['object_list'], self.request.region, self.request.include_subregions)
+        return context
+
     def get_conducted_on(self, obj):
         return obj.conducted_on.strftime(settings.SITE_DATE_FORMAT)
 
@@ -299,18 +346,13 @@ class PollRunCRUDL(smartmin.SmartCRUDL):
 
             if filter_form.is_valid():
                 responses = self.get_responses(filter_form, self.object)
-                question_data = []
-                for question in self.object.poll.questions.active():
-                    chart_type, chart_data, summary_table = charts.single_pollrun(
-                        self.object, responses, question)
-                    map_data = maps.get_map_data(responses, question)
-                    question_data.append((
-                        question,
-                        chart_type,
-                        chart_data,
-                        map_data,
-                        summary_table,
-                    ))
+                contact_filters = {
+                    name: filter_form.cleaned_data[name] for name, _ in filter_form.contact_fields}
+                region = self.request.region
+                poll_charts = charts.PollCharts(
+                    self.object.poll.questions.active(), responses, contact_filters,
+                    cache_scope=[region.pk if region else None, self.request.include_subregions])
+                question_data = poll_charts.single_pollrun(self.object)
             else:
                 question_data = None
 
@@ -324,7 +366,7 @@ class PollRunCRUDL(smartmin.SmartCRUDL):
             contacts = filter_form.filter_contacts(contacts)
 
             if self.request.region:
-                contacts = contacts.filter(region__in=self.request.data_regions)
+                contacts = contacts.filter(region__in=self.request.data_region_ids)
             responses = Response.objects.active()
             responses = responses.filter(pollrun=pollrun)
             responses = responses.filter(contact__in=contacts)
@@ -347,12 +389,21 @@ class PollRunCRUDL(smartmin.SmartCRUDL):
             if group_by == "reporter":
                 group_by_reporter_group = True
                 groups_or_regions = Group.get_all(self.request.org).order_by('name')
+                status_counts = responses.status_counts('contact__groups')
             else:
                 group_by_reporter_group = False
                 if self.request.data_regions:
                     groups_or_regions = self.request.data_regions
                 else:
                     groups_or_regions = Region.objects.filter(org=self.request.org)
+                status_counts = responses.status_counts('contact__region')
+            groups_or_regions = list(groups_or_regions)
+
+            # Parent panels may show the totals of their sub-panels.
+            rollup_subregions = (
+                not group_by_reporter_group and
+                self.request.include_subregions and
+                self.request.GET.get('rollup') == '1')
 
             # initialize an ordered dict of group to response counts
             # response statuses:
@@ -360,22 +411,17 @@ class PollRunCRUDL(smartmin.SmartCRUDL):
             per_group_counts = OrderedDict()
             overall_counts = {'E': 0, 'P': 0, 'C': 0}
 
-            # Calculate all reporter group or region activity per group or region
-
+            # Calculate all reporter group or region activity per group or region,
+            # from the counts of each status in each group or region.
             for group_or_region in groups_or_regions:
-                if group_by_reporter_group:
-                    responses_group = responses.filter(contact__groups=group_or_region)
-                else:
-                    responses_group = responses.filter(contact__region=group_or_region)
-                if responses_group:
-                    per_group_counts[group_or_region] = {
-                        "E": responses_group.filter(status=Response.STATUS_EMPTY).count(),
-                        "P": responses_group.filter(status=Response.STATUS_PARTIAL).count(),
-                        "C": responses_group.filter(status=Response.STATUS_COMPLETE).count()
-                    }
-                    overall_counts['E'] = overall_counts['E'] + per_group_counts[group_or_region]['E']
-                    overall_counts['P'] = overall_counts['P'] + per_group_counts[group_or_region]['P']
-                    overall_counts['C'] = overall_counts['C'] + per_group_counts[group_or_region]['C']
+                counts = status_counts.get(group_or_region.pk)
+                if counts:
+                    per_group_counts[group_or_region] = dict(counts)
+                    for status in overall_counts:
+                        overall_counts[status] += counts[status]
+
+            if rollup_subregions:
+                per_group_counts = self.rollup_region_counts(groups_or_regions, status_counts)
 
             # Note: we used to figure out participation data for contacts with no
             # group or region - but there cannot be any data from such contacts, since
@@ -408,8 +454,25 @@ class PollRunCRUDL(smartmin.SmartCRUDL):
             ))
             context['complete_count'] = overall_counts['C']
             context['group_by_reporter_group'] = group_by_reporter_group
+            context['rollup_subregions'] = rollup_subregions
             return context
 
+        def rollup_region_counts(self, regions, status_counts):
+            """
+            Map each of the regions to the response counts of its subtree of
+            the regions, omitting regions with no responses in their subtree.
+            """
+            per_region_counts = OrderedDict()
+            for region in regions:
+                counts = {'E': 0, 'P': 0, 'C': 0}
+                for subregion in regions:
+                    if region.is_ancestor_of(subregion, include_self=True):
+                        for status, count in status_counts.get(subregion.pk, {}).items():
+                            counts[status] += count
+                if any(counts.values()):
+                    per_region_counts[region] = counts
+            return per_region_counts
+
     class List(OrgPermsMixin, PollRunListMixin, smartmin.SmartListView):
         """
         All pollruns in current region
@@ -465,8 +528,10 @@ class PollRunCRUDL(smartmin.SmartCRUDL):
             return qs
 
         def render_to_response(self, context, **response_kwargs):
+            pollruns = PollRun.objects.set_response_counts(
+                context['object_list'], self.request.region, self.request.include_subregions)
             results = [i.as_json(self.request.region, self.request.include_subregions)
-                       for i in context['object_list']]
+                       for i in pollruns]
             return JsonResponse({'count': len(results), 'results': results})
 
 
@@ -102,7 +102,7 @@ def _user_has_region_access(user, region):
     if user.is_superuser or user.is_admin_for(region.org):
         return True
     else:
-        pks = region.get_ancestors(include_self=True).values_list('pk')
+        pks = Region.objects.get_tree(region.org_id).get_ancestor_ids(region.pk, include_self=True)
         return user.regions.filter(pk__in=pks).exists()
 
 
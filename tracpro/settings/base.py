@@ -248,6 +248,10 @@ CELERY_TIMEZONE = 'UTC'
 
 ORG_TASK_TIMEOUT = datetime.timedelta(minutes=30)
 
+# Fetch each poll's runs in a separate task, rather than all of an org's polls
+# in a single task.
+FETCH_RUNS_FAN_OUT = False
+
 
 def _org_scheduler_task(task_name):
     return {
@@ -205,6 +205,38 @@ jQuery.fn.extend({
             });
         });
     },
+    /* Load each question's chart from its URL, once it is scrolled into view. */
+    load_question_chart: function() {
+        var load = function(container) {
+            $.getJSON(container.data('url'), function(data) {
+                container.html(data.html);
+                container.find('.chart-open-ended').chart_open_ended();
+                container.find('.chart-numeric').chart_numeric();
+                container.find('.chart-multiple-choice').chart_multiple_choice();
+                container.find('.chart-bar').chart_bar();
+                container.find('.map').init_maps();
+            }).fail(function() {
+                container.find('.chart-loading').text("Unable to load the data for this question.");
+            });
+        };
+        if (!window.IntersectionObserver) {
+            $(this).each(function(i, item) {
+                load($(item));
+            });
+            return;
+        }
+        var observer = new IntersectionObserver(function(entries) {
+            $.each(entries, function(i, entry) {
+                if (entry.isIntersecting) {
+                    observer.unobserve(entry.target);
+                    load($(entry.target));
+                }
+            });
+        }, {rootMargin: '200px'});  // Start loading just before it's visible.
+        $(this).each(function(i, item) {
+            observer.observe(item);
+        });
+    },
 });
 
 $(function() {
@@ -219,4 +251,5 @@ $(function() {
     $('.chart-multiple-choice').chart_multiple_choice();
     $('.chart-bar').chart_bar();
     $('.chart-baseline').chart_baseline();
+    $('.question-chart').load_question_chart();
 });
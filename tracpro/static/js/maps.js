@@ -123,47 +123,66 @@ $(function() {
     }
   });
 
-  /* Retrieve boundary data from the server, and create the map. */
-  $.getJSON("/boundary/", function(data) {
-    var allBoundaries = data['results'];
-
-    $('.map').each(function() {
-      var mapDiv = $(this);
-      var mapData = mapDiv.data('map-data');  // boundary id -> {'category': 'foo', ...}
-      var mapColors = getColors(mapDiv.data('all-categories'));  // category -> display color
-
-      var boundaries = [];
-      $.each(allBoundaries, function(boundaryId, boundaryData) {
-        var data = mapData[boundaryId] || null;
-        var fillColor = data ? mapColors[data.category] : "#c2aa7e";
-
-        // Deep-copy the basic boundary info and augment with map-specific data.
-        var info = $.extend(true, {data: data}, boundaryData);
-        var boundary = new Boundary(info);
-        boundary.setStyle({fillColor: fillColor});
-        boundaries.push(boundary);
-      });
+  /* Retrieve boundary data from the server, once for all maps. */
+  var boundariesRequest = null;
+  var getBoundaries = function() {
+    if (!boundariesRequest) {
+      boundariesRequest = $.getJSON("/boundary/");
+    }
+    return boundariesRequest;
+  };
+
+  /* Create a map of the boundaries, colored by the map's data. */
+  var createMap = function(mapDiv, allBoundaries) {
+    var mapData = mapDiv.data('map-data');  // boundary id -> {'category': 'foo', ...}
+    var mapColors = getColors(mapDiv.data('all-categories'));  // category -> display color
+
+    var boundaries = [];
+    $.each(allBoundaries, function(boundaryId, boundaryData) {
+      var data = mapData[boundaryId] || null;
+      var fillColor = data ? mapColors[data.category] : "#c2aa7e";
+
+      // Deep-copy the basic boundary info and augment with map-specific data.
+      var info = $.extend(true, {data: data}, boundaryData);
+      var boundary = new Boundary(info);
+      boundary.setStyle({fillColor: fillColor});
+      boundaries.push(boundary);
+    });
 
-      var map = L.map(this, {
-        attributionControl: false,
-        fullscreenControl: {
-          position: "topright"
-        },
-        scrollWheelZoom: false,
-        maxBoundsViscosity: 1  // prevent scrolling out of bounds
-      });
+    var map = L.map(mapDiv[0], {
+      attributionControl: false,
+      fullscreenControl: {
+        position: "topright"
+      },
+      scrollWheelZoom: false,
+      maxBoundsViscosity: 1  // prevent scrolling out of bounds
+    });
 
-      map.infoBox = new InfoBox();
-      map.addControl(map.infoBox);
+    map.infoBox = new InfoBox();
+    map.addControl(map.infoBox);
 
-      map.legend = new Legend();
-      map.addControl(map.legend);
+    map.legend = new Legend();
+    map.addControl(map.legend);
 
-      map.boundaries = L.featureGroup(boundaries);
-      map.addControl(map.boundaries);
-      map.setMaxBounds(map.boundaries.getBounds());
+    map.boundaries = L.featureGroup(boundaries);
+    map.addControl(map.boundaries);
+    map.setMaxBounds(map.boundaries.getBounds());
 
-      mapDiv.data('map', map);
-    });
+    mapDiv.data('map', map);
+  };
+
+  jQuery.fn.extend({
+    init_maps: function() {
+      var mapDivs = $(this);
+      if (mapDivs.length) {
+        getBoundaries().done(function(data) {
+          mapDivs.each(function() {
+            createMap($(this), data['results']);
+          });
+        });
+      }
+    }
   });
+
+  $('.map').init_maps();
 });
@@ -4,13 +4,14 @@ import datetime
 
 import factory
 import factory.fuzzy
+import pytz
 
 from temba_client.v2 import types
 
 from .factory_utils import FuzzyUUID
 
 
-__all__ = ['TembaFlow', 'TembaBoundary', 'TembaExport']
+__all__ = ['TembaFlow', 'TembaBoundary', 'TembaExport', 'TembaObjectRef', 'TembaRun', 'TembaRunValue']
 
 
 class TembaObjectFactory(factory.Factory):
@@ -64,3 +65,35 @@ class TembaExport(TembaObjectFactory):
 
     class Meta:
         model = types.Export
+
+
+class TembaObjectRef(TembaObjectFactory):
+    uuid = FuzzyUUID()
+    name = factory.fuzzy.FuzzyText()
+
+    class Meta:
+        model = types.ObjectRef
+
+
+class TembaRunValue(TembaObjectFactory):
+    node = FuzzyUUID()
+    value = factory.fuzzy.FuzzyText()
+    category = factory.fuzzy.FuzzyText()
+    time = factory.LazyAttribute(lambda o: datetime.datetime.now(pytz.utc))
+
+    class Meta:
+        model = types.Run.Value
+
+
+class TembaRun(TembaObjectFactory):
+    id = factory.Sequence(lambda n: n)
+    flow = factory.SubFactory(TembaObjectRef)
+    contact = factory.SubFactory(TembaObjectRef)
+    responded = True
+    values = {}
+    exit_type = 'completed'
+    created_on = factory.LazyAttribute(lambda o: datetime.datetime.now(pytz.utc))
+    modified_on = factory.LazyAttribute(lambda o: o.created_on)
+
+    class Meta:
+        model = types.Run
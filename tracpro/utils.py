@@ -1,4 +1,14 @@
+import threading
+import time
+
+import djcelery_transactions.transaction_signals  # noqa: adds transaction.signals
+
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+
+_pending = threading.local()
 
 
 def get_uuids(things):
@@ -23,3 +33,96 @@ def dunder_to_chained_attrs(value, key):
     first_key, rest_of_keys = key.split('__', 1)
     first_val = getattr(value, first_key)
     return dunder_to_chained_attrs(first_val, rest_of_keys)
+
+
+def bulk_update(model, objs, fields, batch_size=1000):
+    """
+    Save the given fields of already-saved model instances, using a single
+    UPDATE ... FROM (VALUES ...) query per batch.
+
+    Returns the number of rows updated.
+    """
+    objs = list(objs)
+    if not objs:
+        return 0
+
+    meta = model._meta
+    fields = [meta.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    casts = ["%s::integer"] + ["%%s::%s" % field.db_type(connection) for field in fields]
+    row = "(%s)" % ", ".join(casts)
+    columns = ", ".join(quote(field.column) for field in fields)
+    assignments = ", ".join("{col} = v.{col}".format(col=quote(field.column)) for field in fields)
+
+    updated = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start:start + batch_size]
+            params = []
+            for obj in batch:
+                params.append(obj.pk)
+                params.extend(field.get_db_prep_save(getattr(obj, field.attname), connection)
+                              for field in fields)
+            sql = ("UPDATE {table} SET {assignments} "
+                   "FROM (VALUES {rows}) AS v({pk}, {columns}) "
+                   "WHERE {table}.{pk} = v.{pk}").format(
+                table=quote(meta.db_table),
+                assignments=assignments,
+                rows=", ".join([row] * len(batch)),
+                pk=quote(meta.pk.column),
+                columns=columns,
+            )
+            cursor.execute(sql, params)
+            updated += cursor.rowcount
+    return updated
+
+
+def get_cache_version(key):
+    """
+    Return the current value of a cache version key. Anything cached under
+    the version is invalidated when it is bumped.
+    """
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time, so that values cached under a
+        # version which has since been evicted are never reused.
+        version = int(time.time() * 1000)
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_cache_version(key):
+    """Invalidate anything cached under the current value of a cache version key."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # There is no version yet, so nothing has been cached under it.
+        pass
+
+
+def call_after_transaction(func, *args):
+    """
+    Call the function once the outermost transaction has ended, whether it
+    was committed or rolled back, or now if there is no transaction.
+
+    A call which is already pending is not repeated.
+    """
+    if not connection.in_atomic_block:
+        func(*args)
+        return
+    calls = _pending.__dict__.setdefault('calls', [])
+    if (func, args) not in calls:
+        calls.append((func, args))
+
+
+def _call_pending(**kwargs):
+    if connection.in_atomic_block:
+        return
+    calls = _pending.__dict__.pop('calls', [])
+    for func, args in calls:
+        func(*args)
+
+
+transaction.signals.post_commit.connect(_call_pending)
+transaction.signals.post_rollback.connect(_call_pending)